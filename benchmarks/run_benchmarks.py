@@ -0,0 +1,289 @@
+"""
+This script benchmarks the hot paths of humipy against the development
+database: measurement ingestion, the measurement and sensor location queries,
+the rendering of the measurements table and the application startup.
+
+The benchmarks run against an in-memory and a file-backed SQLite development
+database (the engines returned by connect.get_engine(dev=True)), both seeded
+with a synthetic dataset of the requested sizes. The results are
+written to a JSON file. Pass the results of an earlier run with --compare to
+report regressions.
+
+Usage:
+
+python benchmarks/run_benchmarks.py --sizes 10000 100000 --output results.json
+"""
+
+
+import argparse
+from datetime import datetime, timedelta
+import humipy
+from humipy.database import connect, read, write
+from humipy.database.health import get_sensor_health
+from humipy.database.seed import SENSORS
+from humipy.views.measurements import get_measurements_table
+import io
+import json
+import os
+import pandas as pd
+import platform
+from rich.console import Console
+import sqlalchemy
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Optional
+
+
+def get_command_line_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000],
+        help="numbers of synthetic measurements",
+    )
+    parser.add_argument(
+        "--backends", nargs="+", choices=["memory", "file"],
+        default=["memory", "file"],
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--locations", type=int, default=3)
+    parser.add_argument("--sensors", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument(
+        "--compare", default=None,
+        help="results of an earlier run to compare against",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=1.2,
+        help="slowdown ratio reported as a regression",
+    )
+    return parser.parse_args()
+
+
+def time_call(func: Callable, repeat: int) -> dict:
+    """
+    This function times repeated calls of a function.
+
+    Args:
+        func (Callable): the function to call without arguments.
+        repeat (int): the number of calls.
+
+    Returns:
+        dict: the number of runs and the minimum, median, mean and maximum
+            duration in seconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return {
+        "runs": repeat,
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "mean": statistics.mean(durations),
+        "max": max(durations),
+    }
+
+
+def get_benchmark_engine(
+        backend: str,
+        directory: str,
+        size: int,
+        args: argparse.Namespace) -> sqlalchemy.engine.base.Engine:
+    """
+    This function returns a development engine for a backend, populated with
+    a synthetic dataset with one measurement every ten seconds on average.
+
+    Args:
+        backend (str): either 'memory' or 'file'.
+        directory (str): the directory of the file-backed database.
+        size (int): the number of synthetic measurements.
+        args (argparse.Namespace): the command line arguments.
+
+    Returns:
+        sqlalchemy.engine.base.Engine: a SQLAlchemy engine object.
+    """
+    dev_database = None
+    if backend == "file":
+        dev_database = os.path.join(directory, f"humipy_{size}.db")
+    return connect.get_engine(
+        dev=True,
+        dev_database=dev_database,
+        seed_options={
+            "n_locations": args.locations,
+            "n_sensors": args.sensors,
+            "n_measurements": size,
+            "span": timedelta(seconds=10 * size),
+            "seed": args.seed,
+        },
+    )
+
+
+def run_startup_benchmark(repeat: int) -> dict:
+    """
+    This function times starting a new interpreter that parses the command
+    line of humipy.
+
+    Args:
+        repeat (int): the number of runs.
+
+    Returns:
+        dict: the timing statistics.
+    """
+    return time_call(
+        lambda: subprocess.run(
+            [sys.executable, "-m", "humipy", "--help"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        ),
+        repeat,
+    )
+
+
+def run_benchmarks(
+        engine: sqlalchemy.engine.base.Engine,
+        repeat: int) -> dict:
+    """
+    This function times the hot paths against a populated database.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        repeat (int): the number of runs per benchmark.
+
+    Returns:
+        dict: the timing statistics per benchmark.
+    """
+    sensor = SENSORS[0]
+    console = Console(file=io.StringIO(), width=200)
+    readings = [(sensor, 60., None)] * 500
+    # Timestamped readings are only written on the first run, so that the
+    # other runs time a gateway resending a batch that was written already
+    start = datetime.now()
+    timestamped_readings = [
+        (sensor, 60., start + timedelta(seconds=i)) for i in range(500)
+    ]
+    return {
+        "push_measurement": time_call(
+            lambda: write.push_measurement(engine, sensor, 60.), repeat
+        ),
+        "push_measurements_500": time_call(
+            lambda: write.push_measurements(engine, readings), repeat
+        ),
+        "push_measurements_500_resent": time_call(
+            lambda: write.push_measurements(engine, timestamped_readings),
+            repeat,
+        ),
+        "get_recent_measurements_25": time_call(
+            lambda: read.get_recent_measurements(engine, 25), repeat
+        ),
+        "fetch_latest_per_location": time_call(
+            lambda: read.fetch_latest_per_location(engine), repeat
+        ),
+        "get_sensor_health": time_call(
+            lambda: get_sensor_health(engine), repeat
+        ),
+        "get_open_sensor_locations": time_call(
+            lambda: read.get_open_sensor_locations(engine), repeat
+        ),
+        "render_measurements_table_25": time_call(
+            lambda: console.print(get_measurements_table(engine, 25)), repeat
+        ),
+    }
+
+
+def compare(results: list[dict], path: str, threshold: float) -> list[str]:
+    """
+    This function compares the median durations with those of an earlier
+    run.
+
+    Args:
+        results (list[dict]): the results of this run.
+        path (str): the path to the results of the earlier run.
+        threshold (float): the slowdown ratio reported as a regression.
+
+    Returns:
+        list[str]: a description of every regression.
+    """
+    with open(path) as f:
+        baseline = {
+            (r["backend"], r["size"], r["benchmark"]): r
+            for r in json.load(f)["results"]
+        }
+    regressions = []
+    for result in results:
+        key = (result["backend"], result["size"], result["benchmark"])
+        if key not in baseline:
+            continue
+        ratio = result["median"] / baseline[key]["median"]
+        if ratio > threshold:
+            regressions.append(
+                f"{'/'.join(map(str, key))}: {ratio:.2f}x slower"
+            )
+    return regressions
+
+
+def main(args: Optional[argparse.Namespace] = None) -> None:
+    args = get_command_line_arguments() if args is None else args
+    results = [
+        {
+            "backend": None,
+            "size": None,
+            "benchmark": "startup",
+            **run_startup_benchmark(max(1, args.repeat // 4)),
+        }
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in args.backends:
+            for size in sorted(args.sizes):
+                start = time.perf_counter()
+                engine = get_benchmark_engine(backend, directory, size, args)
+                print(
+                    f"{backend}: populated {size} measurements in "
+                    f"{time.perf_counter() - start:.1f}s"
+                )
+                for name, stats in run_benchmarks(engine, args.repeat).items():
+                    results.append(
+                        {
+                            "backend": backend,
+                            "size": size,
+                            "benchmark": name,
+                            **stats,
+                        }
+                    )
+                    print(
+                        f"  {name:<32} median {stats['median'] * 1e3:9.3f} ms"
+                    )
+                engine.dispose()
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "meta": {
+                    "humipy": humipy.__version__,
+                    "python": platform.python_version(),
+                    "sqlalchemy": sqlalchemy.__version__,
+                    "pandas": pd.__version__,
+                    "platform": platform.platform(),
+                    "created": datetime.now().isoformat(),
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 CREATE TABLE IF NOT EXISTS sensors (
     sensor_id SMALLSERIAL PRIMARY KEY,
-    sensor_serial_number VARCHAR(20) UNIQUE,
+    sensor_serial_number VARCHAR(20) UNIQUE NOT NULL,
     sensor_type VARCHAR(20)
 );
 
@@ -24,5 +24,87 @@ CREATE TABLE IF NOT EXISTS humidity_measurements (
     sensor_location_id INT NOT NULL,
     humidity REAL NULL,
     measurement_time TIMESTAMP NOT NULL,
+    temperature REAL NULL,
+    pressure REAL NULL,
     CONSTRAINT fk_sensor_location FOREIGN KEY (sensor_location_id) REFERENCES sensor_locations(sensor_location_id)
-);
\ No newline at end of file
+);
+
+ALTER TABLE humidity_measurements ADD COLUMN IF NOT EXISTS temperature REAL NULL;
+
+ALTER TABLE humidity_measurements ADD COLUMN IF NOT EXISTS pressure REAL NULL;
+
+CREATE TABLE IF NOT EXISTS hourly_humidity_rollups (
+    sensor_location_id INT NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    measurement_count INT NOT NULL,
+    humidity_sum DOUBLE PRECISION NOT NULL,
+    humidity_min REAL NULL,
+    humidity_max REAL NULL,
+    PRIMARY KEY (sensor_location_id, bucket_start),
+    CONSTRAINT fk_sensor_location FOREIGN KEY (sensor_location_id) REFERENCES sensor_locations(sensor_location_id)
+);
+
+CREATE TABLE IF NOT EXISTS daily_humidity_rollups (
+    sensor_location_id INT NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    measurement_count INT NOT NULL,
+    humidity_sum DOUBLE PRECISION NOT NULL,
+    humidity_min REAL NULL,
+    humidity_max REAL NULL,
+    PRIMARY KEY (sensor_location_id, bucket_start),
+    CONSTRAINT fk_sensor_location FOREIGN KEY (sensor_location_id) REFERENCES sensor_locations(sensor_location_id)
+);
+
+CREATE TABLE IF NOT EXISTS latest_readings (
+    sensor_location_id INT PRIMARY KEY,
+    humidity REAL NULL,
+    measurement_time TIMESTAMP NOT NULL,
+    CONSTRAINT fk_sensor_location FOREIGN KEY (sensor_location_id) REFERENCES sensor_locations(sensor_location_id)
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_sensor_locations_open ON sensor_locations (sensor_id) WHERE stop_placement IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_humidity_measurements_time ON humidity_measurements (measurement_time);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_humidity_measurements_sensor_location_time ON humidity_measurements (sensor_location_id, measurement_time);
+
+CREATE TABLE IF NOT EXISTS outdoor_weather (
+    latitude DOUBLE PRECISION NOT NULL,
+    longitude DOUBLE PRECISION NOT NULL,
+    weather_parameter VARCHAR(50) NOT NULL,
+    measurement_time TIMESTAMP NOT NULL,
+    value REAL NULL,
+    PRIMARY KEY (latitude, longitude, weather_parameter, measurement_time)
+);
+
+CREATE INDEX IF NOT EXISTS ix_outdoor_weather_time ON outdoor_weather (measurement_time);
+
+CREATE TABLE IF NOT EXISTS weather_backfill_chunks (
+    chunk_key TEXT PRIMARY KEY,
+    chunk_start TIMESTAMP NOT NULL,
+    chunk_end TIMESTAMP NOT NULL,
+    row_count INT NOT NULL,
+    completed_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sensor_statistics (
+    sensor_location_id INT PRIMARY KEY,
+    measurement_count INT NOT NULL,
+    humidity_ewma DOUBLE PRECISION NOT NULL,
+    humidity_ewm_variance DOUBLE PRECISION NOT NULL,
+    last_measurement_time TIMESTAMP NOT NULL,
+    CONSTRAINT fk_sensor_location FOREIGN KEY (sensor_location_id) REFERENCES sensor_locations(sensor_location_id)
+);
+
+CREATE TABLE IF NOT EXISTS humidity_anomalies (
+    humidity_anomaly_id SERIAL PRIMARY KEY,
+    sensor_location_id INT NOT NULL,
+    measurement_time TIMESTAMP NOT NULL,
+    humidity REAL NULL,
+    anomaly_type VARCHAR(20) NOT NULL,
+    baseline REAL NULL,
+    deviation REAL NULL,
+    CONSTRAINT fk_sensor_location FOREIGN KEY (sensor_location_id) REFERENCES sensor_locations(sensor_location_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_humidity_anomalies_time ON humidity_anomalies (measurement_time);
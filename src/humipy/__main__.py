@@ -1,17 +1,571 @@
 import argparse
-from humipy.cli import render_app
+from datetime import datetime, timedelta
+import math
+import os
+import sys
+from typing import Optional
 
 
-def get_command_line_arguments() -> argparse.ArgumentParser:
+# Only the standard library is imported at module level. Every command
+# imports the modules it needs, so that lightweight commands (e.g., those
+# called from cron jobs and sensor gateway scripts) do not load pandas, NumPy
+# or Rich.
+
+
+def get_command_line_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument("--dev", action="store_true")
+    parser.add_argument(
+        "--dev-database", default=None,
+        help="path of a file-backed test database (reused if it exists)",
+    )
+    parser.add_argument("--dev-locations", type=positive_int, default=3)
+    parser.add_argument("--dev-sensors", type=positive_int, default=2)
+    parser.add_argument(
+        "--dev-measurements", type=non_negative_int, default=1000,
+    )
+    parser.add_argument(
+        "--dev-span-days", type=float, default=1.,
+        help="time span of the test measurements in days",
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="print query and function latency percentiles on exit",
+    )
+    parser.add_argument(
+        "--profile-json", default=None,
+        help="write the profiling report to a JSON file on exit",
+    )
+    parser.add_argument(
+        "--profile-sample-rate", type=float, default=1.,
+        help="fraction of the calls and statements that is timed",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("version", help="print the version")
+
+    latest_parser = subparsers.add_parser(
+        "latest",
+        help="print the latest measurement at a location, or in every room",
+    )
+    latest_parser.add_argument("location", nargs="?", default=None)
+
+    anomalies_parser = subparsers.add_parser(
+        "anomalies", help="print the most recent humidity spikes and faults",
+    )
+    anomalies_parser.add_argument("--limit", type=int, default=20)
+
+    health_parser = subparsers.add_parser(
+        "health", help="report gaps, uptime and rate drift of the sensors",
+    )
+    health_parser.add_argument(
+        "--days", type=float, default=None,
+        help="report the last N days (defaults to the whole history)",
+    )
+    health_parser.add_argument("--gap-minutes", type=float, default=15.)
+    health_parser.add_argument(
+        "--recent-hours", type=float, default=24.,
+        help="period of which the reporting rate is compared to before",
+    )
+    health_parser.add_argument(
+        "--method", choices=["auto", "sql", "chunked"], default="auto",
+    )
+    health_parser.add_argument(
+        "--all", action="store_true", help="include closed placements",
+    )
+
+    push_parser = subparsers.add_parser(
+        "push", help="push a humidity measurement",
+    )
+    push_parser.add_argument("serial_number")
+    push_parser.add_argument("value", type=finite_float)
+    push_parser.add_argument("--temperature", type=finite_float, default=None)
+    push_parser.add_argument("--pressure", type=finite_float, default=None)
+    push_parser.add_argument(
+        "--time", type=datetime.fromisoformat, default=None,
+        help="the time the sensor took the measurement (ISO 8601)",
+    )
+    push_parser.add_argument(
+        "--spool", default=None,
+        help="spool directory for when the database is unreachable",
+    )
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="run the network ingestion server",
+    )
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=8300)
+    serve_parser.add_argument("--udp-port", type=int, default=None)
+    serve_parser.add_argument("--no-tcp", action="store_true")
+    serve_parser.add_argument("--batch-size", type=int, default=500)
+    serve_parser.add_argument("--flush-interval", type=float, default=1.)
+    serve_parser.add_argument("--max-queue", type=int, default=10000)
+    serve_parser.add_argument("--stats-interval", type=float, default=60.)
+    add_spool_arguments(serve_parser)
+    serve_parser.add_argument("--replay-interval", type=float, default=10.)
+    serve_parser.add_argument(
+        "--replay-rate", type=float, default=None,
+        help="maximum spooled measurements replayed per second",
+    )
+
+    spool_parser = subparsers.add_parser(
+        "spool", help="inspect or replay a measurement spool",
+    )
+    spool_subparsers = spool_parser.add_subparsers(
+        dest="spool_command", required=True,
+    )
+    spool_status_parser = spool_subparsers.add_parser(
+        "status", help="print the size of the spool",
+    )
+    spool_status_parser.add_argument("directory")
+    spool_replay_parser = spool_subparsers.add_parser(
+        "replay", help="write the spooled measurements to the database",
+    )
+    spool_replay_parser.add_argument("directory")
+    spool_replay_parser.add_argument("--batch-size", type=int, default=500)
+    spool_replay_parser.add_argument(
+        "--rate", type=float, default=None,
+        help="maximum measurements replayed per second",
+    )
+
+    db_parser = subparsers.add_parser("db", help="manage the database schema")
+    db_subparsers = db_parser.add_subparsers(dest="db_command", required=True)
+    db_subparsers.add_parser(
+        "upgrade", help="create missing tables, indexes and constraints",
+    )
+    partition_parser = db_subparsers.add_parser(
+        "partition",
+        help="partition the measurements by month (PostgreSQL only)",
+    )
+    partition_parser.add_argument("--months-ahead", type=int, default=3)
+    maintain_parser = db_subparsers.add_parser(
+        "maintain", help="create the monthly partitions of the coming months",
+    )
+    maintain_parser.add_argument("--months-ahead", type=int, default=3)
+    retention_parser = db_subparsers.add_parser(
+        "retention", help="remove raw measurements older than N months",
+    )
+    retention_parser.add_argument("--months", type=int, required=True)
+    retention_parser.add_argument(
+        "--archive", default=None,
+        help="directory to archive the removed measurements to",
+    )
+
+    export_parser = subparsers.add_parser(
+        "export", help="export new measurements to partitioned files",
+    )
+    export_parser.add_argument("directory")
+    export_parser.add_argument(
+        "--format", choices=["parquet", "csv"], default=None,
+    )
+    export_parser.add_argument("--chunksize", type=int, default=100000)
+    export_parser.add_argument("--full", action="store_true")
+
+    manifest_parser = subparsers.add_parser(
+        "import-manifest",
+        help="register locations, sensors and placements from a manifest",
+    )
+    manifest_parser.add_argument(
+        "file", help="a YAML, JSON or CSV manifest file",
+    )
+
+    weather_parser = subparsers.add_parser(
+        "weather", help="manage the outdoor weather history",
+    )
+    weather_subparsers = weather_parser.add_subparsers(
+        dest="weather_command", required=True,
+    )
+    backfill_parser = weather_subparsers.add_parser(
+        "backfill", help="fetch the outdoor weather of a time range",
+    )
+    backfill_parser.add_argument(
+        "--from", dest="start", required=True,
+        help="start of the time range (ISO 8601)",
+    )
+    backfill_parser.add_argument(
+        "--to", dest="end", default=None,
+        help="end of the time range, exclusive (ISO 8601, defaults to now)",
+    )
+    backfill_parser.add_argument(
+        "--location", action="append", default=None,
+        help="latitude,longitude (repeatable, defaults to Ghent)",
+    )
+    backfill_parser.add_argument(
+        "--parameter", action="append", default=None,
+        help="meteomatics parameter (repeatable)",
+    )
+    backfill_parser.add_argument("--chunk-days", type=float, default=7.)
+    backfill_parser.add_argument("--step-minutes", type=int, default=60)
+    backfill_parser.add_argument("--workers", type=int, default=4)
+    backfill_parser.add_argument(
+        "--rate", type=float, default=5., help="maximum requests per second",
+    )
+    backfill_parser.add_argument(
+        "--cache-directory", default=None,
+        help="directory of the on-disk response cache",
+    )
     return parser.parse_args()
 
 
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {value}")
+    return number
+
+
+def non_negative_int(value: str) -> int:
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"cannot be negative: {value}")
+    return number
+
+
+def finite_float(value: str) -> float:
+    number = float(value)
+    if not math.isfinite(number):
+        raise argparse.ArgumentTypeError(f"must be finite: {value}")
+    return number
+
+
+def format_humidity(value: Optional[float]) -> str:
+    # The humidity column is nullable
+    return "-" if value is None else f"{value:.1f}"
+
+
+def add_spool_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--spool", default=None,
+        help="spool directory for when the database is unreachable",
+    )
+    parser.add_argument(
+        "--spool-fsync", choices=["always", "interval", "never"],
+        default="always",
+    )
+    parser.add_argument("--spool-segment-mb", type=float, default=8.)
+    parser.add_argument("--spool-max-mb", type=float, default=256.)
+
+
 def main() -> None:
     args = get_command_line_arguments()
-    render_app(args.dev)
+    if not (args.profile or args.profile_json):
+        run_command(args)
+        return
+
+    from humipy import profiling
+
+    profiling.enable(args.profile_sample_rate)
+    try:
+        run_command(args)
+    finally:
+        if args.profile:
+            profiling.print_report(file=sys.stderr)
+        if args.profile_json:
+            profiling.dump_report(args.profile_json)
+
+
+def run_command(args: argparse.Namespace) -> None:
+    if args.command == "version":
+        from humipy import __version__
+
+        print(__version__)
+    elif args.command == "latest":
+        run_latest(args)
+    elif args.command == "anomalies":
+        run_anomalies(args)
+    elif args.command == "health":
+        run_health(args)
+    elif args.command == "push":
+        run_push(args)
+    elif args.command == "serve":
+        run_server(args)
+    elif args.command == "spool":
+        run_spool_command(args)
+    elif args.command == "db":
+        run_db_command(args)
+    elif args.command == "export":
+        run_export(args)
+    elif args.command == "import-manifest":
+        run_import_manifest(args)
+    elif args.command == "weather":
+        run_weather_command(args)
+    else:
+        from humipy.cli import render_app
+
+        render_app(args.dev, engine=get_engine(args))
+
+
+def get_engine(args: argparse.Namespace, profile: Optional[str] = None):
+    from humipy.database import connect
+
+    return connect.get_engine(
+        args.dev,
+        dev_database=args.dev_database,
+        profile=profile,
+        seed_options={
+            "n_locations": args.dev_locations,
+            "n_sensors": args.dev_sensors,
+            "n_measurements": args.dev_measurements,
+            "span": timedelta(days=args.dev_span_days),
+        },
+    )
+
+
+def run_latest(args: argparse.Namespace) -> None:
+    from humipy.database.read import (
+        fetch_latest_measurement,
+        fetch_latest_per_location,
+    )
+
+    if args.location is None:
+        for row in fetch_latest_per_location(get_engine(args)):
+            if row.measurement_time is not None:
+                print(
+                    f"{row.measurement_time:%Y-%m-%d %H:%M:%S} "
+                    f"{row.location_name} {row.sensor_serial_number} "
+                    f"{format_humidity(row.humidity)}"
+                )
+        return
+    row = fetch_latest_measurement(get_engine(args), args.location)
+    if row is None:
+        print(f"No measurements at {args.location}.", file=sys.stderr)
+        sys.exit(1)
+    print(
+        f"{row.measurement_time:%Y-%m-%d %H:%M:%S} {row.location_name} "
+        f"{row.sensor_serial_number} {format_humidity(row.humidity)}"
+    )
+
+
+def run_anomalies(args: argparse.Namespace) -> None:
+    from humipy.database.read import fetch_recent_anomalies
+
+    for row in fetch_recent_anomalies(get_engine(args), args.limit):
+        line = (
+            f"{row.measurement_time:%Y-%m-%d %H:%M:%S} {row.location_name} "
+            f"{row.sensor_serial_number} {format_humidity(row.humidity)} "
+            f"{row.anomaly_type}"
+        )
+        if row.deviation is not None:
+            line += (
+                f" (baseline {row.baseline:.1f}, {row.deviation:+.1f} sigma)"
+            )
+        print(line)
+
+
+def run_health(args: argparse.Namespace) -> None:
+    from humipy.database.health import format_duration, get_sensor_health
+    import math
+
+    report = get_sensor_health(
+        get_engine(args, profile="export"),
+        start=(
+            None if args.days is None
+            else datetime.now() - timedelta(days=args.days)
+        ),
+        gap_threshold=timedelta(minutes=args.gap_minutes),
+        recent=timedelta(hours=args.recent_hours),
+        method=args.method,
+    )
+    if not args.all:
+        report = report[report["is_open"]]
+    for row in report.itertuples():
+        drift = (
+            "-" if math.isnan(row.rate_drift_pct)
+            else f"{row.rate_drift_pct:+.0f}%"
+        )
+        print(
+            f"{row.location_name} {row.sensor_serial_number} "
+            f"silent {format_duration(row.silent_seconds)}, "
+            f"gaps {row.gap_count} (longest "
+            f"{format_duration(row.longest_gap_seconds)}), "
+            f"uptime {row.uptime_pct:.1f}%, rate drift {drift}"
+        )
+
+
+def run_push(args: argparse.Namespace) -> None:
+    from humipy.database.write import push_measurement
+    import sqlalchemy
+
+    engine = get_engine(args)
+    try:
+        push_measurement(
+            engine,
+            args.serial_number,
+            args.value,
+            temperature=args.temperature,
+            pressure=args.pressure,
+            measurement_time=args.time,
+        )
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        from humipy.spool import Spool, is_unreachable
+
+        if args.spool is None or not is_unreachable(e):
+            raise
+        reading = (
+            args.serial_number, args.value, args.time, args.temperature,
+            args.pressure,
+        )
+        if not Spool(args.spool).append([reading]):
+            print("The spool is full.", file=sys.stderr)
+            sys.exit(1)
+        print(
+            "The database is unreachable, the measurement was spooled.",
+            file=sys.stderr,
+        )
+
+
+def run_server(args: argparse.Namespace) -> None:
+    import logging
+    from humipy.server import serve
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s",
+    )
+    spool = None
+    if args.spool is not None:
+        from humipy.spool import Spool
+
+        spool = Spool(
+            args.spool,
+            segment_bytes=int(args.spool_segment_mb * 1024 ** 2),
+            max_bytes=int(args.spool_max_mb * 1024 ** 2),
+            fsync=args.spool_fsync,
+        )
+    serve(
+        get_engine(args, profile="ingestion"),
+        host=args.host,
+        port=None if args.no_tcp else args.port,
+        udp_port=args.udp_port,
+        batch_size=args.batch_size,
+        flush_interval=args.flush_interval,
+        max_queue=args.max_queue,
+        stats_interval=args.stats_interval,
+        spool=spool,
+        replay_interval=args.replay_interval,
+        replay_rate=args.replay_rate,
+    )
+
+
+def run_spool_command(args: argparse.Namespace) -> None:
+    from humipy.spool import Spool
+
+    if not os.path.isdir(args.directory):
+        print(f"No spool at {args.directory}.", file=sys.stderr)
+        sys.exit(1)
+    spool = Spool(args.directory)
+    if args.spool_command == "status":
+        print(f"{spool.pending_bytes} bytes pending")
+    elif args.spool_command == "replay":
+        summary = spool.replay(
+            get_engine(args), batch_size=args.batch_size, max_rate=args.rate,
+        )
+        print(
+            f"Replayed {summary['replayed']} measurements from "
+            f"{summary['segments']} segments ({summary['written']} written, "
+            f"{summary['quarantined']} quarantined, of which "
+            f"{summary['corrupt']} corrupt lines)."
+        )
+
+
+def run_db_command(args: argparse.Namespace) -> None:
+    from humipy.database import partitions, schema
+
+    engine = get_engine(args)
+    if args.db_command == "upgrade":
+        applied = schema.upgrade(engine)
+    elif args.db_command == "partition":
+        try:
+            applied = partitions.partition_measurements(
+                engine, args.months_ahead
+            )
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+    elif args.db_command == "maintain":
+        applied = partitions.ensure_partitions(engine, args.months_ahead)
+    elif args.db_command == "retention":
+        applied = partitions.apply_retention(
+            engine, args.months, archive_directory=args.archive
+        )
+    for change in applied:
+        print(change)
+    if not applied:
+        print("The database is up to date.")
+
+
+def run_export(args: argparse.Namespace) -> None:
+    from humipy.export import export_measurements
+
+    summary = export_measurements(
+        get_engine(args, profile="export"),
+        args.directory,
+        file_format=args.format,
+        chunksize=args.chunksize,
+        full=args.full,
+    )
+    print(
+        f"Exported {summary['exported']} measurements to "
+        f"{len(summary['files'])} files (high-water mark "
+        f"{summary['high_water_mark']})."
+    )
+
+
+def run_import_manifest(args: argparse.Namespace) -> None:
+    from humipy.manifest import import_manifest
+
+    try:
+        summary = import_manifest(get_engine(args), args.file)
+    except (ImportError, OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    for kind, result in summary.items():
+        print(
+            f"{kind.capitalize()}: {len(result['created'])} created, "
+            f"{len(result['skipped'])} skipped"
+        )
+        for item in result["skipped"]:
+            if isinstance(item, tuple):
+                item = " at ".join(reversed(item))
+            print(f"  skipped {item}")
+
+
+def run_weather_command(args: argparse.Namespace) -> None:
+    from dateutil.parser import isoparse
+    from humipy.meteomatics import MeteomaticsClient
+    from humipy.weather import (
+        DEFAULT_LOCATION,
+        WEATHER_PARAMETERS,
+        backfill_weather,
+    )
+
+    if args.weather_command == "backfill":
+        engine = get_engine(args, profile="export")
+        with MeteomaticsClient(
+                cache_directory=args.cache_directory,
+                max_connections=args.workers) as client:
+            summary = backfill_weather(
+                engine,
+                isoparse(args.start),
+                datetime.now() if args.end is None else isoparse(args.end),
+                client=client,
+                weather_params=args.parameter or WEATHER_PARAMETERS,
+                locations=args.location or [DEFAULT_LOCATION],
+                chunk=timedelta(days=args.chunk_days),
+                step=timedelta(minutes=args.step_minutes),
+                max_workers=args.workers,
+                rate=args.rate,
+            )
+        print(
+            f"Fetched {summary['fetched']} of {summary['chunks']} chunks "
+            f"({summary['skipped']} completed before, {summary['failed']} "
+            f"failed), inserted {summary['inserted']} rows."
+        )
+        if summary["failed"]:
+            sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -6,19 +6,32 @@ from humipy.views.locations import (
     render_locations_table,
     render_location_addition,
 )
-from humipy.views.sensors import render_sensors_table, render_sensor_addition
+from humipy.views.sensors import (
+    render_sensor_addition,
+    render_sensor_health_table,
+    render_sensors_table,
+)
 from humipy.views.menus import render_main_menu, render_database_menu
 from humipy.views.sensor_locations import (
     render_open_sensor_locations_table,
     render_start_placement,
 )
-from humipy.views.measurements import render_measurements_view
+from humipy.views.measurements import (
+    render_current_humidity_table,
+    render_measurements_view,
+)
 from humipy.views.exit import render_app_exit
+import sqlalchemy
+from typing import Optional
 
 
-def render_app(dev: bool, menu_option: str = "m") -> None:
-    # Initialize a SQLAlchemy engine
-    engine = connect.get_engine(dev)
+def render_app(
+        dev: bool,
+        menu_option: str = "m",
+        engine: Optional[sqlalchemy.engine.base.Engine] = None) -> None:
+    # Initialize a SQLAlchemy engine, unless the caller already did
+    if engine is None:
+        engine = connect.get_engine(dev)
     # Render the different menu options
     while menu_option != "q":
         if menu_option == "m":
@@ -33,10 +46,14 @@ def render_app(dev: bool, menu_option: str = "m") -> None:
             menu_option = render_location_addition(engine)
         elif menu_option == "w":
             menu_option = render_sensor_addition(engine)
+        elif menu_option == "h":
+            menu_option = render_sensor_health_table(engine)
         elif menu_option == "o":
             menu_option = render_open_sensor_locations_table(engine)
         elif menu_option == "b":
             menu_option = render_start_placement(engine)
+        elif menu_option == "c":
+            menu_option = render_current_humidity_table(engine)
         elif menu_option == "e":
             menu_option = render_measurements_view(engine, 25, dev)
 
@@ -0,0 +1,502 @@
+"""
+This module offers async variants of the read and write functions, built on
+SQLAlchemy's AsyncEngine, so that they can be used from asyncio services
+without blocking the event loop. PostgreSQL is accessed with asyncpg and the
+test database with aiosqlite (see the 'async' extra).
+
+The queries and write steps are shared with humipy.database.read and
+humipy.database.write through humipy.database.statements, and the engine
+settings with humipy.database.connect, so the write path keeps using the
+sensor location cache, the rollups and the latest readings of the
+synchronous API. The fan_out helper runs an async function for many items
+with bounded concurrency, e.g., to serve many sensor gateways from one
+service.
+"""
+
+
+import asyncio
+from datetime import datetime
+from dotenv import load_dotenv
+from humipy.database.cache import invalidate_sensor_location_cache
+from humipy.database.connect import get_database_url, get_engine_arguments
+from humipy.database.models import (
+    humidity_measurements_table,
+    locations_table,
+    metadata,
+    sensor_locations_table,
+    sensors_table,
+)
+from humipy.database.statements import (
+    get_latest_readings_query,
+    get_measurement_rows,
+    get_measurements_rows_query,
+    get_measurements_since_query,
+    get_missing_placement_message,
+    get_open_sensor_locations,
+    get_sensor_locations_rows_query,
+    insert_ignore,
+    insert_measurements,
+)
+import sqlalchemy
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import StaticPool
+from typing import Awaitable, Callable, Iterable, Optional, TypeVar
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+async def get_async_engine(
+        dev: bool = False,
+        dev_database: Optional[str] = None,
+        seed_options: Optional[dict] = None,
+        profile: Optional[str] = None) -> AsyncEngine:
+    """
+    This function initializes an async engine, configured like the engine of
+    humipy.database.connect.get_engine. A new test database is populated
+    with dummy data.
+
+    Args:
+        dev (bool, optional): indicator to indicate to use the test
+            environment or a production environment. Defaults to False.
+        dev_database (Optional[str], optional): the path of a file-backed
+            test database. If None, the test database is kept in memory. An
+            existing file that is already populated is reused as is. Defaults
+            to None.
+        seed_options (Optional[dict], optional): keyword arguments passed to
+            humipy.database.seed.seed_connection to populate the test
+            database. Defaults to None.
+        profile (Optional[str], optional): the pool profile. Defaults to None.
+
+    Returns:
+        AsyncEngine: a SQLAlchemy async engine object.
+    """
+    load_dotenv()
+    if dev:
+        if dev_database is None:
+            engine = create_async_engine(
+                "sqlite+aiosqlite:///:memory:", poolclass=StaticPool,
+            )
+        else:
+            # aiosqlite opens a connection per checkout (NullPool), which
+            # is cheap for a local file
+            engine = create_async_engine(f"sqlite+aiosqlite:///{dev_database}")
+        async with engine.begin() as conn:
+            seeded = await conn.run_sync(
+                lambda sync_conn: sqlalchemy.inspect(sync_conn).has_table(
+                    locations_table.name
+                )
+            ) and await conn.scalar(select(locations_table).limit(1))
+            if not seeded:
+                # NumPy is only needed to seed the test database
+                from humipy.database.seed import seed_connection
+
+                await conn.run_sync(metadata.create_all)
+                await conn.run_sync(seed_connection, **(seed_options or {}))
+        return engine
+
+    return create_async_engine(
+        get_database_url("asyncpg"),
+        **get_engine_arguments(profile, "asyncpg"),
+    )
+
+
+async def fan_out(
+        func: Callable[[T], Awaitable[R]],
+        items: Iterable[T],
+        concurrency: int = 10) -> list[R]:
+    """
+    This function awaits an async function for every item, with at most a
+    given number of calls running concurrently.
+
+    Args:
+        func (Callable[[T], Awaitable[R]]): the async function.
+        items (Iterable[T]): the items.
+        concurrency (int, optional): the maximum number of concurrent calls.
+            Defaults to 10.
+
+    Returns:
+        list[R]: the results, in the order of the items.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(item: T) -> R:
+        async with semaphore:
+            return await func(item)
+
+    return await asyncio.gather(*(call(item) for item in items))
+
+
+async def fetch_locations(engine: AsyncEngine) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves all locations as rows.
+
+    Args:
+        engine (AsyncEngine): a SQLAlchemy async engine object.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows with the location identifier and
+            name.
+    """
+    return await _fetch_all(
+        engine, select(locations_table).order_by(locations_table.c.location_id)
+    )
+
+
+async def fetch_sensors(engine: AsyncEngine) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves all sensors as rows.
+
+    Args:
+        engine (AsyncEngine): a SQLAlchemy async engine object.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows with the sensor identifier, serial
+            number and type.
+    """
+    return await _fetch_all(
+        engine, select(sensors_table).order_by(sensors_table.c.sensor_id)
+    )
+
+
+async def fetch_open_sensor_locations(
+        engine: AsyncEngine,
+        sensor_serial_number: Optional[str] = None
+        ) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves the open sensor locations as rows.
+
+    Args:
+        engine (AsyncEngine): a SQLAlchemy async engine object.
+        sensor_serial_number (Optional[str], optional): only the open sensor
+            location of this sensor is retrieved. Defaults to None.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows with the same columns as
+            humipy.database.read.fetch_open_sensor_locations.
+    """
+    stmt = (
+        get_sensor_locations_rows_query()
+        .where(sensor_locations_table.c.stop_placement == None)
+    )
+    if sensor_serial_number is not None:
+        stmt = stmt.where(
+            sensors_table.c.sensor_serial_number == sensor_serial_number
+        )
+    return await _fetch_all(engine, stmt)
+
+
+async def fetch_recent_measurements(
+        engine: AsyncEngine,
+        top_n: int) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves the n most recent humidity measurements as rows.
+
+    Args:
+        engine (AsyncEngine): a SQLAlchemy async engine object.
+        top_n (int): the n most recent measurements to retrieve.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows with the same columns as
+            humipy.database.read.fetch_recent_measurements.
+    """
+    return await _fetch_all(
+        engine,
+        get_measurements_rows_query()
+        .order_by(humidity_measurements_table.c.measurement_time.desc())
+        .limit(top_n),
+    )
+
+
+async def fetch_measurements_since(
+        engine: AsyncEngine,
+        measurement_time: Optional[datetime],
+        top_n: int) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves at most n of the most recent humidity
+    measurements taken at or after the given date and time as rows.
+
+    Args:
+        engine (AsyncEngine): a SQLAlchemy async engine object.
+        measurement_time (Optional[datetime]): only measurements taken at or
+            after this date and time are retrieved. If None, the n most
+            recent measurements are retrieved.
+        top_n (int): the maximum number of measurements to retrieve.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows with the same columns as
+            humipy.database.read.fetch_measurements_since.
+    """
+    return await _fetch_all(
+        engine, get_measurements_since_query(measurement_time, top_n)
+    )
+
+
+async def fetch_latest_measurement(
+        engine: AsyncEngine,
+        location_name: str) -> Optional[sqlalchemy.engine.Row]:
+    """
+    This function retrieves the most recent humidity measurement at a
+    location as a row.
+
+    Args:
+        engine (AsyncEngine): a SQLAlchemy async engine object.
+        location_name (str): the location name.
+
+    Returns:
+        Optional[sqlalchemy.engine.Row]: a row with the same columns as
+            fetch_recent_measurements, or None if there are no measurements
+            at the location.
+    """
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            get_measurements_rows_query()
+            .where(locations_table.c.location_name == location_name)
+            .order_by(humidity_measurements_table.c.measurement_time.desc())
+            .limit(1)
+        )
+        return result.first()
+
+
+async def fetch_latest_per_location(
+        engine: AsyncEngine) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves the latest humidity measurement of every open
+    sensor location as rows.
+
+    Args:
+        engine (AsyncEngine): a SQLAlchemy async engine object.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows with the same columns as
+            humipy.database.read.fetch_latest_per_location.
+    """
+    return await _fetch_all(engine, get_latest_readings_query())
+
+
+async def add_location(engine: AsyncEngine, location_name: str) -> bool:
+    """
+    This function adds a location, unless it exists already.
+
+    Args:
+        engine (AsyncEngine): a SQLAlchemy async engine object.
+        location_name (str): location name.
+
+    Returns:
+        bool: True if the location was added.
+    """
+    async with engine.begin() as conn:
+        created = await conn.run_sync(
+            insert_ignore,
+            locations_table,
+            locations_table.c.location_name,
+            [{"location_name": location_name}],
+        )
+    return bool(created)
+
+
+async def add_sensor(
+        engine: AsyncEngine,
+        sensor_serial_number: str,
+        sensor_type: Optional[str] = None) -> bool:
+    """
+    This function adds a sensor, unless it exists already.
+
+    Args:
+        engine (AsyncEngine): a SQLAlchemy async engine object.
+        sensor_serial_number (str): sensor serial number.
+        sensor_type (Optional[str], optional): the sensor type. Defaults to
+            None.
+
+    Returns:
+        bool: True if the sensor was added.
+    """
+    async with engine.begin() as conn:
+        created = await conn.run_sync(
+            insert_ignore,
+            sensors_table,
+            sensors_table.c.sensor_serial_number,
+            [
+                {
+                    "sensor_serial_number": sensor_serial_number,
+                    "sensor_type": sensor_type,
+                }
+            ],
+        )
+    return bool(created)
+
+
+async def start_sensor_placement(
+        engine: AsyncEngine,
+        location_name: str,
+        sensor_serial_number: str,
+        start_placement: Optional[datetime] = None) -> bool:
+    """
+    This function starts a sensor placement, unless the sensor already has an
+    open sensor location.
+
+    Args:
+        engine (AsyncEngine): a SQLAlchemy async engine object.
+        location_name (str): the location name.
+        sensor_serial_number (str): the sensor serial number.
+        start_placement (Optional[datetime], optional): the start date. If
+            None, the current date and time is used. Defaults to None.
+
+    Returns:
+        bool: True if the placement was started.
+    """
+    async with engine.begin() as conn:
+        if await conn.run_sync(
+                get_open_sensor_locations, [sensor_serial_number]):
+            return False
+        await conn.execute(
+            insert(sensor_locations_table).values(
+                sensor_id=(
+                    select(sensors_table.c.sensor_id)
+                    .where(
+                        sensors_table.c.sensor_serial_number
+                        == sensor_serial_number
+                    )
+                    .scalar_subquery()
+                ),
+                location_id=(
+                    select(locations_table.c.location_id)
+                    .where(locations_table.c.location_name == location_name)
+                    .scalar_subquery()
+                ),
+                start_placement=(
+                    datetime.now() if start_placement is None
+                    else start_placement
+                ),
+            )
+        )
+    invalidate_sensor_location_cache(engine.sync_engine, sensor_serial_number)
+    return True
+
+
+async def stop_sensor_placement(
+        engine: AsyncEngine,
+        location_name: str,
+        sensor_serial_number: str,
+        stop_placement: Optional[datetime] = None) -> None:
+    """
+    This function stops the open placement of a sensor at a location.
+
+    Args:
+        engine (AsyncEngine): a SQLAlchemy async engine object.
+        location_name (str): the location name.
+        sensor_serial_number (str): the sensor serial number.
+        stop_placement (Optional[datetime], optional): the stop date. If None,
+            the current date and time is used. Defaults to None.
+    """
+    sensor_locations = sensor_locations_table.c
+    async with engine.begin() as conn:
+        await conn.execute(
+            update(sensor_locations_table)
+            .where(
+                sensor_locations.stop_placement == None,
+                sensor_locations.sensor_id == (
+                    select(sensors_table.c.sensor_id)
+                    .where(
+                        sensors_table.c.sensor_serial_number
+                        == sensor_serial_number
+                    )
+                    .scalar_subquery()
+                ),
+                sensor_locations.location_id == (
+                    select(locations_table.c.location_id)
+                    .where(locations_table.c.location_name == location_name)
+                    .scalar_subquery()
+                ),
+            )
+            .values(
+                stop_placement=(
+                    datetime.now() if stop_placement is None
+                    else stop_placement
+                )
+            )
+        )
+    invalidate_sensor_location_cache(engine.sync_engine, sensor_serial_number)
+
+
+async def push_measurement(
+        engine: AsyncEngine,
+        sensor_serial_number: str,
+        measurement: float,
+        temperature: Optional[float] = None,
+        pressure: Optional[float] = None,
+        measurement_time: Optional[datetime] = None) -> bool:
+    """
+    This function pushes a humidity measurement, optionally with the
+    temperature and pressure of the same sample. A measurement that was
+    written already is skipped.
+
+    Args:
+        engine (AsyncEngine): a SQLAlchemy async engine object.
+        sensor_serial_number (str): the sensor serial number.
+        measurement (float): the humidity measurement.
+        temperature (Optional[float], optional): the temperature in degrees
+            Celsius. Defaults to None.
+        pressure (Optional[float], optional): the pressure in hPa. Defaults
+            to None.
+        measurement_time (Optional[datetime], optional): the time at which
+            the sensor took the measurement. If None, the current date and
+            time is used. Defaults to None.
+
+    Returns:
+        bool: True if the measurement was written, False if it was a
+            duplicate.
+    """
+    reading = (
+        sensor_serial_number, measurement, measurement_time, temperature,
+        pressure,
+    )
+    async with engine.begin() as conn:
+        rows = await conn.run_sync(
+            lambda sync_conn: get_measurement_rows(
+                engine.sync_engine, sync_conn, [reading]
+            )
+        )
+        if not rows:
+            raise ValueError(get_missing_placement_message(reading))
+        return bool(await conn.run_sync(insert_measurements, rows))
+
+
+async def push_measurements(
+        engine: AsyncEngine,
+        readings: Iterable[tuple]) -> int:
+    """
+    This function pushes a batch of humidity measurements in one transaction.
+    Readings from sensors that were not placed at their measurement time are
+    skipped, as are measurements that were written already.
+
+    Args:
+        engine (AsyncEngine): a SQLAlchemy async engine object.
+        readings (Iterable[tuple]): the readings as (sensor serial number,
+            humidity, measurement time) tuples, optionally followed by the
+            temperature and the pressure of the sample. If the measurement
+            time is None, the current date and time is used.
+
+    Returns:
+        int: the number of measurements written to the database.
+    """
+    readings = list(readings)
+    if not readings:
+        return 0
+    async with engine.begin() as conn:
+        rows = await conn.run_sync(
+            lambda sync_conn: get_measurement_rows(
+                engine.sync_engine, sync_conn, readings
+            )
+        )
+        return await conn.run_sync(insert_measurements, rows)
+
+
+async def _fetch_all(
+        engine: AsyncEngine,
+        stmt: sqlalchemy.sql.selectable.Select) -> list[sqlalchemy.engine.Row]:
+    async with engine.connect() as conn:
+        result = await conn.execute(stmt)
+        return list(result.all())
@@ -0,0 +1,323 @@
+"""
+This module keeps streaming statistics of the humidity of every sensor
+location and flags anomalous measurements as they are written, so that
+failing sensors and sudden humidity spikes (e.g., a leak or a shower left
+running) are caught without querying the measurement history.
+
+Every sensor location has a baseline: an exponentially weighted moving
+average (EWMA) of its humidity and the matching exponentially weighted
+variance, which are updated in constant time per measurement. A measurement
+that deviates more than a number of standard deviations from the baseline,
+once the baseline has seen enough measurements, is flagged as a spike.
+Measurements outside the physical range of relative humidity are flagged as
+out of range and do not update the baseline.
+
+The baselines are stored in the sensor_statistics table and the flagged
+measurements in the humidity_anomalies table, in the same transaction as the
+insert of the measurements, so that a restart does not lose the baselines.
+Large batches of measurements are processed with NumPy, which is only
+imported for them, so that single pushes from gateway scripts stay light.
+"""
+
+
+from __future__ import annotations
+from humipy.database.models import (
+    humidity_anomalies_table,
+    sensor_statistics_table,
+)
+import math
+import sqlalchemy
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from typing import TYPE_CHECKING, Iterable, Optional, Sequence, Union
+
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+# The weight of a new measurement in the baseline (the baseline roughly
+# follows the last 1 / ALPHA measurements)
+ALPHA = .05
+# The number of standard deviations from the baseline beyond which a
+# measurement is a spike
+THRESHOLD = 4.
+# The number of measurements a baseline needs before spikes are flagged
+WARMUP = 30
+# The lower bound of the standard deviation, as the DHT11 has a resolution of
+# one percent and a steady room would otherwise flag every change
+MIN_STD = 1.
+
+SPIKE = "spike"
+OUT_OF_RANGE = "out_of_range"
+
+
+_VECTORIZE_MIN = 64
+
+
+def update_statistics(
+        conn: sqlalchemy.engine.base.Connection,
+        measurements: Iterable[dict]) -> int:
+    """
+    This function folds measurements into the baselines of their sensor
+    locations and stores the anomalous measurements, without committing. The
+    baselines of the sensor locations involved are locked for the rest of
+    the transaction on PostgreSQL, so that concurrent batches do not lose
+    updates.
+
+    Args:
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+        measurements (Iterable[dict]): the measurements, each with a sensor
+            location identifier, humidity and measurement time.
+
+    Returns:
+        int: the number of anomalies.
+    """
+    measurements = sorted(
+        measurements,
+        key=lambda m: (m["sensor_location_id"], m["measurement_time"]),
+    )
+    if not measurements:
+        return 0
+    last_times = {}
+    for measurement in measurements:
+        # The measurements are sorted by time per sensor location
+        last_times[measurement["sensor_location_id"]] = (
+            measurement["measurement_time"]
+        )
+
+    statistics = sensor_statistics_table.c
+    stmt = select(sensor_statistics_table).where(
+        statistics.sensor_location_id.in_(sorted(last_times))
+    )
+    if conn.dialect.name == "postgresql":
+        stmt = stmt.with_for_update()
+    rows = conn.execute(stmt).all()
+    state = {
+        row.sensor_location_id: (
+            row.measurement_count,
+            row.humidity_ewma,
+            row.humidity_ewm_variance,
+        )
+        for row in rows
+    }
+    stored_times = {
+        row.sensor_location_id: row.last_measurement_time for row in rows
+    }
+    state, anomalies = compute_statistics(
+        [m["sensor_location_id"] for m in measurements],
+        [
+            math.nan if m["humidity"] is None else m["humidity"]
+            for m in measurements
+        ],
+        state,
+    )
+
+    statistics_rows = [
+        {
+            "sensor_location_id": sensor_location_id,
+            "measurement_count": state[sensor_location_id][0],
+            "humidity_ewma": state[sensor_location_id][1],
+            "humidity_ewm_variance": state[sensor_location_id][2],
+            "last_measurement_time": max(
+                last_time, stored_times.get(sensor_location_id, last_time)
+            ),
+        }
+        for sensor_location_id, last_time in sorted(last_times.items())
+        if sensor_location_id in state
+    ]
+    if statistics_rows:
+        upsert: Union[postgresql.Insert, sqlite.Insert]
+        if conn.dialect.name == "postgresql":
+            upsert = postgresql.insert(sensor_statistics_table)
+        else:
+            upsert = sqlite.insert(sensor_statistics_table)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[statistics.sensor_location_id],
+            set_={
+                column: upsert.excluded[column]
+                for column in (
+                    "measurement_count",
+                    "humidity_ewma",
+                    "humidity_ewm_variance",
+                    "last_measurement_time",
+                )
+            },
+        )
+        conn.execute(upsert, statistics_rows)
+
+    if anomalies:
+        conn.execute(
+            insert(humidity_anomalies_table),
+            [
+                {
+                    "sensor_location_id": measurements[i]["sensor_location_id"],
+                    "measurement_time": measurements[i]["measurement_time"],
+                    "humidity": measurements[i]["humidity"],
+                    "anomaly_type": anomaly_type,
+                    "baseline": baseline,
+                    "deviation": deviation,
+                }
+                for i, anomaly_type, baseline, deviation in anomalies
+            ],
+        )
+    return len(anomalies)
+
+
+def compute_statistics(
+        sensor_location_ids: Sequence[int],
+        humidity: Sequence[float],
+        state: dict[int, tuple[int, float, float]],
+        alpha: float = ALPHA,
+        threshold: float = THRESHOLD,
+        warmup: int = WARMUP
+        ) -> tuple[dict, list[tuple[int, str, Optional[float], Optional[float]]]]:
+    """
+    This function updates the baselines with a batch of measurements and
+    finds the anomalous measurements. The measurements of a sensor location
+    must be ordered by time. Batches of at least 64 measurements are
+    processed with NumPy.
+
+    Args:
+        sensor_location_ids (Sequence[int]): the sensor location identifiers.
+        humidity (Sequence[float]): the humidity measurements, with NaN for
+            missing values.
+        state (dict[int, tuple[int, float, float]]): the measurement count,
+            EWMA and exponentially weighted variance per sensor location.
+        alpha (float, optional): the weight of a new measurement. Defaults to
+            ALPHA.
+        threshold (float, optional): the number of standard deviations
+            beyond which a measurement is a spike. Defaults to THRESHOLD.
+        warmup (int, optional): the number of measurements a baseline needs
+            before spikes are flagged. Defaults to WARMUP.
+
+    Returns:
+        tuple[dict, list[tuple[int, str, Optional[float], Optional[float]]]]:
+            the updated state, and the index, type, baseline and deviation
+            (in standard deviations) of every anomaly, ordered by index. Out
+            of range measurements have no baseline and deviation.
+    """
+    if len(humidity) < _VECTORIZE_MIN:
+        return _compute_statistics_scalar(
+            sensor_location_ids, humidity, state, alpha, threshold, warmup
+        )
+    import numpy as np
+
+    state = dict(state)
+    location_ids = np.asarray(sensor_location_ids)
+    humidity_values = np.asarray(humidity, dtype=float)
+    order = np.argsort(location_ids, kind="stable")
+    unique_ids, starts = np.unique(location_ids[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    anomalies: list[tuple[int, str, Optional[float], Optional[float]]] = []
+    for sensor_location_id, start, end in zip(
+            unique_ids.tolist(), starts, ends):
+        group = order[start:end]
+        values = humidity_values[group]
+        valid = ~np.isnan(values)
+        out_of_range = valid & ((values < 0.) | (values > 100.))
+        used = valid & ~out_of_range
+        anomalies.extend(
+            (i, OUT_OF_RANGE, None, None)
+            for i in group[out_of_range].tolist()
+        )
+        values = values[used]
+        if not len(values):
+            continue
+
+        count, mean, variance = state.get(sensor_location_id, (0, 0., 0.))
+        if count == 0:
+            # The first measurement becomes the baseline
+            mean, variance = values[0], 0.
+        means, variances = _ewm(values, alpha, mean, variance)
+        deviations = (values - means[:-1]) / np.maximum(
+            np.sqrt(variances[:-1]), MIN_STD
+        )
+        spikes = np.flatnonzero(
+            (count + np.arange(len(values)) >= warmup)
+            & (np.abs(deviations) > threshold)
+        )
+        anomalies.extend(
+            zip(
+                group[used][spikes].tolist(),
+                [SPIKE] * len(spikes),
+                means[spikes].tolist(),
+                deviations[spikes].tolist(),
+            )
+        )
+        state[sensor_location_id] = (
+            count + len(values), float(means[-1]), float(variances[-1])
+        )
+    anomalies.sort(key=lambda anomaly: anomaly[0])
+    return state, anomalies
+
+
+def _compute_statistics_scalar(
+        sensor_location_ids: Sequence[int],
+        humidity: Sequence[float],
+        state: dict[int, tuple[int, float, float]],
+        alpha: float,
+        threshold: float,
+        warmup: int
+        ) -> tuple[dict, list[tuple[int, str, Optional[float], Optional[float]]]]:
+    """
+    This function computes the same results as compute_statistics, one
+    measurement at a time, which is faster for small batches.
+    """
+    state = dict(state)
+    anomalies: list[tuple[int, str, Optional[float], Optional[float]]] = []
+    for i, (sensor_location_id, value) in enumerate(
+            zip(sensor_location_ids, humidity)):
+        if math.isnan(value):
+            continue
+        if value < 0. or value > 100.:
+            anomalies.append((i, OUT_OF_RANGE, None, None))
+            continue
+        count, mean, variance = state.get(sensor_location_id, (0, 0., 0.))
+        if count == 0:
+            mean, variance = value, 0.
+        deviation = (value - mean) / max(math.sqrt(variance), MIN_STD)
+        if count >= warmup and abs(deviation) > threshold:
+            anomalies.append((i, SPIKE, mean, deviation))
+        variance = (1. - alpha) * (variance + alpha * (value - mean) ** 2)
+        mean += alpha * (value - mean)
+        state[sensor_location_id] = (count + 1, mean, variance)
+    return state, anomalies
+
+
+def _ewm(
+        values: np.ndarray,
+        alpha: float,
+        mean: float,
+        variance: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    This function computes the EWMA and exponentially weighted variance
+    after every value, vectorized. Both follow the linear recurrence
+    y[k] = (1 - alpha) * y[k - 1] + u[k], which is solved with a cumulative
+    sum of u[k] / (1 - alpha) ** k, in blocks short enough to keep the
+    weights finite.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the EWMA and variance before the first
+            value and after every value.
+    """
+    import numpy as np
+
+    decay = 1. - alpha
+    block = max(1, int(100. / -np.log10(decay)))
+    means = np.empty(len(values) + 1)
+    variances = np.empty(len(values) + 1)
+    means[0], variances[0] = mean, variance
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        weights = decay ** np.arange(1, len(chunk) + 1)
+        stop = start + len(chunk)
+        means[start + 1:stop + 1] = weights * (
+            means[start] + np.cumsum(alpha * chunk / weights)
+        )
+        # The variance is updated with the deviation from the previous EWMA
+        squared = decay * alpha * (chunk - means[start:stop]) ** 2
+        variances[start + 1:stop + 1] = weights * (
+            variances[start] + np.cumsum(squared / weights)
+        )
+    return means, variances
@@ -0,0 +1,168 @@
+"""
+This module implements an in-process lookup cache that maps sensor serial
+numbers to the identifiers of their open sensor locations. Sensor placements
+rarely change, so caching this lookup takes the read query off the ingestion
+path. The cache is bounded in size and entries expire after a time-to-live,
+so that multiple processes writing to the same database cannot drift apart
+for long after a placement change made elsewhere.
+"""
+
+
+from collections import OrderedDict
+import sqlalchemy
+import threading
+import time
+from typing import Hashable, Optional
+import weakref
+
+
+_DEFAULT_MAXSIZE = 4096
+_DEFAULT_TTL = 60.0
+
+
+class LookupCache:
+    """
+    A bounded least-recently-used cache whose entries expire after a fixed
+    time-to-live.
+
+    Args:
+        maxsize (int, optional): the maximum number of entries. Defaults to
+            4096.
+        ttl (float, optional): the time-to-live of an entry in seconds.
+            Defaults to 60 seconds.
+    """
+
+    def __init__(
+            self,
+            maxsize: int = _DEFAULT_MAXSIZE,
+            ttl: float = _DEFAULT_TTL) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key) is not None
+
+    def get(self, key: Hashable) -> Optional[tuple]:
+        """
+        This method returns the cached entry for a key.
+
+        Args:
+            key (Hashable): the key to look up.
+
+        Returns:
+            Optional[tuple]: a one-element tuple holding the cached value, or
+                None if the key is not cached or has expired. Wrapping the
+                value allows None to be cached as well.
+        """
+        return self._lookup(key)
+
+    def put(self, key: Hashable, value: object) -> None:
+        """
+        This method caches a value for a key, evicting the least recently
+        used entry if the cache is full.
+
+        Args:
+            key (Hashable): the key.
+            value (object): the value to cache.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """
+        This method removes a single entry, or all entries if no key is given.
+
+        Args:
+            key (Optional[Hashable], optional): the key to remove. Defaults to
+                None.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def _lookup(self, key: Hashable) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return (value,)
+
+
+_sensor_location_caches: weakref.WeakKeyDictionary[
+    sqlalchemy.engine.base.Engine, LookupCache
+] = weakref.WeakKeyDictionary()
+
+
+def get_sensor_location_cache(
+        engine: sqlalchemy.engine.base.Engine) -> LookupCache:
+    """
+    This function returns the sensor location cache of an engine. Every engine
+    gets its own cache, so that different databases never share entries.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+
+    Returns:
+        LookupCache: the cache mapping sensor serial numbers to open sensor
+            location identifiers.
+    """
+    cache = _sensor_location_caches.get(engine)
+    if cache is None:
+        cache = LookupCache()
+        _sensor_location_caches[engine] = cache
+    return cache
+
+
+def configure_sensor_location_cache(
+        engine: sqlalchemy.engine.base.Engine,
+        maxsize: int = _DEFAULT_MAXSIZE,
+        ttl: float = _DEFAULT_TTL) -> LookupCache:
+    """
+    This function replaces the sensor location cache of an engine with a new,
+    empty cache with the given size and time-to-live.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        maxsize (int, optional): the maximum number of entries. Defaults to
+            4096.
+        ttl (float, optional): the time-to-live of an entry in seconds.
+            Defaults to 60 seconds.
+
+    Returns:
+        LookupCache: the new cache.
+    """
+    cache = LookupCache(maxsize, ttl)
+    _sensor_location_caches[engine] = cache
+    return cache
+
+
+def invalidate_sensor_location_cache(
+        engine: sqlalchemy.engine.base.Engine,
+        sensor_serial_number: Optional[str] = None) -> None:
+    """
+    This function invalidates the cached sensor location of a single sensor,
+    or of all sensors if no serial number is given.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        sensor_serial_number (Optional[str], optional): the sensor serial
+            number. Defaults to None.
+    """
+    cache = _sensor_location_caches.get(engine)
+    if cache is not None:
+        cache.invalidate(sensor_serial_number)
@@ -1,46 +1,146 @@
 from dotenv import load_dotenv
-from humipy.database.models import metadata
-from humipy.database.write import (
-    add_location, add_sensor, start_sensor_placement, push_measurement
-)
+from humipy.database.models import locations_table
+from humipy.database.pool import InstrumentedQueuePool, get_pool_options
+from humipy.profiling import instrument_engine
 from os import getenv
-import random
 import sqlalchemy
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select
+from sqlalchemy.pool import StaticPool
+from typing import Optional
 
 
-_SENSORS = ["XIE-385A92H20-T0", "XIA-502A92V37-T7"]
-
-
-def get_engine(dev: bool = False) -> sqlalchemy.engine.base.Engine:
+def get_engine(
+        dev: bool = False,
+        dev_database: Optional[str] = None,
+        seed_options: Optional[dict] = None,
+        profile: Optional[str] = None) -> sqlalchemy.engine.base.Engine:
     """
     This function initializes an engine. This engine functions as a connection 
-    factory and connection pool.
+    factory and connection pool. The pool is configured with a pool profile 
+    (see humipy.database.pool) and keeps statistics that are returned by 
+    humipy.database.pool.get_pool_stats. The statements executed by the 
+    engine are recorded by humipy.profiling if profiling is enabled.
 
     Args:
         dev (bool, optional): indicator to indicate to use the test 
             environment or a production environment. Defaults to False.
+        dev_database (Optional[str], optional): the path of a file-backed 
+            test database. If None, the test database is kept in memory. An 
+            existing file that is already populated is reused as is. Defaults 
+            to None.
+        seed_options (Optional[dict], optional): keyword arguments passed to 
+            humipy.database.seed.seed_database to populate the test database 
+            (e.g., n_sensors, n_locations, n_measurements and span). Defaults 
+            to None.
+        profile (Optional[str], optional): the pool profile, i.e., 
+            'interactive', 'ingestion' or 'export'. If None, the profile in 
+            the DB_POOL_PROFILE variable is used, or the interactive profile. 
+            Defaults to None.
 
     Returns:
         sqlalchemy.engine.base.Engine: a SQLAlchemy engine object.
     """
+    load_dotenv()
+    options = get_pool_options(profile)
+    if dev and dev_database is not None:
+        engine = create_engine(
+            f"sqlite+pysqlite:///{dev_database}",
+            poolclass=InstrumentedQueuePool,
+            pool_size=options["pool_size"],
+            max_overflow=options["max_overflow"],
+            pool_timeout=options["pool_timeout"],
+        )
+        if not _is_test_database_seeded(engine):
+            _create_test_database(engine, seed_options)
+        instrument_engine(engine)
+        return engine
     if dev:
-        engine = create_engine("sqlite+pysqlite:///:memory:")
-        _create_test_database(engine)
+        # The in-memory database only lives as long as its connection, so a 
+        # single connection is shared by all threads (e.g., the ingestion 
+        # server writes from a worker thread)
+        engine = create_engine(
+            "sqlite+pysqlite:///:memory:",
+            poolclass=StaticPool,
+            connect_args={"check_same_thread": False},
+        )
+        _create_test_database(engine, seed_options)
+        instrument_engine(engine)
         return engine
-    
-    load_dotenv()
+
+    engine = create_engine(
+        get_database_url(),
+        poolclass=InstrumentedQueuePool,
+        **get_engine_arguments(profile),
+    )
+    instrument_engine(engine)
+    return engine
+
+
+def get_database_url(driver: str = "psycopg2") -> str:
+    """
+    This function builds the URL of the production database from the 
+    DB_NAME, DB_HOST, DB_PORT, DB_USERNAME and DB_PASSWORD variables.
+
+    Args:
+        driver (str, optional): the PostgreSQL driver, i.e., 'psycopg2' or 
+            'asyncpg'. Defaults to 'psycopg2'.
+
+    Returns:
+        str: the database URL.
+    """
     db = getenv("DB_NAME")
     host = getenv("DB_HOST")
     port = getenv("DB_PORT")
     username = getenv("DB_USERNAME")
     password = getenv("DB_PASSWORD")
-    return create_engine(
-        f"postgresql+psycopg2://{username}:{password}@{host}:{port}/{db}"
-    )
+    return f"postgresql+{driver}://{username}:{password}@{host}:{port}/{db}"
 
 
-def _create_test_database(engine: sqlalchemy.engine.base.Engine) -> None:
+def get_engine_arguments(
+        profile: Optional[str] = None,
+        driver: str = "psycopg2") -> dict:
+    """
+    This function returns the keyword arguments of create_engine (or 
+    create_async_engine) for the production database: the pool settings of 
+    a pool profile (see humipy.database.pool), and the connect and statement 
+    timeouts in the form the driver expects.
+
+    Args:
+        profile (Optional[str], optional): the pool profile. Defaults to 
+            None.
+        driver (str, optional): the PostgreSQL driver, i.e., 'psycopg2' or 
+            'asyncpg'. Defaults to 'psycopg2'.
+
+    Returns:
+        dict: the keyword arguments.
+    """
+    options = get_pool_options(profile)
+    statement_timeout = int((options["statement_timeout"] or 0) * 1000)
+    if driver == "asyncpg":
+        connect_args = {"timeout": options["connect_timeout"]}
+        if statement_timeout:
+            connect_args["server_settings"] = {
+                "statement_timeout": str(statement_timeout)
+            }
+    else:
+        connect_args = {"connect_timeout": options["connect_timeout"]}
+        if statement_timeout:
+            connect_args["options"] = (
+                f"-c statement_timeout={statement_timeout}"
+            )
+    return {
+        "pool_size": options["pool_size"],
+        "max_overflow": options["max_overflow"],
+        "pool_timeout": options["pool_timeout"],
+        "pool_pre_ping": options["pool_pre_ping"],
+        "pool_recycle": options["pool_recycle"],
+        "connect_args": connect_args,
+    }
+
+
+def _create_test_database(
+        engine: sqlalchemy.engine.base.Engine,
+        seed_options: Optional[dict] = None) -> None:
     """
     This function create a test database. The test database is populated with 
     dummy data. The test database enables the user to interacht with the 
@@ -48,25 +148,28 @@ def _create_test_database(engine: sqlalchemy.engine.base.Engine) -> None:
 
     Args:
         engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        seed_options (Optional[dict], optional): keyword arguments passed to 
+            humipy.database.seed.seed_database. Defaults to None.
     """
-    metadata.create_all(engine)
-    for location in ["Kitchen", "Bathroom", "Bedroom"]:
-        add_location(engine, location)
-    for sensor in _SENSORS:
-        add_sensor(engine, sensor, "DHT11")
-    start_sensor_placement(engine, "Bathroom", _SENSORS[0])
-    start_sensor_placement(engine, "Kitchen", _SENSORS[1])
-    _push_dummy_measurements(engine)
+    # NumPy is only needed to seed the test database, so it is imported here
+    from humipy.database.seed import seed_database
 
+    seed_database(engine, **(seed_options or {}))
 
-def _push_dummy_measurements(engine: sqlalchemy.engine.base.Engine) -> None:
+
+def _is_test_database_seeded(engine: sqlalchemy.engine.base.Engine) -> bool:
     """
-    This function inserts dummy humidity measurements into the test database.
+    This function checks whether a file-backed test database was already 
+    populated, i.e., whether it holds locations.
 
     Args:
         engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+
+    Returns:
+        bool: True if the locations table exists and is not empty.
     """
-    for _ in range(1000):
-        push_measurement(
-            engine, random.choice(_SENSORS), random.uniform(55., 75.),
-        )
\ No newline at end of file
+    if not sqlalchemy.inspect(engine).has_table(locations_table.name):
+        return False
+    with engine.connect() as conn:
+        row = conn.execute(select(locations_table).limit(1)).first()
+    return row is not None
\ No newline at end of file
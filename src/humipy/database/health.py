@@ -0,0 +1,349 @@
+"""
+This module reports the health of the sensors over their measurement
+history: for every sensor location, the gaps between measurements that are
+longer than a threshold, its uptime and the drift of its reporting rate, so
+that sensors that silently stopped reporting are noticed.
+
+On PostgreSQL, the gaps are computed with the LAG window function in the
+database, so that only one row per sensor location leaves the database. On
+SQLite, where window functions are considerably slower, the measurement times
+are streamed in chunks in the order of the (sensor location, measurement
+time) index and the gaps are computed with NumPy, carrying the last
+measurement time of every sensor location from one chunk to the next.
+"""
+
+
+from __future__ import annotations
+from datetime import datetime, timedelta
+from humipy.database.models import (
+    humidity_measurements_table,
+    sensor_locations_table,
+)
+from humipy.database.statements import get_sensor_locations_rows_query
+from humipy.profiling import timed
+import sqlalchemy
+from sqlalchemy import case, extract, func, select
+from typing import TYPE_CHECKING, Optional
+
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+@timed
+def get_sensor_health(
+        engine: sqlalchemy.engine.base.Engine,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        gap_threshold: timedelta = timedelta(minutes=15),
+        recent: timedelta = timedelta(days=1),
+        method: str = "auto",
+        chunksize: int = 100000) -> pd.DataFrame:
+    """
+    This function reports the health of every sensor location that was
+    placed during a time range. The time range of a sensor location is
+    limited to its placement, and the time before its first and after its
+    last measurement count as gaps too.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        start (Optional[datetime], optional): the start of the time range. If
+            None, the whole history is reported. Defaults to None.
+        end (Optional[datetime], optional): the end of the time range. If
+            None, the current date and time is used. Defaults to None.
+        gap_threshold (timedelta, optional): the time between measurements
+            above which a sensor is considered down. Defaults to 15 minutes.
+        recent (timedelta, optional): the period at the end of the time range
+            of which the reporting rate is compared to the rate before it.
+            Defaults to one day.
+        method (str, optional): 'sql' to compute the gaps in the database,
+            'chunked' to compute them with NumPy, or 'auto' to use the
+            database on PostgreSQL only. Defaults to 'auto'.
+        chunksize (int, optional): the number of measurements per chunk of
+            the 'chunked' method. Defaults to 100000.
+
+    Returns:
+        pd.DataFrame: a data frame with one row per sensor location, with
+            the sensor location identifier, location name, sensor serial
+            number, whether the placement is open, the reported time range,
+            the measurement count, the last measurement time, the time since
+            the last measurement, the number of gaps, the longest gap and the
+            total downtime (in seconds), the uptime percentage, the
+            reporting rate per hour before and during the recent period, and
+            the drift between both rates as a percentage.
+    """
+    import pandas as pd
+
+    end = datetime.now() if end is None else end
+    recent_start = end - recent
+    threshold = gap_threshold.total_seconds()
+    if method == "auto":
+        method = "sql" if engine.dialect.name == "postgresql" else "chunked"
+    if method == "sql":
+        aggregates = _aggregate_sql(engine, start, end, threshold, recent_start)
+    elif method == "chunked":
+        aggregates = _aggregate_chunked(
+            engine, start, end, threshold, recent_start, chunksize
+        )
+    else:
+        raise ValueError(f"Unknown method: {method}.")
+
+    with engine.connect() as conn:
+        placements = conn.execute(
+            get_sensor_locations_rows_query().order_by(
+                sensor_locations_table.c.sensor_location_id
+            )
+        ).all()
+    rows = []
+    for placement in placements:
+        window_start = placement.start_placement
+        if start is not None:
+            window_start = max(window_start, start)
+        window_end = end
+        if placement.stop_placement is not None:
+            window_end = min(window_end, placement.stop_placement)
+        if window_end <= window_start:
+            continue
+        window = (window_end - window_start).total_seconds()
+        (
+            count, first, last, gap_count, downtime, longest, recent_count
+        ) = aggregates.get(
+            placement.sensor_location_id, (0, None, None, 0, 0., 0., 0)
+        )
+        if count:
+            edges = [
+                max((first - window_start).total_seconds(), 0.),
+                max((window_end - last).total_seconds(), 0.),
+            ]
+            silent = edges[1]
+        else:
+            edges = [window]
+            silent = window
+        edge_gaps = [edge for edge in edges if edge > threshold]
+        gap_count += len(edge_gaps)
+        downtime += sum(edge_gaps)
+        longest = max([longest] + edges)
+
+        # The rates before and during the recent period, if the time range
+        # covers both
+        rate = recent_rate = drift = float("nan")
+        before = (min(recent_start, window_end) - window_start).total_seconds()
+        during = (window_end - max(recent_start, window_start)).total_seconds()
+        if before > 0:
+            rate = (count - recent_count) / before * 3600.
+        if during > 0:
+            recent_rate = recent_count / during * 3600.
+        if before > 0 and during > 0 and rate > 0:
+            drift = (recent_rate / rate - 1.) * 100.
+        rows.append(
+            {
+                "sensor_location_id": placement.sensor_location_id,
+                "location_name": placement.location_name,
+                "sensor_serial_number": placement.sensor_serial_number,
+                "is_open": placement.stop_placement is None,
+                "window_start": window_start,
+                "window_end": window_end,
+                "measurement_count": count,
+                "last_measurement": last,
+                "silent_seconds": silent,
+                "gap_count": gap_count,
+                "longest_gap_seconds": longest,
+                "downtime_seconds": downtime,
+                "uptime_pct": max(1. - downtime / window, 0.) * 100.,
+                "rate_per_hour": rate,
+                "recent_rate_per_hour": recent_rate,
+                "rate_drift_pct": drift,
+            }
+        )
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "sensor_location_id",
+            "location_name",
+            "sensor_serial_number",
+            "is_open",
+            "window_start",
+            "window_end",
+            "measurement_count",
+            "last_measurement",
+            "silent_seconds",
+            "gap_count",
+            "longest_gap_seconds",
+            "downtime_seconds",
+            "uptime_pct",
+            "rate_per_hour",
+            "recent_rate_per_hour",
+            "rate_drift_pct",
+        ],
+    )
+
+
+def format_duration(seconds: float) -> str:
+    """
+    This function formats a duration compactly, with its two largest units.
+
+    Args:
+        seconds (float): the duration in seconds.
+
+    Returns:
+        str: the formatted duration (e.g., '2d 3h' or '12m 5s').
+    """
+    seconds = int(round(seconds))
+    parts: list[str] = []
+    for unit, size in [("d", 86400), ("h", 3600), ("m", 60), ("s", 1)]:
+        if seconds >= size or (unit == "s" and not parts):
+            parts.append(f"{seconds // size}{unit}")
+            seconds %= size
+    return " ".join(parts[:2])
+
+
+def _filter_time_range(
+        stmt: sqlalchemy.sql.selectable.Select,
+        start: Optional[datetime],
+        end: datetime) -> sqlalchemy.sql.selectable.Select:
+    measurements = humidity_measurements_table.c
+    if start is not None:
+        stmt = stmt.where(measurements.measurement_time >= start)
+    return stmt.where(measurements.measurement_time < end)
+
+
+def _aggregate_sql(
+        engine: sqlalchemy.engine.base.Engine,
+        start: Optional[datetime],
+        end: datetime,
+        threshold: float,
+        recent_start: datetime) -> dict[int, tuple]:
+    """
+    This function computes the gaps of every sensor location in the database
+    with the LAG window function.
+
+    Returns:
+        dict[int, tuple]: the measurement count, first and last measurement
+            time, the number of gaps above the threshold, their total and the
+            longest gap (in seconds), and the number of recent measurements
+            per sensor location identifier.
+    """
+    measurements = humidity_measurements_table.c
+    if engine.dialect.name == "sqlite":
+        # SQLite stores times as strings, which are converted to Julian days
+        # once per row
+        time = func.julianday(measurements.measurement_time)
+        gap = (
+            time - func.lag(time).over(
+                partition_by=measurements.sensor_location_id,
+                order_by=measurements.measurement_time,
+            )
+        ) * 86400.
+    else:
+        gap = extract(
+            "epoch",
+            measurements.measurement_time
+            - func.lag(measurements.measurement_time).over(
+                partition_by=measurements.sensor_location_id,
+                order_by=measurements.measurement_time,
+            ),
+        )
+    gaps = _filter_time_range(
+        select(
+            measurements.sensor_location_id,
+            measurements.measurement_time,
+            gap.label("gap"),
+        ),
+        start,
+        end,
+    ).subquery()
+    is_gap = gaps.c.gap > threshold
+    stmt = select(
+        gaps.c.sensor_location_id,
+        func.count(),
+        func.min(gaps.c.measurement_time),
+        func.max(gaps.c.measurement_time),
+        func.count(case((is_gap, 1))),
+        func.coalesce(func.sum(case((is_gap, gaps.c.gap))), 0.),
+        func.coalesce(func.max(gaps.c.gap), 0.),
+        func.count(case((gaps.c.measurement_time >= recent_start, 1))),
+    ).group_by(gaps.c.sensor_location_id)
+    with engine.connect() as conn:
+        rows = conn.execute(stmt).all()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def _aggregate_chunked(
+        engine: sqlalchemy.engine.base.Engine,
+        start: Optional[datetime],
+        end: datetime,
+        threshold: float,
+        recent_start: datetime,
+        chunksize: int) -> dict[int, tuple]:
+    """
+    This function computes the same aggregates as _aggregate_sql from a
+    stream of the measurement times, one chunk at a time with NumPy.
+    """
+    import numpy as np
+
+    measurements = humidity_measurements_table.c
+    time: sqlalchemy.ColumnElement = measurements.measurement_time
+    if engine.dialect.name == "sqlite":
+        # The times are parsed by NumPy instead of one by one by SQLAlchemy
+        time = sqlalchemy.type_coerce(time, sqlalchemy.String)
+    stmt = _filter_time_range(
+        select(measurements.sensor_location_id, time)
+        .order_by(measurements.sensor_location_id, time),
+        start,
+        end,
+    )
+    recent_time = np.datetime64(recent_start, "us")
+    aggregates: dict[int, tuple] = {}
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=chunksize
+        ).execute(stmt)
+        for partition in result.partitions():
+            ids = np.fromiter(
+                (row[0] for row in partition), dtype=np.int64,
+                count=len(partition),
+            )
+            times = np.array(
+                [row[1] for row in partition], dtype="datetime64[us]"
+            )
+            unique_ids, starts = np.unique(ids, return_index=True)
+            ends = np.append(starts[1:], len(ids))
+
+            # The first measurement of a sensor location in the chunk follows
+            # its last measurement in the earlier chunks
+            previous = np.empty_like(times)
+            previous[1:] = times[:-1]
+            previous[starts] = np.array(
+                [
+                    aggregates[i][2] if i in aggregates else None
+                    for i in unique_ids.tolist()
+                ],
+                dtype="datetime64[us]",
+            )
+            gaps = (times - previous) / np.timedelta64(1, "s")
+            is_gap = gaps > threshold
+            chunk = zip(
+                unique_ids.tolist(),
+                (ends - starts).tolist(),
+                times[starts].tolist(),
+                times[ends - 1].tolist(),
+                np.add.reduceat(is_gap, starts).tolist(),
+                np.add.reduceat(np.where(is_gap, gaps, 0.), starts).tolist(),
+                np.nan_to_num(np.fmax.reduceat(gaps, starts)).tolist(),
+                np.add.reduceat(times >= recent_time, starts).tolist(),
+            )
+            for sensor_location_id, *values in chunk:
+                current = aggregates.get(sensor_location_id)
+                if current is None:
+                    aggregates[sensor_location_id] = tuple(values)
+                    continue
+                aggregates[sensor_location_id] = (
+                    current[0] + values[0],
+                    current[1],
+                    values[2],
+                    current[3] + values[3],
+                    current[4] + values[4],
+                    max(current[5], values[5]),
+                    current[6] + values[6],
+                )
+    return aggregates
@@ -0,0 +1,118 @@
+"""
+This module maintains the latest_readings table, which holds the most recent
+humidity measurement of every sensor location. The table is updated in the
+same transaction as the insert of new measurements, so that the current
+humidity in every room can be looked up without scanning the measurements.
+"""
+
+
+from humipy.database.models import (
+    humidity_measurements_table,
+    latest_readings_table,
+)
+import sqlalchemy
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from typing import Iterable, Union
+
+
+def update_latest_readings(
+        conn: sqlalchemy.engine.base.Connection,
+        measurements: Iterable[dict]) -> None:
+    """
+    This function stores the most recent of the given measurements of every
+    sensor location, unless a more recent measurement is stored already.
+    Nothing is committed.
+
+    Args:
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+        measurements (Iterable[dict]): the measurements, each with a sensor
+            location identifier, humidity and measurement time.
+    """
+    latest: dict[int, dict] = {}
+    for measurement in measurements:
+        sensor_location_id = measurement["sensor_location_id"]
+        current = latest.get(sensor_location_id)
+        if (
+                current is None
+                or measurement["measurement_time"]
+                >= current["measurement_time"]):
+            latest[sensor_location_id] = measurement
+    if not latest:
+        return
+
+    table = latest_readings_table
+    stmt: Union[postgresql.Insert, sqlite.Insert]
+    if conn.dialect.name == "postgresql":
+        stmt = postgresql.insert(table)
+    else:
+        stmt = sqlite.insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.sensor_location_id],
+        set_={
+            "humidity": stmt.excluded.humidity,
+            "measurement_time": stmt.excluded.measurement_time,
+        },
+        # Measurements that arrive out of order do not replace a more recent
+        # reading
+        where=table.c.measurement_time <= stmt.excluded.measurement_time,
+    )
+    conn.execute(
+        stmt,
+        [
+            {
+                "sensor_location_id": sensor_location_id,
+                "humidity": measurement["humidity"],
+                "measurement_time": measurement["measurement_time"],
+            }
+            for sensor_location_id, measurement in sorted(latest.items())
+        ],
+    )
+
+
+def rebuild_latest_readings(engine: sqlalchemy.engine.base.Engine) -> None:
+    """
+    This function recomputes the latest readings from the raw humidity
+    measurements, e.g., after the table was added to an existing database.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+    """
+    with engine.begin() as conn:
+        fill_latest_readings(conn)
+
+
+def fill_latest_readings(conn: sqlalchemy.engine.base.Connection) -> None:
+    """
+    This function replaces the latest readings with the most recent raw
+    humidity measurement of every sensor location, without committing.
+
+    Args:
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+    """
+    measurements = humidity_measurements_table.c
+    ranked = select(
+        measurements.sensor_location_id,
+        measurements.humidity,
+        measurements.measurement_time,
+        func.row_number()
+        .over(
+            partition_by=measurements.sensor_location_id,
+            order_by=(
+                measurements.measurement_time.desc(),
+                measurements.humidity_measurement_id.desc(),
+            ),
+        )
+        .label("rank"),
+    ).subquery()
+    conn.execute(delete(latest_readings_table))
+    conn.execute(
+        insert(latest_readings_table).from_select(
+            ["sensor_location_id", "humidity", "measurement_time"],
+            select(
+                ranked.c.sensor_location_id,
+                ranked.c.humidity,
+                ranked.c.measurement_time,
+            ).where(ranked.c.rank == 1),
+        )
+    )
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, MetaData, Table
-from sqlalchemy import Date, Float, Integer, String
+from sqlalchemy import Column, Index, MetaData, Table
+from sqlalchemy import DateTime, Float, Integer, String, text
 
 
 metadata = MetaData()
@@ -9,7 +9,7 @@ locations_table = Table(
     "locations",
     metadata,
     Column("location_id", Integer, primary_key=True),
-    Column("location_name", String, nullable=False),
+    Column("location_name", String, nullable=False, unique=True),
 )
 
 
@@ -17,7 +17,7 @@ sensors_table = Table(
     "sensors",
     metadata,
     Column("sensor_id", Integer, primary_key=True),
-    Column("sensor_serial_number", String, nullable=False),
+    Column("sensor_serial_number", String, nullable=False, unique=True),
     Column("sensor_type", String, nullable=True),
 )
 
@@ -28,8 +28,17 @@ sensor_locations_table = Table(
     Column("sensor_location_id", Integer, primary_key=True),
     Column("sensor_id", Integer, nullable=False),
     Column("location_id", Integer, nullable=False),
-    Column("start_placement", Date, nullable=False),
-    Column("stop_placement", Date, nullable=True),
+    Column("start_placement", DateTime, nullable=False),
+    Column("stop_placement", DateTime, nullable=True),
+    # Partial index for the open sensor location lookups, which also ensures
+    # that a sensor has at most one open sensor location
+    Index(
+        "ix_sensor_locations_open",
+        "sensor_id",
+        unique=True,
+        postgresql_where=text("stop_placement IS NULL"),
+        sqlite_where=text("stop_placement IS NULL"),
+    ),
 )
 
 
@@ -39,5 +48,98 @@ humidity_measurements_table = Table(
     Column("humidity_measurement_id", Integer, primary_key=True),
     Column("sensor_location_id", Integer, nullable=False),
     Column("humidity", Float, nullable=True),
-    Column("measurement_time", Date, nullable=False),
-)
\ No newline at end of file
+    Column("measurement_time", DateTime, nullable=False),
+    # DHT11 sensors report the temperature (in degrees Celsius) with the
+    # humidity, and some sensors also report the pressure (in hPa)
+    Column("temperature", Float, nullable=True),
+    Column("pressure", Float, nullable=True),
+    Index("ix_humidity_measurements_time", "measurement_time"),
+    # A sensor location takes one sample at a time, so that gateways can
+    # safely resend measurements that may have been written already
+    Index(
+        "uq_humidity_measurements_sensor_location_time",
+        "sensor_location_id",
+        "measurement_time",
+        unique=True,
+    ),
+)
+
+
+hourly_humidity_rollups_table = Table(
+    "hourly_humidity_rollups",
+    metadata,
+    Column("sensor_location_id", Integer, primary_key=True),
+    Column("bucket_start", DateTime, primary_key=True),
+    Column("measurement_count", Integer, nullable=False),
+    Column("humidity_sum", Float, nullable=False),
+    Column("humidity_min", Float, nullable=True),
+    Column("humidity_max", Float, nullable=True),
+)
+
+
+daily_humidity_rollups_table = Table(
+    "daily_humidity_rollups",
+    metadata,
+    Column("sensor_location_id", Integer, primary_key=True),
+    Column("bucket_start", DateTime, primary_key=True),
+    Column("measurement_count", Integer, nullable=False),
+    Column("humidity_sum", Float, nullable=False),
+    Column("humidity_min", Float, nullable=True),
+    Column("humidity_max", Float, nullable=True),
+)
+
+outdoor_weather_table = Table(
+    "outdoor_weather",
+    metadata,
+    Column("latitude", Float, primary_key=True),
+    Column("longitude", Float, primary_key=True),
+    Column("weather_parameter", String, primary_key=True),
+    Column("measurement_time", DateTime, primary_key=True),
+    Column("value", Float, nullable=True),
+    Index("ix_outdoor_weather_time", "measurement_time"),
+)
+
+
+weather_backfill_chunks_table = Table(
+    "weather_backfill_chunks",
+    metadata,
+    Column("chunk_key", String, primary_key=True),
+    Column("chunk_start", DateTime, nullable=False),
+    Column("chunk_end", DateTime, nullable=False),
+    Column("row_count", Integer, nullable=False),
+    Column("completed_at", DateTime, nullable=False),
+)
+
+
+latest_readings_table = Table(
+    "latest_readings",
+    metadata,
+    Column("sensor_location_id", Integer, primary_key=True),
+    Column("humidity", Float, nullable=True),
+    Column("measurement_time", DateTime, nullable=False),
+)
+
+
+sensor_statistics_table = Table(
+    "sensor_statistics",
+    metadata,
+    Column("sensor_location_id", Integer, primary_key=True),
+    Column("measurement_count", Integer, nullable=False),
+    Column("humidity_ewma", Float, nullable=False),
+    Column("humidity_ewm_variance", Float, nullable=False),
+    Column("last_measurement_time", DateTime, nullable=False),
+)
+
+
+humidity_anomalies_table = Table(
+    "humidity_anomalies",
+    metadata,
+    Column("humidity_anomaly_id", Integer, primary_key=True),
+    Column("sensor_location_id", Integer, nullable=False),
+    Column("measurement_time", DateTime, nullable=False),
+    Column("humidity", Float, nullable=True),
+    Column("anomaly_type", String, nullable=False),
+    Column("baseline", Float, nullable=True),
+    Column("deviation", Float, nullable=True),
+    Index("ix_humidity_anomalies_time", "measurement_time"),
+)
@@ -0,0 +1,466 @@
+"""
+This module partitions the humidity measurements by month on PostgreSQL and
+applies a retention policy to the raw measurements.
+
+Partitioning is opt-in. It turns humidity_measurements into a table
+partitioned by range of measurement time, to which the existing table is
+attached as the partition of everything up to the current month, so that no
+rows are copied. Monthly partitions are then created ahead of time by
+ensure_partitions (e.g., from a daily cron job), and a default partition
+catches measurements outside the existing partitions.
+
+The retention policy removes the raw measurements of the months older than a
+number of months, once the rollups hold all of their measurements, after
+optionally archiving them to compressed CSV files. As the rollups only hold
+the humidity, the months with temperatures or pressures (or measurements
+without a humidity) are only removed if they are archived. On partitioned
+tables, whole partitions are dropped, which avoids vacuuming. On SQLite and on
+tables that are not partitioned, every month is treated as a period of its
+own and its rows are deleted.
+"""
+
+
+from datetime import datetime
+import gzip
+from humipy.database.models import (
+    daily_humidity_rollups_table,
+    humidity_measurements_table,
+)
+import logging
+import os
+import sqlalchemy
+from sqlalchemy import case, delete, func, or_, select, text
+from typing import Optional
+
+
+_TABLE = humidity_measurements_table.name
+_logger = logging.getLogger(__name__)
+
+
+def is_partitioned(engine: sqlalchemy.engine.base.Engine) -> bool:
+    """
+    This function checks whether the humidity measurements are partitioned.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+
+    Returns:
+        bool: True if the humidity measurements table is a partitioned
+            PostgreSQL table.
+    """
+    if engine.dialect.name != "postgresql":
+        return False
+    with engine.connect() as conn:
+        return conn.scalar(
+            text(
+                "SELECT relkind = 'p' FROM pg_class "
+                "WHERE oid = to_regclass(:table)"
+            ),
+            {"table": _TABLE},
+        ) or False
+
+
+def partition_measurements(
+        engine: sqlalchemy.engine.base.Engine,
+        months_ahead: int = 3,
+        now: Optional[datetime] = None) -> list[str]:
+    """
+    This function converts the humidity measurements table into a table that
+    is partitioned by month, in a single transaction. The existing table
+    becomes the partition of all measurements before next month.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        months_ahead (int, optional): the number of monthly partitions
+            created after the current month. Defaults to 3.
+        now (Optional[datetime], optional): the current date and time.
+            Defaults to None.
+
+    Returns:
+        list[str]: a description of every change that was applied.
+    """
+    if engine.dialect.name != "postgresql":
+        raise ValueError("Partitioning requires PostgreSQL.")
+    if is_partitioned(engine):
+        return ensure_partitions(engine, months_ahead, now)
+
+    legacy = f"{_TABLE}_legacy"
+    boundary = _add_months(_month_start(now or datetime.now()), 1)
+    with engine.begin() as conn:
+        sequence = conn.scalar(
+            text("SELECT pg_get_serial_sequence(:table, :column)"),
+            {"table": _TABLE, "column": "humidity_measurement_id"},
+        )
+        conn.execute(text(f"ALTER TABLE {_TABLE} RENAME TO {legacy}"))
+        for index in humidity_measurements_table.indexes:
+            conn.execute(
+                text(
+                    f"ALTER INDEX IF EXISTS {index.name} "
+                    f"RENAME TO {index.name}_legacy"
+                )
+            )
+        # The primary key of a partitioned table must include the partition
+        # key. The identifiers keep coming from the existing sequence.
+        conn.execute(
+            text(
+                f"CREATE TABLE {_TABLE} ("
+                f"humidity_measurement_id BIGINT NOT NULL "
+                f"DEFAULT nextval('{sequence}'), "
+                f"sensor_location_id INT NOT NULL, "
+                f"humidity REAL NULL, "
+                f"measurement_time TIMESTAMP NOT NULL, "
+                f"temperature REAL NULL, "
+                f"pressure REAL NULL, "
+                f"PRIMARY KEY (humidity_measurement_id, measurement_time)"
+                f") PARTITION BY RANGE (measurement_time)"
+            )
+        )
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+        # A partition cannot have a primary key of its own, so the primary
+        # key of the existing table is replaced by the one of the new table
+        primary_key = conn.scalar(
+            text(
+                "SELECT conname FROM pg_constraint "
+                "WHERE conrelid = to_regclass(:table) AND contype = 'p'"
+            ),
+            {"table": legacy},
+        )
+        if primary_key is not None:
+            conn.execute(
+                text(f"ALTER TABLE {legacy} DROP CONSTRAINT {primary_key}")
+            )
+        conn.execute(
+            text(
+                f"ALTER TABLE {legacy} ADD PRIMARY KEY "
+                f"(humidity_measurement_id, measurement_time)"
+            )
+        )
+        conn.execute(
+            text(
+                f"ALTER TABLE {_TABLE} ATTACH PARTITION {legacy} "
+                f"FOR VALUES FROM (MINVALUE) TO ('{boundary:%Y-%m-%d}')"
+            )
+        )
+        for index in humidity_measurements_table.indexes:
+            columns = ", ".join(column.name for column in index.columns)
+            unique = "UNIQUE " if index.unique else ""
+            conn.execute(
+                text(
+                    f"CREATE {unique}INDEX {index.name} "
+                    f"ON {_TABLE} ({columns})"
+                )
+            )
+        conn.execute(
+            text(
+                f"CREATE TABLE {_TABLE}_default PARTITION OF {_TABLE} DEFAULT"
+            )
+        )
+    return [
+        f"partitioned {_TABLE} by month",
+        f"attached {legacy} for the measurements before {boundary:%Y-%m-%d}",
+    ] + ensure_partitions(engine, months_ahead, now)
+
+
+def ensure_partitions(
+        engine: sqlalchemy.engine.base.Engine,
+        months_ahead: int = 3,
+        now: Optional[datetime] = None) -> list[str]:
+    """
+    This function creates the missing monthly partitions of the current
+    month and the coming months. Measurements of these months that were
+    caught by the default partition are moved to their new partition. It
+    does nothing if the humidity measurements are not partitioned.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        months_ahead (int, optional): the number of months after the current
+            month. Defaults to 3.
+        now (Optional[datetime], optional): the current date and time.
+            Defaults to None.
+
+    Returns:
+        list[str]: a description of every partition that was created.
+    """
+    if not is_partitioned(engine):
+        return []
+    applied = []
+    current = _month_start(now or datetime.now())
+    default = f"{_TABLE}_default"
+    with engine.begin() as conn:
+        covered = [
+            (start, end) for _, start, end in _get_partitions(conn)
+        ]
+        for i in range(months_ahead + 1):
+            start = _add_months(current, i)
+            end = _add_months(start, 1)
+            if any(
+                    (lower is None or lower < end)
+                    and (upper is None or start < upper)
+                    for lower, upper in covered):
+                continue
+            name = f"{_TABLE}_{start:%Y_%m}"
+            bounds = {"start": start, "end": end}
+            # A partition cannot be created while the default partition
+            # holds rows of its range, so the default partition is detached
+            # until they are moved
+            moving = conn.scalar(
+                text(
+                    f"SELECT EXISTS (SELECT 1 FROM {default} "
+                    f"WHERE measurement_time >= :start "
+                    f"AND measurement_time < :end)"
+                ),
+                bounds,
+            )
+            if moving:
+                conn.execute(
+                    text(f"ALTER TABLE {_TABLE} DETACH PARTITION {default}")
+                )
+            conn.execute(
+                text(
+                    f"CREATE TABLE {name} PARTITION OF {_TABLE} "
+                    f"FOR VALUES FROM ('{start:%Y-%m-%d}') "
+                    f"TO ('{end:%Y-%m-%d}')"
+                )
+            )
+            applied.append(f"created partition {name}")
+            if moving:
+                moved = conn.execute(
+                    text(
+                        f"WITH moved AS (DELETE FROM {default} "
+                        f"WHERE measurement_time >= :start "
+                        f"AND measurement_time < :end RETURNING *) "
+                        f"INSERT INTO {name} SELECT * FROM moved"
+                    ),
+                    bounds,
+                ).rowcount
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {_TABLE} ATTACH PARTITION {default} "
+                        f"DEFAULT"
+                    )
+                )
+                applied.append(
+                    f"moved {moved} measurements from {default} to {name}"
+                )
+    return applied
+
+
+def apply_retention(
+        engine: sqlalchemy.engine.base.Engine,
+        months: int,
+        archive_directory: Optional[str] = None,
+        now: Optional[datetime] = None) -> list[str]:
+    """
+    This function removes the raw measurements of the months before the last
+    number of months. A month is only removed if the daily rollups hold all
+    of its measurements, otherwise it is skipped with a warning. The rollups
+    only hold the humidity, so a month with measurements that have a
+    temperature or pressure, or no humidity, is skipped with a warning too,
+    unless it is archived.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        months (int): the number of months, in addition to the current month,
+            of which the raw measurements are kept.
+        archive_directory (Optional[str], optional): the directory to which
+            the raw measurements are archived before they are removed. If
+            None, they are not archived. Defaults to None.
+        now (Optional[datetime], optional): the current date and time.
+            Defaults to None.
+
+    Returns:
+        list[str]: a description of every period that was removed.
+    """
+    cutoff = _add_months(_month_start(now or datetime.now()), -months)
+    applied = []
+    for name, start, end in _get_periods(engine, cutoff):
+        raw, rolled_up, not_rolled_up = _count_measurements(
+            engine, start, end
+        )
+        if name == _TABLE and raw == 0 and not_rolled_up == 0:
+            continue
+        if rolled_up < raw:
+            _logger.warning(
+                "Skipped %s, its rollups are incomplete (rebuild them first)",
+                name,
+            )
+            continue
+        if not_rolled_up and archive_directory is None:
+            _logger.warning(
+                "Skipped %s, %s of its measurements have values that are not "
+                "rolled up (archive them to remove them)",
+                name,
+                not_rolled_up,
+            )
+            continue
+        if archive_directory is not None:
+            path = _archive(engine, archive_directory, name, start, end)
+            applied.append(f"archived {name} to {path}")
+        with engine.begin() as conn:
+            if name == _TABLE:
+                conn.execute(
+                    delete(humidity_measurements_table).where(
+                        humidity_measurements_table.c.measurement_time >= start,
+                        humidity_measurements_table.c.measurement_time < end,
+                    )
+                )
+            else:
+                conn.execute(text(f"DROP TABLE {name}"))
+        applied.append(
+            f"removed the measurements from {start:%Y-%m-%d} to "
+            f"{end:%Y-%m-%d}" if name == _TABLE else f"dropped {name}"
+        )
+    return applied
+
+
+def _get_periods(
+        engine: sqlalchemy.engine.base.Engine,
+        cutoff: datetime) -> list[tuple[str, datetime, datetime]]:
+    """
+    This function returns the periods that end before the cutoff and hold
+    raw measurements: the partitions of a partitioned table, or otherwise
+    every month.
+
+    Returns:
+        list[tuple[str, datetime, datetime]]: the name of the partition (or
+            of the table) and the start and end of every period.
+    """
+    partitioned = is_partitioned(engine)
+    with engine.connect() as conn:
+        first = conn.scalar(
+            select(func.min(humidity_measurements_table.c.measurement_time))
+        )
+        if first is None:
+            return []
+        if partitioned:
+            partitions = _get_partitions(conn)
+    if partitioned:
+        return [
+            (name, start or first, end)
+            for name, start, end in partitions
+            if end is not None and end <= cutoff
+        ]
+    periods = []
+    start = _month_start(first)
+    while start < cutoff:
+        end = _add_months(start, 1)
+        periods.append((_TABLE, start, end))
+        start = end
+    return periods
+
+
+def _get_partitions(
+        conn: sqlalchemy.engine.base.Connection
+        ) -> list[tuple[str, Optional[datetime], Optional[datetime]]]:
+    """
+    This function returns the name and range of every partition of the
+    humidity measurements, except the default partition. Unbounded bounds
+    are None.
+    """
+    rows = conn.execute(
+        text(
+            "SELECT child.relname, "
+            "pg_get_expr(child.relpartbound, child.oid) "
+            "FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = :table"
+        ),
+        {"table": _TABLE},
+    ).all()
+    partitions = []
+    for name, bound in rows:
+        # e.g., FOR VALUES FROM ('2024-01-01 00:00:00') TO ('2024-02-01 ...')
+        if bound == "DEFAULT":
+            continue
+        lower, upper = bound.split(" FROM (", 1)[1].split(") TO (", 1)
+        partitions.append(
+            (name, _parse_bound(lower), _parse_bound(upper.rstrip(")")))
+        )
+    return partitions
+
+
+def _parse_bound(bound: str) -> Optional[datetime]:
+    bound = bound.strip("'")
+    if bound in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(bound)
+
+
+def _count_measurements(
+        engine: sqlalchemy.engine.base.Engine,
+        start: datetime,
+        end: datetime) -> tuple[int, int, int]:
+    """
+    This function counts the raw humidity measurements of a period, the
+    measurements held by its daily rollups, and the raw measurements with
+    values that the rollups do not hold (a temperature or pressure, or no
+    humidity).
+    """
+    measurements = humidity_measurements_table.c
+    rollups = daily_humidity_rollups_table.c
+    with engine.connect() as conn:
+        raw, not_rolled_up = conn.execute(
+            select(
+                func.count(measurements.humidity),
+                func.count(
+                    case(
+                        (
+                            or_(
+                                measurements.humidity == None,
+                                measurements.temperature != None,
+                                measurements.pressure != None,
+                            ),
+                            1,
+                        ),
+                    )
+                ),
+            ).where(
+                measurements.measurement_time >= start,
+                measurements.measurement_time < end,
+            )
+        ).one()
+        rolled_up = conn.scalar(
+            select(func.coalesce(func.sum(rollups.measurement_count), 0))
+            .where(rollups.bucket_start >= start, rollups.bucket_start < end)
+        )
+    return raw, rolled_up or 0, not_rolled_up
+
+
+def _archive(
+        engine: sqlalchemy.engine.base.Engine,
+        directory: str,
+        name: str,
+        start: datetime,
+        end: datetime) -> str:
+    """
+    This function writes the raw measurements of a period to a compressed
+    CSV file, with the location names and sensor serial numbers.
+
+    Returns:
+        str: the path to the archive.
+    """
+    from humipy.database.read import stream_measurements
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(
+        directory, f"{_TABLE}_{start:%Y_%m_%d}_{end:%Y_%m_%d}.csv.gz"
+    )
+    with gzip.open(path + ".tmp", "wt", newline="") as f:
+        header = True
+        for chunk in stream_measurements(
+                engine, start=start, end=end, chunksize=100000,
+                as_frame=True):
+            chunk.to_csv(f, header=header, index=False)
+            header = False
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def _month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+
+def _add_months(dt: datetime, months: int) -> datetime:
+    month = dt.year * 12 + dt.month - 1 + months
+    return dt.replace(year=month // 12, month=month % 12 + 1)
@@ -0,0 +1,215 @@
+"""
+This module defines the connection pool profiles of the application and
+instruments the connection pool, so that the pool can be sized from the
+observed load.
+
+Every profile sets the pool size, the maximum overflow, the checkout timeout,
+pre-ping, the connection recycle time, the statement timeout and the connect
+timeout. The interactive profile keeps few connections for the terminal
+application and one-shot commands, the ingestion profile allows bursts of
+concurrent writes, and the export profile allows long running statements.
+Every option can be overridden with a dotenv variable:
+
+DB_POOL_PROFILE         the profile used if none is given (interactive)
+DB_POOL_SIZE            the number of connections kept in the pool
+DB_MAX_OVERFLOW         the number of connections opened beyond the pool size
+DB_POOL_TIMEOUT         the seconds to wait for a connection from the pool
+DB_POOL_PRE_PING        whether to test connections on checkout (true/false)
+DB_POOL_RECYCLE         the seconds after which connections are replaced
+DB_STATEMENT_TIMEOUT    the seconds after which statements are cancelled (0
+                        disables the timeout)
+DB_CONNECT_TIMEOUT      the seconds to wait for a new database connection
+"""
+
+
+from os import getenv
+import sqlalchemy
+from sqlalchemy.pool import QueuePool
+import threading
+import time
+from typing import Any, Callable, Optional, cast
+
+
+POOL_PROFILES = {
+    "interactive": {
+        "pool_size": 2,
+        "max_overflow": 3,
+        "pool_timeout": 10.,
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+        "statement_timeout": 30.,
+        "connect_timeout": 5,
+    },
+    "ingestion": {
+        "pool_size": 10,
+        "max_overflow": 20,
+        "pool_timeout": 30.,
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+        "statement_timeout": 10.,
+        "connect_timeout": 5,
+    },
+    "export": {
+        "pool_size": 1,
+        "max_overflow": 1,
+        "pool_timeout": 60.,
+        "pool_pre_ping": True,
+        "pool_recycle": 3600,
+        "statement_timeout": 0.,
+        "connect_timeout": 10,
+    },
+}
+
+
+_ENVIRONMENT_VARIABLES: dict[str, tuple[str, Callable[[str], Any]]] = {
+    "pool_size": ("DB_POOL_SIZE", int),
+    "max_overflow": ("DB_MAX_OVERFLOW", int),
+    "pool_timeout": ("DB_POOL_TIMEOUT", float),
+    "pool_pre_ping": ("DB_POOL_PRE_PING", lambda value: value.lower() in (
+        "1", "true", "yes", "on"
+    )),
+    "pool_recycle": ("DB_POOL_RECYCLE", int),
+    "statement_timeout": ("DB_STATEMENT_TIMEOUT", float),
+    "connect_timeout": ("DB_CONNECT_TIMEOUT", int),
+}
+
+
+def get_pool_options(profile: Optional[str] = None) -> dict:
+    """
+    This function returns the options of a pool profile, overridden by the
+    dotenv variables that are set.
+
+    Args:
+        profile (Optional[str], optional): the name of the profile. If None,
+            the profile in DB_POOL_PROFILE is used, or the interactive profile
+            if that is not set. Defaults to None.
+
+    Returns:
+        dict: the pool size, maximum overflow, pool timeout, pre-ping, pool
+            recycle, statement timeout and connect timeout.
+    """
+    profile = profile or getenv("DB_POOL_PROFILE") or "interactive"
+    if profile not in POOL_PROFILES:
+        raise ValueError(f"Unknown pool profile: {profile}.")
+    options = dict(POOL_PROFILES[profile])
+    for option, (variable, convert) in _ENVIRONMENT_VARIABLES.items():
+        value = getenv(variable)
+        if value:
+            options[option] = convert(value)
+    return options
+
+
+class PoolStats:
+    """
+    This class keeps counters that allow sizing a connection pool.
+    """
+
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.checked_out = 0
+        self.checked_out_max = 0
+        self.overflow_connections = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.
+        self.wait_seconds_max = 0.
+        self._lock = threading.Lock()
+
+    def record_checkout(self, seconds: float, overflow: bool) -> None:
+        """
+        This method records a connection checkout.
+
+        Args:
+            seconds (float): the time spent waiting for the connection.
+            overflow (bool): whether a connection was opened beyond the pool
+                size.
+        """
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.checked_out_max = max(self.checked_out_max, self.checked_out)
+            self.overflow_connections += overflow
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def record_checkin(self) -> None:
+        with self._lock:
+            self.checked_out -= 1
+
+    def record_timeout(self, seconds: float) -> None:
+        with self._lock:
+            self.timeouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "checked_out": self.checked_out,
+            "checked_out_max": self.checked_out_max,
+            "overflow_connections": self.overflow_connections,
+            "timeouts": self.timeouts,
+            "wait_seconds_mean": (
+                self.wait_seconds_total / self.checkouts
+                if self.checkouts else 0.
+            ),
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    A queue pool that records the number of checked out connections, the
+    time spent waiting for a connection, the connections opened beyond the
+    pool size and checkout timeouts.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self) -> "InstrumentedQueuePool":
+        # The engine recreates its pool when it is disposed, the counters are
+        # kept
+        pool = cast(InstrumentedQueuePool, super().recreate())
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        overflow = self.overflow()
+        try:
+            connection = super()._do_get()
+        except sqlalchemy.exc.TimeoutError:
+            self.stats.record_timeout(time.perf_counter() - start)
+            raise
+        self.stats.record_checkout(
+            time.perf_counter() - start,
+            self.overflow() > max(overflow, 0),
+        )
+        return connection
+
+    def _do_return_conn(self, record) -> None:
+        self.stats.record_checkin()
+        super()._do_return_conn(record)
+
+
+def get_pool_stats(engine: sqlalchemy.engine.base.Engine) -> Optional[dict]:
+    """
+    This function returns the statistics of the connection pool of an
+    engine.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+
+    Returns:
+        Optional[dict]: the pool statistics, together with the pool size and
+            the current overflow, or None if the pool is not instrumented.
+    """
+    pool = engine.pool
+    if not isinstance(pool, InstrumentedQueuePool):
+        return None
+    return {
+        "pool_size": pool.size(),
+        "overflow": max(pool.overflow(), 0),
+        **pool.stats.as_dict(),
+    }
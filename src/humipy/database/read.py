@@ -1,15 +1,51 @@
+from __future__ import annotations
+from datetime import datetime
 from humipy.database.models import (
+    humidity_anomalies_table,
     humidity_measurements_table,
     locations_table,
     sensors_table,
     sensor_locations_table,
 )
-import pandas as pd
+from humipy.database.rollups import ROLLUP_TABLES, bucket_expression, truncate
+from humipy.database.statements import (
+    get_latest_readings_query,
+    get_measurements_rows_query,
+    get_measurements_since_query,
+    get_sensor_locations_rows_query,
+)
+from humipy.profiling import timed
 import sqlalchemy
-from sqlalchemy import select
-from typing import Optional
+from sqlalchemy import func, select
+from typing import TYPE_CHECKING, Iterator, Literal, Optional, Union, overload
+
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def _read_frame(
+        stmt: sqlalchemy.sql.selectable.Select,
+        conn: sqlalchemy.engine.base.Connection) -> pd.DataFrame:
+    """
+    This function reads the result of a query into a data frame. Pandas is 
+    only imported when a data frame is actually built, so that code paths 
+    that do not need data frames (e.g., the ingestion path and the 
+    lightweight commands) do not pay for importing it.
+
+    Args:
+        stmt (sqlalchemy.sql.selectable.Select): a SQLAlchemy select construct.
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+
+    Returns:
+        pd.DataFrame: a data frame with the query result.
+    """
+    import pandas as pd
 
+    return pd.read_sql_query(stmt, conn)
 
+
+@timed
 def get_locations(engine: sqlalchemy.engine.base.Engine) -> pd.DataFrame:
     """
     This function retrieves all locations from the locations database table.
@@ -22,10 +58,11 @@ def get_locations(engine: sqlalchemy.engine.base.Engine) -> pd.DataFrame:
     """
     stmt = select(locations_table)
     with engine.connect() as conn:
-        df = pd.read_sql_query(stmt, conn)
+        df = _read_frame(stmt, conn)
     return df
 
 
+@timed
 def get_sensors(engine: sqlalchemy.engine.base.Engine) -> pd.DataFrame:
     """
     This function retrieves all sensors from the sensors database table.
@@ -38,10 +75,11 @@ def get_sensors(engine: sqlalchemy.engine.base.Engine) -> pd.DataFrame:
     """
     stmt = select(sensors_table)
     with engine.connect() as conn:
-        df = pd.read_sql_query(stmt, conn)
+        df = _read_frame(stmt, conn)
     return df
 
 
+@timed
 def get_sensor_locations(
         engine: sqlalchemy.engine.base.Engine) -> pd.DataFrame:
     """
@@ -56,10 +94,11 @@ def get_sensor_locations(
     """
     stmt = _get_sensor_locations_base_query()
     with engine.connect() as conn:
-        df = pd.read_sql_query(stmt, conn)
+        df = _read_frame(stmt, conn)
     return df
 
 
+@timed
 def get_open_sensor_location(
         engine: sqlalchemy.engine.base.Engine,
         sensor_serial_number: Optional[str] = None) -> pd.DataFrame:
@@ -81,9 +120,10 @@ def get_open_sensor_location(
         .where(sensors_table.c.sensor_serial_number == sensor_serial_number)
     )
     with engine.connect() as conn:
-        df = pd.read_sql_query(stmt, conn)
+        df = _read_frame(stmt, conn)
     return df
 
+@timed
 def get_open_sensor_locations(
         engine: sqlalchemy.engine.base.Engine) -> pd.DataFrame:
     """
@@ -101,7 +141,7 @@ def get_open_sensor_locations(
         .where(sensor_locations_table.c.stop_placement == None)
     )
     with engine.connect() as conn:
-        df = pd.read_sql_query(stmt, conn)
+        df = _read_frame(stmt, conn)
     return df
 
 
@@ -128,9 +168,11 @@ def _get_sensor_locations_base_query() -> sqlalchemy.sql.selectable.Select:
     )
 
 
+@timed
 def get_recent_measurements(
         engine: sqlalchemy.engine.base.Engine,
-        top_n: int) -> pd.DataFrame:
+        top_n: int,
+        derived: bool = False) -> pd.DataFrame:
     """
     This function retrieves the n most recent humidity measurements from the 
     appropriate database tables.
@@ -138,6 +180,8 @@ def get_recent_measurements(
     Args:
         engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
         top_n (int): the n most recent measurements to retrieve.
+        derived (bool, optional): whether to add the dew point and absolute 
+            humidity (see humipy.derived). Defaults to False.
 
     Returns:
         pd.DataFrame: a data frame with the most recent humidity measurements.
@@ -177,5 +221,490 @@ def get_recent_measurements(
         .limit(top_n)
     )
     with engine.connect() as conn:
-        df = pd.read_sql_query(stmt, conn)
+        df = _read_frame(stmt, conn)
+    if derived:
+        from humipy.derived import add_derived_metrics
+
+        df = add_derived_metrics(df)
+    return df
+
+
+@timed
+def get_measurement_aggregates(
+        engine: sqlalchemy.engine.base.Engine,
+        bucket: str = "hour",
+        group_by: str = "location",
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None) -> pd.DataFrame:
+    """
+    This function retrieves the minimum, maximum, mean and count of the 
+    humidity measurements per location or sensor and per time bucket. The 
+    aggregates are computed by the database. Hourly and daily aggregates are 
+    read from the rollup tables, while minute aggregates are computed from 
+    the raw measurements.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        bucket (str, optional): the bucket size, either 'minute', 'hour' or 
+            'day'. Defaults to 'hour'.
+        group_by (str, optional): either 'location' or 'sensor'. Defaults to 
+            'location'.
+        start (Optional[datetime], optional): only buckets starting at or 
+            after the bucket of this date and time are retrieved. Defaults to 
+            None.
+        end (Optional[datetime], optional): only buckets starting before this 
+            date and time are retrieved. Defaults to None.
+
+    Returns:
+        pd.DataFrame: a data frame with one row per bucket and location or 
+            sensor, ordered by bucket start.
+    """
+    if group_by == "location":
+        group_column = locations_table.c.location_name
+    elif group_by == "sensor":
+        group_column = sensors_table.c.sensor_serial_number
+    else:
+        raise ValueError(f"Cannot group measurements by {group_by}.")
+
+    if bucket in ROLLUP_TABLES:
+        source = ROLLUP_TABLES[bucket]
+        bucket_start: sqlalchemy.ColumnElement = source.c.bucket_start
+        count: sqlalchemy.ColumnElement = func.sum(
+            source.c.measurement_count
+        )
+        total = func.sum(source.c.humidity_sum)
+        minimum = func.min(source.c.humidity_min)
+        maximum = func.max(source.c.humidity_max)
+    else:
+        source = humidity_measurements_table
+        bucket_start = bucket_expression(
+            engine.dialect.name, source.c.measurement_time, bucket
+        )
+        count = func.count(source.c.humidity)
+        total = func.sum(source.c.humidity)
+        minimum = func.min(source.c.humidity)
+        maximum = func.max(source.c.humidity)
+
+    stmt = (
+        select(
+            bucket_start.label("bucket_start"),
+            group_column,
+            minimum.label("humidity_min"),
+            maximum.label("humidity_max"),
+            (
+                sqlalchemy.cast(total, sqlalchemy.Float)
+                / func.nullif(count, 0)
+            ).label("humidity_mean"),
+            count.label("measurement_count"),
+        )
+        .join_from(
+            source,
+            sensor_locations_table,
+            (
+                source.c.sensor_location_id
+                == sensor_locations_table.c.sensor_location_id
+            ),
+        )
+        .join_from(
+            sensor_locations_table,
+            sensors_table,
+            sensor_locations_table.c.sensor_id == sensors_table.c.sensor_id,
+        )
+        .join_from(
+            sensor_locations_table,
+            locations_table,
+            sensor_locations_table.c.location_id == locations_table.c.location_id
+        )
+        .group_by(bucket_start, group_column)
+        .order_by(bucket_start, group_column)
+    )
+    time_column = (
+        source.c.bucket_start if bucket in ROLLUP_TABLES
+        else source.c.measurement_time
+    )
+    if start is not None:
+        stmt = stmt.where(time_column >= truncate(start, bucket))
+    if end is not None:
+        stmt = stmt.where(time_column < end)
+    with engine.connect() as conn:
+        df = _read_frame(stmt, conn)
     return df
+
+
+@timed
+def get_latest_per_location(
+        engine: sqlalchemy.engine.base.Engine) -> pd.DataFrame:
+    """
+    This function retrieves the latest humidity measurement of every open 
+    sensor location from the latest readings table, so that the cost does 
+    not depend on the number of measurements.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+
+    Returns:
+        pd.DataFrame: a data frame with the same columns as 
+            fetch_latest_per_location.
+    """
+    with engine.connect() as conn:
+        df = _read_frame(get_latest_readings_query(), conn)
+    return df
+
+
+# The overloads tell type checkers which kind of chunks are yielded
+@overload
+def stream_measurements(
+        engine: sqlalchemy.engine.base.Engine,
+        start: Optional[datetime] = ...,
+        end: Optional[datetime] = ...,
+        chunksize: int = ...,
+        location_name: Optional[str] = ...,
+        sensor_serial_number: Optional[str] = ...,
+        after_id: Optional[int] = ...,
+        as_frame: Literal[True] = ...,
+        derived: bool = ...) -> Iterator[pd.DataFrame]: ...
+
+
+@overload
+def stream_measurements(
+        engine: sqlalchemy.engine.base.Engine,
+        start: Optional[datetime] = ...,
+        end: Optional[datetime] = ...,
+        chunksize: int = ...,
+        location_name: Optional[str] = ...,
+        sensor_serial_number: Optional[str] = ...,
+        after_id: Optional[int] = ...,
+        *,
+        as_frame: Literal[False],
+        derived: bool = ...) -> Iterator[list]: ...
+
+
+def stream_measurements(
+        engine: sqlalchemy.engine.base.Engine,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        chunksize: int = 10000,
+        location_name: Optional[str] = None,
+        sensor_serial_number: Optional[str] = None,
+        after_id: Optional[int] = None,
+        as_frame: bool = True,
+        derived: bool = False) -> Iterator[Union[pd.DataFrame, list]]:
+    """
+    This function streams the humidity measurements in a time range in 
+    chunks, ordered by measurement time. A server-side cursor is used, so 
+    that only one chunk is held in memory at a time, regardless of the size 
+    of the time range. The connection stays open until the generator is 
+    exhausted or closed.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        start (Optional[datetime], optional): only measurements taken at or 
+            after this date and time are retrieved. Defaults to None.
+        end (Optional[datetime], optional): only measurements taken before 
+            this date and time are retrieved. Defaults to None.
+        chunksize (int, optional): the number of measurements per chunk. 
+            Defaults to 10000.
+        location_name (Optional[str], optional): only measurements at this 
+            location are retrieved. Defaults to None.
+        sensor_serial_number (Optional[str], optional): only measurements of 
+            this sensor are retrieved. Defaults to None.
+        after_id (Optional[int], optional): only measurements with a larger 
+            identifier are retrieved. Defaults to None.
+        as_frame (bool, optional): whether to yield data frames or lists of 
+            rows. Defaults to True.
+        derived (bool, optional): whether to add the dew point and absolute 
+            humidity to the data frames (see humipy.derived). Defaults to 
+            False.
+
+    Yields:
+        Iterator[Union[pd.DataFrame, list]]: chunks of at most chunksize 
+            measurements, with the measurement identifier, sensor location 
+            identifier, measurement time, humidity, temperature, pressure, 
+            location name and sensor serial number.
+    """
+    measurements = humidity_measurements_table.c
+    stmt = get_measurements_rows_query().order_by(
+        measurements.measurement_time,
+        measurements.humidity_measurement_id,
+    )
+    if start is not None:
+        stmt = stmt.where(measurements.measurement_time >= start)
+    if end is not None:
+        stmt = stmt.where(measurements.measurement_time < end)
+    if location_name is not None:
+        stmt = stmt.where(locations_table.c.location_name == location_name)
+    if sensor_serial_number is not None:
+        stmt = stmt.where(
+            sensors_table.c.sensor_serial_number == sensor_serial_number
+        )
+    if after_id is not None:
+        stmt = stmt.where(measurements.humidity_measurement_id > after_id)
+
+    if as_frame:
+        import pandas as pd
+
+        if derived:
+            from humipy.derived import add_derived_metrics
+
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=chunksize
+        ).execute(stmt)
+        columns = list(result.keys())
+        for partition in result.partitions():
+            if as_frame:
+                df = pd.DataFrame.from_records(partition, columns=columns)
+                yield add_derived_metrics(df) if derived else df
+            else:
+                yield partition
+
+
+
+# The functions below return SQLAlchemy rows instead of data frames. Rows are 
+# compact named tuples, which makes these functions considerably cheaper for 
+# small lookups and for callers that iterate over the results anyway (e.g., 
+# the views). The data frame functions above are meant for analytical use.
+
+
+def _fetch_all(
+        engine: sqlalchemy.engine.base.Engine,
+        stmt: sqlalchemy.sql.selectable.Select) -> list[sqlalchemy.engine.Row]:
+    with engine.connect() as conn:
+        rows = list(conn.execute(stmt).all())
+    return rows
+
+
+@timed
+def fetch_locations(
+        engine: sqlalchemy.engine.base.Engine) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves all locations as rows.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows with the location identifier and 
+            name.
+    """
+    return _fetch_all(
+        engine, select(locations_table).order_by(locations_table.c.location_id)
+    )
+
+
+@timed
+def fetch_sensors(
+        engine: sqlalchemy.engine.base.Engine) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves all sensors as rows.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows with the sensor identifier, serial 
+            number and type.
+    """
+    return _fetch_all(
+        engine, select(sensors_table).order_by(sensors_table.c.sensor_id)
+    )
+
+
+@timed
+def fetch_sensor_locations(
+        engine: sqlalchemy.engine.base.Engine) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves all sensor locations, both open and closed, as 
+    rows.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows with the sensor location 
+            identifier, the sensor identifier, serial number and type, the 
+            location identifier and name, and the start and stop of the 
+            placement.
+    """
+    return _fetch_all(engine, get_sensor_locations_rows_query())
+
+
+@timed
+def fetch_open_sensor_locations(
+        engine: sqlalchemy.engine.base.Engine,
+        sensor_serial_number: Optional[str] = None,
+        ) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves the open sensor locations as rows, optionally 
+    only the one of a particular sensor.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        sensor_serial_number (Optional[str], optional): the sensor serial 
+            number. Defaults to None.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows with the same columns as 
+            fetch_sensor_locations.
+    """
+    stmt = (
+        get_sensor_locations_rows_query()
+        .where(sensor_locations_table.c.stop_placement == None)
+    )
+    if sensor_serial_number is not None:
+        stmt = stmt.where(
+            sensors_table.c.sensor_serial_number == sensor_serial_number
+        )
+    return _fetch_all(engine, stmt)
+
+
+@timed
+def fetch_recent_measurements(
+        engine: sqlalchemy.engine.base.Engine,
+        top_n: int) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves the n most recent humidity measurements as rows.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        top_n (int): the n most recent measurements to retrieve.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows with the measurement identifier, 
+            sensor location identifier, measurement time, humidity, 
+            temperature, pressure, location name and sensor serial number, 
+            newest first.
+    """
+    stmt = (
+        get_measurements_rows_query()
+        .order_by(humidity_measurements_table.c.measurement_time.desc())
+        .limit(top_n)
+    )
+    return _fetch_all(engine, stmt)
+
+
+@timed
+def fetch_measurements_since(
+        engine: sqlalchemy.engine.base.Engine,
+        measurement_time: Optional[datetime],
+        top_n: int) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves at most n of the most recent humidity 
+    measurements taken at or after the given date and time as rows. Only the 
+    measurements table is queried, and the measurement time index limits the 
+    rows read to the requested time window.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        measurement_time (Optional[datetime]): only measurements taken at or 
+            after this date and time are retrieved. If None, the n most 
+            recent measurements are retrieved.
+        top_n (int): the maximum number of measurements to retrieve.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows of the measurements table, newest 
+            first.
+    """
+    return _fetch_all(
+        engine, get_measurements_since_query(measurement_time, top_n)
+    )
+
+
+@timed
+def fetch_latest_measurement(
+        engine: sqlalchemy.engine.base.Engine,
+        location_name: str) -> Optional[sqlalchemy.engine.Row]:
+    """
+    This function retrieves the most recent humidity measurement at a 
+    location as a row.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        location_name (str): the location name.
+
+    Returns:
+        Optional[sqlalchemy.engine.Row]: a row with the same columns as 
+            fetch_recent_measurements, or None if there are no measurements 
+            at the location.
+    """
+    stmt = (
+        get_measurements_rows_query()
+        .where(locations_table.c.location_name == location_name)
+        .order_by(humidity_measurements_table.c.measurement_time.desc())
+        .limit(1)
+    )
+    with engine.connect() as conn:
+        row = conn.execute(stmt).first()
+    return row
+
+
+@timed
+def fetch_latest_per_location(
+        engine: sqlalchemy.engine.base.Engine) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves the latest humidity measurement of every open 
+    sensor location as rows, ordered by location name. The cost is 
+    proportional to the number of sensors, not to the number of measurements.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows with the sensor location 
+            identifier, location name, sensor serial number, measurement time 
+            and humidity. The time and humidity are None for sensor locations 
+            without measurements.
+    """
+    return _fetch_all(engine, get_latest_readings_query())
+
+
+@timed
+def fetch_recent_anomalies(
+        engine: sqlalchemy.engine.base.Engine,
+        top_n: int) -> list[sqlalchemy.engine.Row]:
+    """
+    This function retrieves the n most recent anomalous humidity 
+    measurements (spikes and out of range measurements) as rows.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        top_n (int): the n most recent anomalies to retrieve.
+
+    Returns:
+        list[sqlalchemy.engine.Row]: rows with the measurement time, location 
+            name, sensor serial number, humidity, anomaly type, baseline and 
+            deviation (in standard deviations), newest first.
+    """
+    anomalies = humidity_anomalies_table.c
+    stmt = (
+        select(
+            anomalies.measurement_time,
+            locations_table.c.location_name,
+            sensors_table.c.sensor_serial_number,
+            anomalies.humidity,
+            anomalies.anomaly_type,
+            anomalies.baseline,
+            anomalies.deviation,
+        )
+        .join_from(
+            humidity_anomalies_table,
+            sensor_locations_table,
+            (
+                anomalies.sensor_location_id
+                == sensor_locations_table.c.sensor_location_id
+            ),
+        )
+        .join_from(
+            sensor_locations_table,
+            sensors_table,
+            sensor_locations_table.c.sensor_id == sensors_table.c.sensor_id,
+        )
+        .join_from(
+            sensor_locations_table,
+            locations_table,
+            sensor_locations_table.c.location_id == locations_table.c.location_id
+        )
+        .order_by(anomalies.measurement_time.desc())
+        .limit(top_n)
+    )
+    return _fetch_all(engine, stmt)
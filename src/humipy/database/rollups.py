@@ -0,0 +1,235 @@
+"""
+This module maintains the hourly and daily rollup tables of the humidity
+measurements. Every rollup row holds the count, sum, minimum and maximum of
+the humidity measurements of one sensor location in one time bucket. The
+rollups are updated incrementally in the same transaction as the insert of
+new measurements, and can be rebuilt from the raw measurements.
+"""
+
+
+from datetime import datetime
+from humipy.database.models import (
+    daily_humidity_rollups_table,
+    hourly_humidity_rollups_table,
+    humidity_measurements_table,
+)
+import math
+import sqlalchemy
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from typing import Callable, Iterable, Optional, Union
+
+
+ROLLUP_TABLES = {
+    "hour": hourly_humidity_rollups_table,
+    "day": daily_humidity_rollups_table,
+}
+
+
+_SQLITE_BUCKET_FORMATS = {
+    "minute": "%Y-%m-%d %H:%M:00.000000",
+    "hour": "%Y-%m-%d %H:00:00.000000",
+    "day": "%Y-%m-%d 00:00:00.000000",
+}
+
+
+def truncate(dt: datetime, bucket: str) -> datetime:
+    """
+    This function truncates a date and time to the start of its bucket.
+
+    Args:
+        dt (datetime): the date and time.
+        bucket (str): the bucket size ('minute', 'hour' or 'day').
+
+    Returns:
+        datetime: the start of the bucket.
+    """
+    if bucket == "minute":
+        return dt.replace(second=0, microsecond=0)
+    if bucket == "hour":
+        return dt.replace(minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown bucket size: {bucket}.")
+
+
+def bucket_expression(
+        dialect_name: str,
+        column: sqlalchemy.ColumnElement,
+        bucket: str) -> sqlalchemy.ColumnElement:
+    """
+    This function returns a SQL expression that truncates a date and time
+    column to the start of its bucket.
+
+    Args:
+        dialect_name (str): the name of the database dialect.
+        column (sqlalchemy.ColumnElement): the date and time column.
+        bucket (str): the bucket size ('minute', 'hour' or 'day').
+
+    Returns:
+        sqlalchemy.ColumnElement: the bucket start expression.
+    """
+    if bucket not in _SQLITE_BUCKET_FORMATS:
+        raise ValueError(f"Unknown bucket size: {bucket}.")
+    if dialect_name == "sqlite":
+        # SQLite stores date and time values as strings, so the bucket start
+        # is formatted the same way SQLAlchemy stores a datetime
+        expr = func.strftime(_SQLITE_BUCKET_FORMATS[bucket], column)
+    else:
+        expr = func.date_trunc(bucket, column)
+    return sqlalchemy.type_coerce(expr, sqlalchemy.DateTime)
+
+
+def update_rollups(
+        conn: sqlalchemy.engine.base.Connection,
+        measurements: Iterable[dict]) -> None:
+    """
+    This function folds new humidity measurements into the rollup tables.
+
+    Args:
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection,
+            preferably the one that inserted the measurements.
+        measurements (Iterable[dict]): the new measurements, each with a
+            sensor location identifier, humidity and measurement time.
+    """
+    # Missing and NaN values are left out, like NULL values in SQL aggregates
+    measurements = [
+        row for row in measurements
+        if row["humidity"] is not None and not math.isnan(row["humidity"])
+    ]
+    if not measurements:
+        return
+    for bucket, table in ROLLUP_TABLES.items():
+        aggregates: dict[
+            tuple[int, datetime], tuple[int, float, float, float]
+        ] = {}
+        for row in measurements:
+            key = (
+                row["sensor_location_id"],
+                truncate(row["measurement_time"], bucket),
+            )
+            humidity = row["humidity"]
+            if key in aggregates:
+                count, total, minimum, maximum = aggregates[key]
+                aggregates[key] = (
+                    count + 1,
+                    total + humidity,
+                    min(minimum, humidity),
+                    max(maximum, humidity),
+                )
+            else:
+                aggregates[key] = (1, humidity, humidity, humidity)
+        conn.execute(
+            _get_rollup_upsert(conn.dialect.name, table),
+            [
+                {
+                    "sensor_location_id": sensor_location_id,
+                    "bucket_start": bucket_start,
+                    "measurement_count": count,
+                    "humidity_sum": total,
+                    "humidity_min": minimum,
+                    "humidity_max": maximum,
+                }
+                for (sensor_location_id, bucket_start), (
+                    count, total, minimum, maximum
+                ) in aggregates.items()
+            ],
+        )
+
+
+def rebuild_rollups(
+        engine: sqlalchemy.engine.base.Engine,
+        since: Optional[datetime] = None) -> None:
+    """
+    This function recomputes the rollup tables from the raw humidity
+    measurements, e.g., after measurements were loaded without updating the
+    rollups.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        since (Optional[datetime], optional): only the buckets starting at or
+            after the bucket of this date and time are rebuilt. If None, the
+            rollups are rebuilt from the first raw measurement on, so that
+            the rollups of measurements removed by the retention policy are
+            kept. Defaults to None.
+    """
+    measurements = humidity_measurements_table.c
+    with engine.begin() as conn:
+        if since is None:
+            since = conn.scalar(select(func.min(measurements.measurement_time)))
+            if since is None:
+                return
+        for bucket, table in ROLLUP_TABLES.items():
+            bucket_start = bucket_expression(
+                conn.dialect.name, measurements.measurement_time, bucket
+            )
+            stmt = (
+                select(
+                    measurements.sensor_location_id,
+                    bucket_start,
+                    func.count(measurements.humidity),
+                    func.coalesce(func.sum(measurements.humidity), 0.),
+                    func.min(measurements.humidity),
+                    func.max(measurements.humidity),
+                )
+                .group_by(measurements.sensor_location_id, bucket_start)
+            )
+            since = truncate(since, bucket)
+            stmt = stmt.where(measurements.measurement_time >= since)
+            conn.execute(delete(table).where(table.c.bucket_start >= since))
+            conn.execute(
+                insert(table).from_select(
+                    [
+                        "sensor_location_id",
+                        "bucket_start",
+                        "measurement_count",
+                        "humidity_sum",
+                        "humidity_min",
+                        "humidity_max",
+                    ],
+                    stmt,
+                )
+            )
+
+
+def _get_rollup_upsert(
+        dialect_name: str,
+        table: sqlalchemy.Table) -> sqlalchemy.sql.dml.Insert:
+    """
+    This function creates an insert statement that adds the aggregates to an
+    existing rollup row, or creates the row if it does not exist yet.
+
+    Args:
+        dialect_name (str): the name of the database dialect.
+        table (sqlalchemy.Table): the rollup table.
+
+    Returns:
+        sqlalchemy.sql.dml.Insert: a SQLAlchemy insert construct.
+    """
+    stmt: Union[postgresql.Insert, sqlite.Insert]
+    least: Callable[..., sqlalchemy.ColumnElement]
+    greatest: Callable[..., sqlalchemy.ColumnElement]
+    if dialect_name == "postgresql":
+        stmt = postgresql.insert(table)
+        least, greatest = func.least, func.greatest
+    else:
+        # The scalar min and max functions of SQLite take multiple arguments
+        stmt = sqlite.insert(table)
+        least, greatest = func.min, func.max
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.sensor_location_id, table.c.bucket_start],
+        set_={
+            "measurement_count": (
+                table.c.measurement_count + stmt.excluded.measurement_count
+            ),
+            "humidity_sum": table.c.humidity_sum + stmt.excluded.humidity_sum,
+            "humidity_min": least(
+                func.coalesce(table.c.humidity_min, stmt.excluded.humidity_min),
+                stmt.excluded.humidity_min,
+            ),
+            "humidity_max": greatest(
+                func.coalesce(table.c.humidity_max, stmt.excluded.humidity_max),
+                stmt.excluded.humidity_max,
+            ),
+        },
+    )
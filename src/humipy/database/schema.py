@@ -0,0 +1,215 @@
+"""
+This module brings an existing database up to date with the tables, nullable
+columns, indexes and unique constraints defined in humipy.database.models.
+"""
+
+
+from datetime import datetime
+from humipy.database.latest import fill_latest_readings
+from humipy.database.models import (
+    humidity_measurements_table,
+    latest_readings_table,
+    metadata,
+    sensor_locations_table,
+)
+from humipy.database.rollups import rebuild_rollups
+import sqlalchemy
+from sqlalchemy import (
+    Index,
+    MetaData,
+    delete,
+    func,
+    inspect,
+    select,
+    text,
+    update,
+)
+
+
+def upgrade(engine: sqlalchemy.engine.base.Engine) -> list[str]:
+    """
+    This function creates the tables, indexes and unique constraints that are
+    missing from the database, and adds missing nullable columns. Before a
+    unique index is created, the duplicate rows are removed, keeping the
+    first row, and a non-unique index on the same columns is dropped. An
+    existing index that has become unique is recreated. As the sensor
+    locations are referenced by the measurements, the duplicate open sensor
+    locations of a sensor are stopped rather than removed: all but the last
+    one are stopped when the last one started. Other existing objects are
+    left untouched, so the function can safely be run repeatedly.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+
+    Returns:
+        list[str]: a description of every change that was applied.
+    """
+    applied = []
+    removed_measurements = 0
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        existing_tables = set(inspector.get_table_names())
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                table.create(conn)
+                applied.append(f"created table {table.name}")
+                if table is latest_readings_table:
+                    fill_latest_readings(conn)
+                    applied.append(f"filled table {table.name}")
+                continue
+
+            existing_columns = {
+                column["name"] for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                if column.name not in existing_columns and column.nullable:
+                    column_type = column.type.compile(conn.dialect)
+                    conn.execute(
+                        text(
+                            f"ALTER TABLE {table.name} ADD COLUMN "
+                            f"{column.name} {column_type} NULL"
+                        )
+                    )
+                    applied.append(
+                        f"added column {column.name} to {table.name}"
+                    )
+
+            existing_indexes = inspector.get_indexes(table.name)
+            existing_unique = {
+                index["name"]: index["unique"] for index in existing_indexes
+            }
+            indexes = sorted(table.indexes, key=lambda index: str(index.name))
+            for index in indexes:
+                if index.name in existing_unique:
+                    if not index.unique or existing_unique[index.name]:
+                        continue
+                    conn.execute(text(f"DROP INDEX {index.name}"))
+                    applied.append(f"dropped index {index.name}")
+                columns = [column.name for column in index.columns]
+                if index.unique and table is sensor_locations_table:
+                    stopped = _stop_duplicate_placements(conn)
+                    if stopped:
+                        applied.append(
+                            f"stopped {stopped} duplicate open sensor "
+                            f"locations"
+                        )
+                elif index.unique:
+                    removed = _remove_duplicates(conn, table, columns)
+                    if removed:
+                        applied.append(
+                            f"removed {removed} duplicate rows from "
+                            f"{table.name}"
+                        )
+                    if table is humidity_measurements_table:
+                        removed_measurements += removed
+                index.create(conn)
+                applied.append(f"created index {index.name}")
+                if not index.unique:
+                    continue
+                # The unique index supersedes a plain index on its columns
+                for existing_index in existing_indexes:
+                    if (
+                            existing_index["column_names"] == columns
+                            and not existing_index["unique"]
+                            and existing_index["name"] != index.name):
+                        conn.execute(
+                            text(f"DROP INDEX {existing_index['name']}")
+                        )
+                        applied.append(
+                            f"dropped index {existing_index['name']}"
+                        )
+
+            # Unique columns may already be covered by a unique constraint
+            # (e.g., created by db_management.sql) or by a unique index
+            unique_column_sets = [
+                constraint["column_names"]
+                for constraint in inspector.get_unique_constraints(table.name)
+            ] + [
+                index["column_names"]
+                for index in existing_indexes if index["unique"]
+            ]
+            for column in table.columns:
+                if column.unique and [column.name] not in unique_column_sets:
+                    # Build the index on a copy of the table, so that it is 
+                    # not added to the shared metadata
+                    table_copy = table.to_metadata(MetaData())
+                    index = Index(
+                        f"uq_{table.name}_{column.name}",
+                        table_copy.c[column.name],
+                        unique=True,
+                    )
+                    index.create(conn)
+                    applied.append(f"created unique index {index.name}")
+
+    # The rollups counted the removed duplicates
+    if removed_measurements:
+        rebuild_rollups(engine)
+        applied.append("rebuilt the rollups")
+    return applied
+
+
+def _remove_duplicates(
+        conn: sqlalchemy.engine.base.Connection,
+        table: sqlalchemy.Table,
+        columns: list[str]) -> int:
+    """
+    This function removes the rows that have the same values in the given
+    columns as a row with a lower primary key, without committing.
+
+    Args:
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+        table (sqlalchemy.Table): the table.
+        columns (list[str]): the columns that must be unique.
+
+    Returns:
+        int: the number of rows removed.
+    """
+    primary_key = list(table.primary_key.columns)[0]
+    first_rows = (
+        select(func.min(primary_key))
+        .group_by(*(table.c[column] for column in columns))
+    )
+    res = conn.execute(delete(table).where(primary_key.not_in(first_rows)))
+    return res.rowcount
+
+
+def _stop_duplicate_placements(
+        conn: sqlalchemy.engine.base.Connection) -> int:
+    """
+    This function stops the open sensor locations of every sensor with more
+    than one, except the one that started last, at the start of that one,
+    without committing.
+
+    Args:
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+
+    Returns:
+        int: the number of sensor locations stopped.
+    """
+    sensor_locations = sensor_locations_table.c
+    rows = conn.execute(
+        select(
+            sensor_locations.sensor_location_id,
+            sensor_locations.sensor_id,
+            sensor_locations.start_placement,
+        )
+        .where(sensor_locations.stop_placement == None)
+        .order_by(
+            sensor_locations.sensor_id,
+            sensor_locations.start_placement.desc(),
+            sensor_locations.sensor_location_id.desc(),
+        )
+    ).all()
+    stopped = 0
+    last_start: dict[int, datetime] = {}
+    for sensor_location_id, sensor_id, start_placement in rows:
+        if sensor_id not in last_start:
+            last_start[sensor_id] = start_placement
+            continue
+        conn.execute(
+            update(sensor_locations_table)
+            .where(sensor_locations.sensor_location_id == sensor_location_id)
+            .values(stop_placement=last_start[sensor_id])
+        )
+        stopped += 1
+    return stopped
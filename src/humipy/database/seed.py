@@ -0,0 +1,359 @@
+"""
+This module populates a development database with synthetic locations,
+sensors, sensor placements and humidity measurements. All rows are written
+with bulk inserts in a single transaction, so that databases with millions of
+measurements can be created in seconds.
+"""
+
+
+from datetime import datetime, timedelta
+from humipy.database.anomalies import compute_statistics
+from humipy.database.models import (
+    daily_humidity_rollups_table,
+    hourly_humidity_rollups_table,
+    humidity_anomalies_table,
+    humidity_measurements_table,
+    latest_readings_table,
+    locations_table,
+    metadata,
+    sensor_locations_table,
+    sensor_statistics_table,
+    sensors_table,
+)
+import numpy as np
+import sqlalchemy
+from sqlalchemy import insert, select
+from typing import Optional
+
+
+LOCATIONS = ["Kitchen", "Bathroom", "Bedroom"]
+SENSORS = ["XIE-385A92H20-T0", "XIA-502A92V37-T7"]
+
+
+_BATCH_SIZE = 50000
+
+
+def seed_database(
+        engine: sqlalchemy.engine.base.Engine,
+        n_locations: int = 3,
+        n_sensors: int = 2,
+        n_measurements: int = 1000,
+        span: timedelta = timedelta(days=1),
+        end: Optional[datetime] = None,
+        seed: Optional[int] = None) -> None:
+    """
+    This function creates the tables and populates them with synthetic data.
+    Every sensor is placed at a location, and the measurements are spread
+    over the sensors and over the time span with a realistic daily humidity
+    cycle.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        n_locations (int, optional): the number of locations. Defaults to 3.
+        n_sensors (int, optional): the number of sensors. Defaults to 2.
+        n_measurements (int, optional): the number of measurements. Defaults
+            to 1000.
+        span (timedelta, optional): the time span of the measurements.
+            Defaults to one day.
+        end (Optional[datetime], optional): the time of the last measurement.
+            If None, the current date and time is used. Defaults to None.
+        seed (Optional[int], optional): the seed of the random number
+            generator. Defaults to None.
+    """
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        seed_connection(
+            conn, n_locations, n_sensors, n_measurements, span, end, seed
+        )
+
+
+def seed_connection(
+        conn: sqlalchemy.engine.base.Connection,
+        n_locations: int = 3,
+        n_sensors: int = 2,
+        n_measurements: int = 1000,
+        span: timedelta = timedelta(days=1),
+        end: Optional[datetime] = None,
+        seed: Optional[int] = None) -> None:
+    """
+    This function populates existing tables with synthetic data, like 
+    seed_database, without committing. It allows seeding through a 
+    connection, e.g., the synchronous connection of an async engine.
+
+    Args:
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+        n_locations (int, optional): the number of locations. Defaults to 3.
+        n_sensors (int, optional): the number of sensors. Defaults to 2.
+        n_measurements (int, optional): the number of measurements. Defaults 
+            to 1000.
+        span (timedelta, optional): the time span of the measurements. 
+            Defaults to one day.
+        end (Optional[datetime], optional): the time of the last measurement. 
+            If None, the current date and time is used. Defaults to None.
+        seed (Optional[int], optional): the seed of the random number 
+            generator. Defaults to None.
+    """
+    if n_locations < 1 or n_sensors < 1:
+        raise ValueError(
+            "The test database needs at least one location and one sensor."
+        )
+    if n_measurements < 0:
+        raise ValueError("The number of measurements cannot be negative.")
+    rng = np.random.default_rng(seed)
+    end = datetime.now() if end is None else end
+    start = end - span
+    location_names = [
+        LOCATIONS[i] if i < len(LOCATIONS) else f"Location {i + 1}"
+        for i in range(n_locations)
+    ]
+    serial_numbers = [
+        SENSORS[i] if i < len(SENSORS) else f"DEV-{i + 1:08d}-T0"
+        for i in range(n_sensors)
+    ]
+
+    conn.execute(
+        insert(locations_table),
+        [{"location_name": name} for name in location_names],
+    )
+    conn.execute(
+        insert(sensors_table),
+        [
+            {"sensor_serial_number": serial_number, "sensor_type": "DHT11"}
+            for serial_number in serial_numbers
+        ],
+    )
+    location_ids = dict(
+        conn.execute(
+            select(
+                locations_table.c.location_name,
+                locations_table.c.location_id,
+            )
+        ).tuples().all()
+    )
+    sensor_ids = dict(
+        conn.execute(
+            select(
+                sensors_table.c.sensor_serial_number,
+                sensors_table.c.sensor_id,
+            )
+        ).tuples().all()
+    )
+    # The first two sensors are placed in the bathroom and the kitchen, 
+    # as in the original development database
+    placements = [
+        {
+            "sensor_id": sensor_ids[serial_number],
+            "location_id": location_ids[
+                location_names[{0: 1, 1: 0}.get(i, i) % n_locations]
+            ],
+            "start_placement": start,
+        }
+        for i, serial_number in enumerate(serial_numbers)
+    ]
+    conn.execute(insert(sensor_locations_table), placements)
+    sensor_location_ids = np.array(
+        conn.execute(
+            select(sensor_locations_table.c.sensor_location_id)
+            .order_by(sensor_locations_table.c.sensor_location_id)
+        ).scalars().all()
+    )
+
+    # Spread the measurements evenly over the time span, and give every
+    # sensor location its own baseline around which the humidity follows
+    # a daily cycle
+    offsets = np.sort(
+        rng.uniform(0., span.total_seconds(), n_measurements)
+    )
+    which = rng.integers(0, len(sensor_location_ids), n_measurements)
+    baselines = rng.uniform(55., 70., len(sensor_location_ids))
+    humidity = (
+        baselines[which]
+        + 5. * np.sin(2. * np.pi * offsets / 86400.)
+        + rng.normal(0., 1.5, n_measurements)
+    ).clip(0., 100.)
+    # The temperature follows the opposite daily cycle, as the DHT11 sensors 
+    # report it with the humidity
+    temperature = (
+        20.
+        - 2. * np.sin(2. * np.pi * offsets / 86400.)
+        + rng.normal(0., .5, n_measurements)
+    )
+    # The measurement times are made strictly increasing, as a sensor 
+    # location cannot take two measurements at the same time
+    microseconds = (offsets * 1e6).astype(np.int64)
+    steps = np.arange(n_measurements)
+    microseconds = np.maximum.accumulate(microseconds - steps) + steps
+    measurements = {
+        "sensor_location_id": sensor_location_ids[which],
+        "humidity": humidity,
+        "measurement_time": (
+            np.datetime64(start, "us")
+            + microseconds.astype("timedelta64[us]")
+        ),
+        "temperature": temperature,
+    }
+    _bulk_insert(conn, humidity_measurements_table, measurements)
+    # The measurements are sorted by time, so the last measurement of 
+    # every sensor location is its latest reading
+    last = len(which) - 1 - np.unique(which[::-1], return_index=True)[1]
+    _bulk_insert(
+        conn,
+        latest_readings_table,
+        {
+            name: measurements[name][last]
+            for name in latest_readings_table.columns.keys()
+        },
+    )
+    _seed_statistics(conn, measurements, last)
+    for table, unit in [
+            (hourly_humidity_rollups_table, "h"),
+            (daily_humidity_rollups_table, "D")]:
+        _bulk_insert(
+            conn,
+            table,
+            _get_rollup_columns(
+                measurements["sensor_location_id"],
+                measurements["humidity"],
+                measurements["measurement_time"],
+                unit,
+            ),
+        )
+
+
+def _seed_statistics(
+        conn: sqlalchemy.engine.base.Connection,
+        measurements: dict,
+        last: np.ndarray) -> None:
+    """
+    This function fills the sensor statistics and the anomalies of the 
+    measurements, which are sorted by time.
+
+    Args:
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+        measurements (dict): the NumPy column per column name.
+        last (np.ndarray): the index of the last measurement of every sensor 
+            location.
+    """
+    state, anomalies = compute_statistics(
+        measurements["sensor_location_id"], measurements["humidity"], {}
+    )
+    sensor_location_ids = measurements["sensor_location_id"][last]
+    _bulk_insert(
+        conn,
+        sensor_statistics_table,
+        {
+            "sensor_location_id": sensor_location_ids,
+            "measurement_count": np.array(
+                [state[i][0] for i in sensor_location_ids.tolist()]
+            ),
+            "humidity_ewma": np.array(
+                [state[i][1] for i in sensor_location_ids.tolist()]
+            ),
+            "humidity_ewm_variance": np.array(
+                [state[i][2] for i in sensor_location_ids.tolist()]
+            ),
+            "last_measurement_time": measurements["measurement_time"][last],
+        },
+    )
+    if anomalies:
+        index = np.array([anomaly[0] for anomaly in anomalies])
+        _bulk_insert(
+            conn,
+            humidity_anomalies_table,
+            {
+                "sensor_location_id": (
+                    measurements["sensor_location_id"][index]
+                ),
+                "measurement_time": measurements["measurement_time"][index],
+                "humidity": measurements["humidity"][index],
+                "anomaly_type": np.array(
+                    [anomaly[1] for anomaly in anomalies]
+                ),
+                "baseline": np.array([anomaly[2] for anomaly in anomalies]),
+                "deviation": np.array([anomaly[3] for anomaly in anomalies]),
+            },
+        )
+
+
+def _get_rollup_columns(
+        sensor_location_ids: np.ndarray,
+        humidity: np.ndarray,
+        times: np.ndarray,
+        unit: str) -> dict:
+    """
+    This function computes the rollup rows of humidity measurements with 
+    NumPy.
+
+    Args:
+        sensor_location_ids (np.ndarray): the sensor location identifiers.
+        humidity (np.ndarray): the humidity measurements.
+        times (np.ndarray): the measurement times (datetime64[us]).
+        unit (str): the NumPy unit of the buckets ('h' or 'D').
+
+    Returns:
+        dict: the columns of the rollup rows.
+    """
+    buckets = times.astype(f"datetime64[{unit}]")
+    order = np.lexsort((buckets, sensor_location_ids))
+    sensor_location_ids = sensor_location_ids[order]
+    buckets = buckets[order]
+    humidity = humidity[order]
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = (
+        (sensor_location_ids[1:] != sensor_location_ids[:-1])
+        | (buckets[1:] != buckets[:-1])
+    )
+    starts = np.flatnonzero(is_first)
+    return {
+        "sensor_location_id": sensor_location_ids[starts],
+        "bucket_start": buckets[starts].astype("datetime64[us]"),
+        "measurement_count": np.diff(np.append(starts, len(order))),
+        "humidity_sum": np.add.reduceat(humidity, starts),
+        "humidity_min": np.minimum.reduceat(humidity, starts),
+        "humidity_max": np.maximum.reduceat(humidity, starts),
+    }
+
+
+def _bulk_insert(
+        conn: sqlalchemy.engine.base.Connection,
+        table: sqlalchemy.Table,
+        columns: dict) -> None:
+    """
+    This function bulk inserts rows given as NumPy columns, in batches. On 
+    SQLite, date and time columns are formatted with NumPy the way SQLAlchemy 
+    stores them, and the rows are passed straight to the driver, which avoids 
+    the per-row type processing of SQLAlchemy.
+
+    Args:
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+        table (sqlalchemy.Table): the table.
+        columns (dict): the NumPy array per column name, with date and time 
+            columns as datetime64[us].
+    """
+    sqlite = conn.dialect.name == "sqlite"
+    if sqlite:
+        columns = {
+            name: (
+                np.char.replace(
+                    np.datetime_as_string(values, unit="us"), "T", " "
+                )
+                if np.issubdtype(values.dtype, np.datetime64) else values
+            )
+            for name, values in columns.items()
+        }
+        stmt = (
+            f"INSERT INTO {table.name} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})"
+        )
+    n_rows = len(next(iter(columns.values())))
+    for i in range(0, n_rows, _BATCH_SIZE):
+        batch = [
+            values[i:i + _BATCH_SIZE].tolist() for values in columns.values()
+        ]
+        if sqlite:
+            conn.exec_driver_sql(stmt, list(zip(*batch)))
+        else:
+            conn.execute(
+                insert(table),
+                [dict(zip(columns, row)) for row in zip(*batch)],
+            )
@@ -0,0 +1,489 @@
+"""
+This module holds the queries and the connection-level write steps that are
+shared by the synchronous API (humipy.database.read and
+humipy.database.write) and the async API (humipy.database.aio). The write
+steps take a connection and do not commit, so that they can run inside a
+transaction of the synchronous API or through AsyncConnection.run_sync.
+"""
+
+
+from datetime import datetime, timedelta
+from humipy.database.anomalies import update_statistics
+from humipy.database.cache import get_sensor_location_cache
+from humipy.database.latest import update_latest_readings
+from humipy.database.models import (
+    humidity_measurements_table,
+    latest_readings_table,
+    locations_table,
+    sensors_table,
+    sensor_locations_table,
+)
+from humipy.database.rollups import update_rollups
+import math
+import sqlalchemy
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from typing import Iterable, Optional, Union
+
+
+def get_measurements_rows_query() -> sqlalchemy.sql.selectable.Select:
+    """
+    This function creates a base query to retrieve humidity measurements with 
+    their location name and sensor serial number. Unlike the query used for 
+    the data frames, only the columns of interest are selected, so that the 
+    rows have no duplicate column names.
+
+    Returns:
+        sqlalchemy.sql.selectable.Select: a SQLAlchemy select construct.
+    """
+    return (
+        select(
+            humidity_measurements_table.c.humidity_measurement_id,
+            humidity_measurements_table.c.sensor_location_id,
+            humidity_measurements_table.c.measurement_time,
+            humidity_measurements_table.c.humidity,
+            humidity_measurements_table.c.temperature,
+            humidity_measurements_table.c.pressure,
+            locations_table.c.location_name,
+            sensors_table.c.sensor_serial_number,
+        )
+        .join_from(
+            humidity_measurements_table,
+            sensor_locations_table,
+            (
+                humidity_measurements_table.c.sensor_location_id
+                == sensor_locations_table.c.sensor_location_id
+            ),
+        )
+        .join_from(
+            sensor_locations_table,
+            sensors_table,
+            sensor_locations_table.c.sensor_id == sensors_table.c.sensor_id,
+        )
+        .join_from(
+            sensor_locations_table,
+            locations_table,
+            sensor_locations_table.c.location_id == locations_table.c.location_id
+        )
+    )
+
+
+def get_sensor_locations_rows_query() -> sqlalchemy.sql.selectable.Select:
+    """
+    This function creates a base query to retrieve sensor locations with 
+    their sensor and location details, selecting every column once.
+
+    Returns:
+        sqlalchemy.sql.selectable.Select: a SQLAlchemy select construct.
+    """
+    return (
+        select(
+            sensor_locations_table.c.sensor_location_id,
+            sensors_table.c.sensor_id,
+            sensors_table.c.sensor_serial_number,
+            sensors_table.c.sensor_type,
+            locations_table.c.location_id,
+            locations_table.c.location_name,
+            sensor_locations_table.c.start_placement,
+            sensor_locations_table.c.stop_placement,
+        )
+        .join_from(
+            sensor_locations_table,
+            sensors_table,
+            sensor_locations_table.c.sensor_id == sensors_table.c.sensor_id,
+        )
+        .join_from(
+            sensor_locations_table,
+            locations_table,
+            sensor_locations_table.c.location_id == locations_table.c.location_id
+        )
+    )
+
+
+def get_measurements_since_query(
+        measurement_time: Optional[datetime],
+        top_n: int) -> sqlalchemy.sql.selectable.Select:
+    """
+    This function creates a query to retrieve at most n of the most recent 
+    humidity measurements taken at or after the given date and time. Only 
+    the measurements table is queried, and the measurement time index limits 
+    the rows read to the requested time window.
+
+    Args:
+        measurement_time (Optional[datetime]): only measurements taken at or 
+            after this date and time are retrieved. If None, the n most 
+            recent measurements are retrieved.
+        top_n (int): the maximum number of measurements to retrieve.
+
+    Returns:
+        sqlalchemy.sql.selectable.Select: a SQLAlchemy select construct.
+    """
+    measurements = humidity_measurements_table.c
+    stmt = (
+        select(humidity_measurements_table)
+        .order_by(
+            measurements.measurement_time.desc(),
+            measurements.humidity_measurement_id.desc(),
+        )
+        .limit(top_n)
+    )
+    if measurement_time is not None:
+        stmt = stmt.where(measurements.measurement_time >= measurement_time)
+    return stmt
+
+
+def get_latest_readings_query() -> sqlalchemy.sql.selectable.Select:
+    """
+    This function creates a query to retrieve the latest reading of every 
+    open sensor location, with its location name and sensor serial number. 
+    Sensor locations without measurements have no time and humidity.
+
+    Returns:
+        sqlalchemy.sql.selectable.Select: a SQLAlchemy select construct.
+    """
+    return (
+        select(
+            sensor_locations_table.c.sensor_location_id,
+            locations_table.c.location_name,
+            sensors_table.c.sensor_serial_number,
+            latest_readings_table.c.measurement_time,
+            latest_readings_table.c.humidity,
+        )
+        .join_from(
+            sensor_locations_table,
+            sensors_table,
+            sensor_locations_table.c.sensor_id == sensors_table.c.sensor_id,
+        )
+        .join_from(
+            sensor_locations_table,
+            locations_table,
+            sensor_locations_table.c.location_id == locations_table.c.location_id
+        )
+        .outerjoin_from(
+            sensor_locations_table,
+            latest_readings_table,
+            (
+                sensor_locations_table.c.sensor_location_id
+                == latest_readings_table.c.sensor_location_id
+            ),
+        )
+        .where(sensor_locations_table.c.stop_placement == None)
+        .order_by(
+            locations_table.c.location_name,
+            sensors_table.c.sensor_serial_number,
+        )
+    )
+
+
+def get_measurement_rows(
+        engine: sqlalchemy.engine.base.Engine,
+        conn: sqlalchemy.engine.base.Connection,
+        readings: list[tuple]) -> list[dict]:
+    """
+    This function turns readings into measurement rows, attributing every 
+    reading to the sensor location of its sensor at its measurement time. 
+    The open sensor locations are resolved through the sensor location 
+    cache. Only the readings that predate the open placement of their 
+    sensor, or of sensors without an open placement, are looked up in the 
+    placement history, with a single query. Readings outside every 
+    placement of their sensor are skipped. The readings are checked before 
+    anything is resolved, so that a batch with a non-finite value is 
+    rejected as a whole.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+        readings (list[tuple]): the readings as (sensor serial number, 
+            humidity, measurement time[, temperature[, pressure]]) tuples.
+
+    Raises:
+        ValueError: if a humidity, temperature or pressure is NaN or 
+            infinite.
+
+    Returns:
+        list[dict]: the measurement rows.
+    """
+    for reading in readings:
+        for name, value in zip(
+                ("humidity", "temperature", "pressure"),
+                (reading[1], *reading[3:5])):
+            # NaN and infinity would poison the rollup sums and the 
+            # statistics, and NaN would be read back as NULL
+            if value is not None and not math.isfinite(value):
+                raise ValueError(
+                    f"The {name} of sensor {reading[0]} is not finite: "
+                    f"{value}."
+                )
+    open_sensor_locations = _resolve_open_sensor_locations(
+        engine, conn, {reading[0] for reading in readings}
+    )
+    now = datetime.now()
+    rows = []
+    late = []
+    for i, reading in enumerate(readings):
+        serial_number, humidity, timestamp, temperature, pressure = (
+            *reading, None, None
+        )[:5]
+        if timestamp is None:
+            # Readings without a time are one microsecond apart, so that 
+            # they do not collide on the (sensor location, measurement time) 
+            # key
+            timestamp = now + timedelta(microseconds=i)
+        elif timestamp.tzinfo is not None:
+            # The measurement times are stored as naive local times
+            timestamp = timestamp.astimezone().replace(tzinfo=None)
+        row = {
+            "sensor_location_id": None,
+            "humidity": humidity,
+            "measurement_time": timestamp,
+            "temperature": temperature,
+            "pressure": pressure,
+        }
+        open_sensor_location = open_sensor_locations.get(serial_number)
+        if (
+                open_sensor_location is not None
+                and timestamp >= open_sensor_location[1]):
+            row["sensor_location_id"] = open_sensor_location[0]
+        else:
+            late.append((serial_number, row))
+        rows.append(row)
+
+    if late:
+        placements = _get_sensor_location_history(
+            conn, {serial_number for serial_number, _ in late}
+        )
+        for serial_number, row in late:
+            for sensor_location_id, start, stop in placements.get(
+                    serial_number, []):
+                if start <= row["measurement_time"] and (
+                        stop is None or row["measurement_time"] < stop):
+                    row["sensor_location_id"] = sensor_location_id
+                    break
+    return [row for row in rows if row["sensor_location_id"] is not None]
+
+
+def get_missing_placement_message(reading: tuple) -> str:
+    if reading[2] is None:
+        return f"There is no open sensor location for sensor {reading[0]}."
+    return (
+        f"There is no sensor location for sensor {reading[0]} at "
+        f"{reading[2]}."
+    )
+
+
+def insert_ignore(
+        conn: sqlalchemy.engine.base.Connection,
+        table: sqlalchemy.Table,
+        column: sqlalchemy.Column,
+        rows: list[dict],
+        where: Optional[sqlalchemy.ColumnElement] = None) -> list:
+    """
+    This function inserts rows with a single statement, skipping the rows 
+    that conflict with an existing row on a unique column, without 
+    committing.
+
+    Args:
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+        table (sqlalchemy.Table): the table.
+        column (sqlalchemy.Column): the unique column.
+        rows (list[dict]): the rows.
+        where (Optional[sqlalchemy.ColumnElement], optional): the condition 
+            of a partial unique index on the column. Defaults to None.
+
+    Returns:
+        list: the values of the unique column of the inserted rows.
+    """
+    if not rows:
+        return []
+    stmt: Union[postgresql.Insert, sqlite.Insert]
+    if conn.dialect.name == "postgresql":
+        stmt = postgresql.insert(table)
+    else:
+        stmt = sqlite.insert(table)
+    res = conn.execute(
+        stmt.on_conflict_do_nothing(
+            index_elements=[column], index_where=where
+        ).returning(column),
+        rows,
+    )
+    created = set(res.scalars().all())
+    return [row[column.name] for row in rows if row[column.name] in created]
+
+
+def insert_measurements(
+        conn: sqlalchemy.engine.base.Connection,
+        rows: list[dict]) -> int:
+    """
+    This function inserts humidity measurements, skipping the measurements 
+    that were written already, and folds the new measurements into the 
+    rollup tables, the latest readings and the sensor statistics (flagging 
+    anomalies), without committing.
+
+    Args:
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+        rows (list[dict]): the measurements, each with a sensor location 
+            identifier, humidity and measurement time.
+
+    Returns:
+        int: the number of measurements that were inserted.
+    """
+    # Duplicates within the batch are dropped, keeping the first measurement
+    unique_rows: dict[tuple[int, datetime], dict] = {}
+    for row in rows:
+        unique_rows.setdefault(
+            (row["sensor_location_id"], row["measurement_time"]), row
+        )
+    rows = list(unique_rows.values())
+    if not rows:
+        return 0
+
+    table = humidity_measurements_table
+    stmt: Union[postgresql.Insert, sqlite.Insert]
+    if conn.dialect.name == "postgresql":
+        stmt = postgresql.insert(table)
+    else:
+        stmt = sqlite.insert(table)
+    # Without a conflict target, databases that do not have the unique index 
+    # yet (see humipy.database.schema) keep accepting measurements
+    inserted = conn.execute(
+        stmt.on_conflict_do_nothing().returning(
+            table.c.sensor_location_id, table.c.measurement_time
+        ),
+        rows,
+    ).tuples().all()
+    if len(inserted) < len(rows):
+        inserted_keys = set(inserted)
+        rows = [
+            row for row in rows
+            if (row["sensor_location_id"], row["measurement_time"])
+            in inserted_keys
+        ]
+    if rows:
+        update_rollups(conn, rows)
+        update_latest_readings(conn, rows)
+        update_statistics(conn, rows)
+    return len(rows)
+
+
+def _resolve_open_sensor_locations(
+        engine: sqlalchemy.engine.base.Engine,
+        conn: sqlalchemy.engine.base.Connection,
+        sensor_serial_numbers: Iterable[str]
+        ) -> dict[str, tuple[int, datetime]]:
+    """
+    This function maps sensor serial numbers to the identifiers and start 
+    placements of their open sensor locations. Serial numbers are first 
+    looked up in the sensor location cache of the engine. Only the serial 
+    numbers missing from the cache are queried, after which the cache is 
+    updated.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+        sensor_serial_numbers (Iterable[str]): the sensor serial numbers.
+
+    Returns:
+        dict[str, tuple[int, datetime]]: the open sensor location identifier 
+            and start placement per sensor serial number. Sensors without an 
+            open sensor location are left out.
+    """
+    cache = get_sensor_location_cache(engine)
+    open_sensor_locations = {}
+    misses = []
+    for serial_number in sensor_serial_numbers:
+        entry = cache.get(serial_number)
+        if entry is None:
+            misses.append(serial_number)
+        elif entry[0] is not None:
+            open_sensor_locations[serial_number] = entry[0]
+    if misses:
+        found = get_open_sensor_locations(conn, misses)
+        for serial_number in misses:
+            cache.put(serial_number, found.get(serial_number))
+        open_sensor_locations.update(found)
+    return open_sensor_locations
+
+
+def get_open_sensor_locations(
+        conn: sqlalchemy.engine.base.Connection,
+        sensor_serial_numbers: Iterable[str]
+        ) -> dict[str, tuple[int, datetime]]:
+    """
+    This function maps sensor serial numbers to the identifiers and start 
+    placements of their open sensor locations with a single query.
+
+    Args:
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+        sensor_serial_numbers (Iterable[str]): the sensor serial numbers.
+
+    Returns:
+        dict[str, tuple[int, datetime]]: the open sensor location identifier 
+            and start placement per sensor serial number. Sensors without an 
+            open sensor location are left out.
+    """
+    stmt = (
+        select(
+            sensors_table.c.sensor_serial_number,
+            sensor_locations_table.c.sensor_location_id,
+            sensor_locations_table.c.start_placement,
+        )
+        .join_from(
+            sensor_locations_table,
+            sensors_table,
+            sensor_locations_table.c.sensor_id == sensors_table.c.sensor_id,
+        )
+        .where(sensor_locations_table.c.stop_placement == None)
+        .where(
+            sensors_table.c.sensor_serial_number.in_(
+                list(sensor_serial_numbers)
+            )
+        )
+    )
+    return {
+        serial_number: (sensor_location_id, start_placement)
+        for serial_number, sensor_location_id, start_placement
+        in conn.execute(stmt)
+    }
+
+
+def _get_sensor_location_history(
+        conn: sqlalchemy.engine.base.Connection,
+        sensor_serial_numbers: Iterable[str]
+        ) -> dict[str, list[tuple[int, datetime, Optional[datetime]]]]:
+    """
+    This function retrieves all sensor locations of sensors, open or not, 
+    with a single query.
+
+    Args:
+        conn (sqlalchemy.engine.base.Connection): a SQLAlchemy connection.
+        sensor_serial_numbers (Iterable[str]): the sensor serial numbers.
+
+    Returns:
+        dict[str, list[tuple[int, datetime, Optional[datetime]]]]: the 
+            sensor location identifier, start placement and stop placement 
+            of the sensor locations per sensor serial number, most recent 
+            first.
+    """
+    stmt = (
+        select(
+            sensors_table.c.sensor_serial_number,
+            sensor_locations_table.c.sensor_location_id,
+            sensor_locations_table.c.start_placement,
+            sensor_locations_table.c.stop_placement,
+        )
+        .join_from(
+            sensor_locations_table,
+            sensors_table,
+            sensor_locations_table.c.sensor_id == sensors_table.c.sensor_id,
+        )
+        .where(
+            sensors_table.c.sensor_serial_number.in_(
+                list(sensor_serial_numbers)
+            )
+        )
+        .order_by(sensor_locations_table.c.start_placement.desc())
+    )
+    history: dict[str, list[tuple]] = {}
+    for serial_number, *placement in conn.execute(stmt):
+        history.setdefault(serial_number, []).append(tuple(placement))
+    return history
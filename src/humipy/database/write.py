@@ -1,16 +1,24 @@
 from datetime import datetime
+from humipy.database.cache import invalidate_sensor_location_cache
 from humipy.database.models import (
-    humidity_measurements_table,
     locations_table,
     sensors_table,
     sensor_locations_table,
 )
-from humipy.database.read import get_open_sensor_location
+from humipy.database.statements import (
+    get_measurement_rows,
+    get_missing_placement_message,
+    get_open_sensor_locations,
+    insert_ignore,
+    insert_measurements,
+)
+from humipy.profiling import timed
 import sqlalchemy
 from sqlalchemy import bindparam, insert, select, update
-from typing import Optional
+from typing import Iterable, Optional
 
 
+@timed
 def add_location(
         engine: sqlalchemy.engine.base.Engine,
         location_name: str) -> bool:
@@ -21,27 +29,20 @@ def add_location(
         engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
         location_name (str): location name.
     """
-    # Check if there is already a record in the locations table with the same 
-    # name. If so, the insert must be aborted, the location names must be 
-    # unique.
-    stmt = (
-        select(locations_table)
-        .where(locations_table.c.location_name == location_name)
-    )
+    # The location names are unique. A conflicting insert is skipped by the 
+    # database, so that concurrent calls cannot add the same location twice.
     with engine.connect() as conn:
-        res = conn.execute(stmt)
-    if res.rowcount > 0:
-        return False
-    
-    # Proceed with inserting a new location to the locations database table
-    with engine.connect() as conn:
-        res = conn.execute(
-            insert(locations_table), {"location_name": location_name}
+        created = insert_ignore(
+            conn,
+            locations_table,
+            locations_table.c.location_name,
+            [{"location_name": location_name}],
         )
         conn.commit()
-    return True
+    return bool(created)
 
 
+@timed
 def add_sensor(
         engine: sqlalchemy.engine.base.Engine,
         sensor_serial_number: str,
@@ -55,31 +56,25 @@ def add_sensor(
         sensor_type (Optional[str], optional): the sensor type. Defaults to 
             None.
     """
-    # Check if there is already a record in the sensors table with the same 
-    # serialnumber. If so, the insert must be aborted, the serial numbers must 
-    # be unique.
-    stmt = (
-        select(sensors_table)
-        .where(sensors_table.c.sensor_serial_number == sensor_serial_number)
-    )
-    with engine.connect() as conn:
-        res = conn.execute(stmt)
-    if res.rowcount > 0:
-        return False
-
-    # Proceed with inserting a new sensor to the sensors database table
+    # The serial numbers are unique. A conflicting insert is skipped by the 
+    # database, so that concurrent calls cannot add the same sensor twice.
     with engine.connect() as conn:
-        res = conn.execute(
-            insert(sensors_table),
-            {
-                "sensor_serial_number": sensor_serial_number,
-                "sensor_type": sensor_type,
-            },
+        created = insert_ignore(
+            conn,
+            sensors_table,
+            sensors_table.c.sensor_serial_number,
+            [
+                {
+                    "sensor_serial_number": sensor_serial_number,
+                    "sensor_type": sensor_type,
+                }
+            ],
         )
         conn.commit()
-    return True
+    return bool(created)
 
 
+@timed
 def start_sensor_placement(
         engine: sqlalchemy.engine.base.Engine,
         location_name: str,
@@ -88,8 +83,9 @@ def start_sensor_placement(
     # First, check if there not is an open sensor location for the sensor of 
     # interest. If that is the case, then no placement can be started for that 
     # particular sensor.
-    if len(get_open_sensor_location(engine, sensor_serial_number)) > 0:
-        return False
+    with engine.connect() as conn:
+        if get_open_sensor_locations(conn, [sensor_serial_number]):
+            return False
     
     # Initialize a start placement date if required (i.e., if the user did not 
     # specify a start date)
@@ -126,16 +122,18 @@ def start_sensor_placement(
             }
         )
         conn.commit()
+    invalidate_sensor_location_cache(engine, sensor_serial_number)
     return True
 
 
+@timed
 def stop_sensor_placement(
         engine: sqlalchemy.engine.base.Engine,
         location_name: str,
         sensor_serial_number: str,
         stop_placement: Optional[datetime] = None):
     """
-    This function stops a sensor placement.
+    This function stops the open placement of a sensor at a location.
 
     Args:
         engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
@@ -162,11 +160,14 @@ def stop_sensor_placement(
         .where(locations_table.c.location_name == bindparam("location_name"))
         .scalar_subquery()
     )
+    # Only the open placement is stopped, as the sensor may have been placed 
+    # at the location before
     stmt = (
         select(sensor_locations_table)
         .where(
             sensor_locations_table.c.sensor_id == scalar_sensor_subquery,
             sensor_locations_table.c.location_id == scalar_location_subquery,
+            sensor_locations_table.c.stop_placement == None,
         )
     )
 
@@ -190,33 +191,237 @@ def stop_sensor_placement(
     with engine.connect() as conn:
         conn.execute(stmt)
         conn.commit()
+    invalidate_sensor_location_cache(engine, sensor_serial_number)
+
+
+@timed
+def register_fleet(
+        engine: sqlalchemy.engine.base.Engine,
+        locations: Iterable[str] = (),
+        sensors: Iterable[tuple[str, Optional[str]]] = (),
+        placements: Iterable[tuple[str, str, Optional[datetime]]] = ()
+        ) -> dict[str, dict[str, list]]:
+    """
+    This function registers locations, sensors and initial sensor placements 
+    in bulk, in a single transaction. Locations and sensors that already exist 
+    are skipped, as are placements of sensors that already have an open 
+    sensor location. The placements are inserted with the same conflict 
+    handling as the locations and sensors, on the unique index of the open 
+    sensor locations, so that concurrent imports cannot open two placements 
+    for one sensor. If a placement refers to an unknown location or sensor, 
+    nothing is registered.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        locations (Iterable[str], optional): the location names. Defaults to 
+            ().
+        sensors (Iterable[tuple[str, Optional[str]]], optional): the sensors 
+            as (sensor serial number, sensor type) tuples. Defaults to ().
+        placements (Iterable[tuple[str, str, Optional[datetime]]], optional): 
+            the placements as (location name, sensor serial number, start 
+            placement) tuples. If the start placement is None, the current 
+            date and time is used. Defaults to ().
+
+    Returns:
+        dict[str, dict[str, list]]: the created and skipped location names, 
+            sensor serial numbers and (location name, sensor serial number) 
+            placements.
+    """
+    # Duplicates within the manifest are dropped, keeping the first entry
+    locations = list(dict.fromkeys(locations))
+    sensor_types: dict[str, Optional[str]] = {}
+    for serial_number, sensor_type in sensors:
+        sensor_types.setdefault(serial_number, sensor_type)
+    sensor_placements: dict[
+        str, tuple[str, str, Optional[datetime]]
+    ] = {}
+    for placement in placements:
+        sensor_placements.setdefault(placement[1], placement)
+    sensors = list(sensor_types.items())
+    placements = list(sensor_placements.values())
+    now = datetime.now()
+
+    with engine.begin() as conn:
+        created_locations = insert_ignore(
+            conn,
+            locations_table,
+            locations_table.c.location_name,
+            [{"location_name": name} for name in locations],
+        )
+        created_sensors = insert_ignore(
+            conn,
+            sensors_table,
+            sensors_table.c.sensor_serial_number,
+            [
+                {
+                    "sensor_serial_number": serial_number,
+                    "sensor_type": sensor_type,
+                }
+                for serial_number, sensor_type in sensors
+            ],
+        )
+
+        location_ids = dict(
+            conn.execute(
+                select(
+                    locations_table.c.location_name,
+                    locations_table.c.location_id,
+                )
+                .where(
+                    locations_table.c.location_name.in_(
+                        {placement[0] for placement in placements}
+                    )
+                )
+            ).tuples().all()
+        )
+        sensor_ids = dict(
+            conn.execute(
+                select(
+                    sensors_table.c.sensor_serial_number,
+                    sensors_table.c.sensor_id,
+                )
+                .where(
+                    sensors_table.c.sensor_serial_number.in_(
+                        {placement[1] for placement in placements}
+                    )
+                )
+            ).tuples().all()
+        )
+        for location_name, serial_number, _ in placements:
+            if location_name not in location_ids:
+                raise ValueError(f"Unknown location: {location_name}.")
+            if serial_number not in sensor_ids:
+                raise ValueError(f"Unknown sensor: {serial_number}.")
+
+        placed_sensor_ids = set(
+            insert_ignore(
+                conn,
+                sensor_locations_table,
+                sensor_locations_table.c.sensor_id,
+                [
+                    {
+                        "sensor_id": sensor_ids[serial_number],
+                        "location_id": location_ids[location_name],
+                        "start_placement": (
+                            now if start_placement is None
+                            else start_placement
+                        ),
+                    }
+                    for location_name, serial_number, start_placement
+                    in placements
+                ],
+                where=sensor_locations_table.c.stop_placement == None,
+            )
+        )
+        created_placements, skipped_placements = [], []
+        for location_name, serial_number, _ in placements:
+            if sensor_ids[serial_number] in placed_sensor_ids:
+                created_placements.append((location_name, serial_number))
+            else:
+                skipped_placements.append((location_name, serial_number))
 
+    for _, serial_number in created_placements:
+        invalidate_sensor_location_cache(engine, serial_number)
+    return {
+        "locations": {
+            "created": created_locations,
+            "skipped": [
+                name for name in locations if name not in created_locations
+            ],
+        },
+        "sensors": {
+            "created": created_sensors,
+            "skipped": [
+                serial_number
+                for serial_number, _ in sensors
+                if serial_number not in created_sensors
+            ],
+        },
+        "placements": {
+            "created": created_placements,
+            "skipped": skipped_placements,
+        },
+    }
 
+
+@timed
 def push_measurement(
         engine: sqlalchemy.engine.base.Engine,
         sensor_serial_number: str,
-        measurement: float):
+        measurement: float,
+        temperature: Optional[float] = None,
+        pressure: Optional[float] = None,
+        measurement_time: Optional[datetime] = None) -> bool:
     """
     This function pushes a humidity measurement to the appropriate database 
-    table.
+    table, optionally with the temperature and pressure of the same sample. 
+    A measurement that was written already (i.e., with the same sensor 
+    location and measurement time) is skipped, so that the push can be 
+    retried safely.
 
     Args:
         engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
         sensor_serial_number (str): the sensor serial number.
         measurement (float): the humidity measurement.
+        temperature (Optional[float], optional): the temperature in degrees 
+            Celsius. Defaults to None.
+        pressure (Optional[float], optional): the pressure in hPa. Defaults 
+            to None.
+        measurement_time (Optional[datetime], optional): the time at which 
+            the sensor took the measurement. The measurement is attributed 
+            to the sensor location of the sensor at that time. If None, the 
+            current date and time is used. Defaults to None.
+
+    Raises:
+        ValueError: if the sensor was not placed at the measurement time, 
+            or if a value is NaN or infinite.
+
+    Returns:
+        bool: True if the measurement was written, False if it was a 
+            duplicate.
     """
-    sensor_location_id = (
-        get_open_sensor_location(engine, sensor_serial_number)
-        ["sensor_location_id"].iloc[0]
-    )
-    stmt = (
-        insert(humidity_measurements_table)
-        .values(
-            sensor_location_id=int(sensor_location_id),
-            humidity=measurement,
-            measurement_time=datetime.now(),
-        )
+    reading = (
+        sensor_serial_number, measurement, measurement_time, temperature,
+        pressure,
     )
     with engine.connect() as conn:
-        conn.execute(stmt)
-        conn.commit()
\ No newline at end of file
+        rows = get_measurement_rows(engine, conn, [reading])
+        if not rows:
+            raise ValueError(get_missing_placement_message(reading))
+        written = insert_measurements(conn, rows)
+        conn.commit()
+    return bool(written)
+
+
+@timed
+def push_measurements(
+        engine: sqlalchemy.engine.base.Engine,
+        readings: Iterable[tuple]) -> int:
+    """
+    This function pushes a batch of humidity measurements to the appropriate 
+    database table. The sensor locations are resolved once for the whole 
+    batch, and all measurements are written with a single insert inside one 
+    transaction. Readings from sensors that were not placed at their 
+    measurement time are skipped, as are measurements that were written 
+    already, so that a gateway can resend a batch that may have been 
+    written (at-least-once delivery).
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        readings (Iterable[tuple]): the readings as (sensor serial number, 
+            humidity, measurement time) tuples, optionally followed by the 
+            temperature and the pressure of the sample. If the measurement 
+            time is None, the current date and time is used.
+
+    Raises:
+        ValueError: if a value is NaN or infinite.
+
+    Returns:
+        int: the number of measurements written to the database.
+    """
+    readings = list(readings)
+    if not readings:
+        return 0
+    with engine.begin() as conn:
+        rows = get_measurement_rows(engine, conn, readings)
+        return insert_measurements(conn, rows)
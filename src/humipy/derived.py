@@ -0,0 +1,99 @@
+"""
+This module derives metrics from the relative humidity and the temperature of
+a sample: the dew point and the absolute humidity. They are computed with
+NumPy when the measurements are queried, instead of being stored.
+
+The saturation vapour pressure follows the Magnus formula with the
+coefficients of Sonntag (1990) over water, which is accurate to within 0.35
+degrees Celsius for the dew point between -45 and 60 degrees Celsius.
+"""
+
+
+import numpy as np
+import pandas as pd
+from typing import Union
+
+
+_MAGNUS_B = 17.62
+_MAGNUS_C = 243.12
+_MAGNUS_PRESSURE = 6.112
+# The specific gas constant of water vapour (in J/(kg K)), to convert the
+# vapour pressure in hPa to grams per cubic metre
+_WATER_VAPOUR_CONSTANT = 461.5
+_ZERO_CELSIUS = 273.15
+
+
+def dew_point(
+        temperature: Union[float, np.ndarray],
+        humidity: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+    """
+    This function computes the dew point.
+
+    Args:
+        temperature (Union[float, np.ndarray]): the temperature in degrees
+            Celsius.
+        humidity (Union[float, np.ndarray]): the relative humidity in
+            percent.
+
+    Returns:
+        Union[float, np.ndarray]: the dew point in degrees Celsius, NaN where
+            the temperature or humidity is missing or the humidity is zero.
+    """
+    temperature = np.asarray(temperature, dtype=float)
+    humidity = np.asarray(humidity, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gamma = (
+            np.log(np.where(humidity > 0., humidity, np.nan) / 100.)
+            + _MAGNUS_B * temperature / (_MAGNUS_C + temperature)
+        )
+        return _MAGNUS_C * gamma / (_MAGNUS_B - gamma)
+
+
+def absolute_humidity(
+        temperature: Union[float, np.ndarray],
+        humidity: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+    """
+    This function computes the absolute humidity, i.e., the mass of water
+    vapour per volume of air.
+
+    Args:
+        temperature (Union[float, np.ndarray]): the temperature in degrees
+            Celsius.
+        humidity (Union[float, np.ndarray]): the relative humidity in
+            percent.
+
+    Returns:
+        Union[float, np.ndarray]: the absolute humidity in grams per cubic
+            metre, NaN where the temperature or humidity is missing.
+    """
+    temperature = np.asarray(temperature, dtype=float)
+    humidity = np.asarray(humidity, dtype=float)
+    vapour_pressure = (
+        humidity / 100. * _MAGNUS_PRESSURE
+        * np.exp(_MAGNUS_B * temperature / (_MAGNUS_C + temperature))
+    )
+    return (
+        vapour_pressure * 100. * 1000.
+        / (_WATER_VAPOUR_CONSTANT * (temperature + _ZERO_CELSIUS))
+    )
+
+
+def add_derived_metrics(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function adds the dew point and the absolute humidity to a data
+    frame of measurements with a humidity and a temperature column.
+
+    Args:
+        df (pd.DataFrame): the measurements.
+
+    Returns:
+        pd.DataFrame: the measurements with a dew_point column (in degrees
+            Celsius) and an absolute_humidity column (in grams per cubic
+            metre).
+    """
+    temperature = pd.to_numeric(df["temperature"]).to_numpy(dtype=float)
+    humidity = pd.to_numeric(df["humidity"]).to_numpy(dtype=float)
+    return df.assign(
+        dew_point=dew_point(temperature, humidity),
+        absolute_humidity=absolute_humidity(temperature, humidity),
+    )
@@ -0,0 +1,247 @@
+"""
+This module exports the humidity measurements, joined with the location names
+and sensor serial numbers, to date-partitioned files for analytics:
+
+directory/date=2024-01-31/part-00000000000000001234.parquet
+
+The measurements are streamed in chunks, so that the memory used does not
+grow with the size of the table. The identifier of the last exported
+measurement is stored in a state file in the export directory, so that
+subsequent runs only export new measurements. As the identifiers are handed
+out when a measurement is inserted, not when it is committed, a measurement
+can become visible after measurements with a larger identifier were
+exported. The identifiers below the high-water mark that were not exported
+yet are therefore kept in the state file too, for a safety window of
+identifiers, and are exported if they show up in a later run. Parquet files
+are written if pyarrow is installed, otherwise CSV files are written.
+"""
+
+
+import json
+from humipy.database.read import stream_measurements
+import os
+import pandas as pd
+import sqlalchemy
+from typing import Any, Optional
+
+
+_STATE_FILE = "_export_state.json"
+_SAFETY_WINDOW = 10000
+
+
+def export_measurements(
+        engine: sqlalchemy.engine.base.Engine,
+        directory: str,
+        file_format: Optional[str] = None,
+        chunksize: int = 100000,
+        full: bool = False,
+        safety_window: int = _SAFETY_WINDOW) -> dict:
+    """
+    This function exports the measurements added since the previous export to
+    date-partitioned files. The files of a run are written under a temporary
+    name and only renamed, and the high-water mark only updated, once all
+    measurements of the run were written.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        directory (str): the export directory.
+        file_format (Optional[str], optional): either 'parquet' or 'csv'. If
+            None, Parquet is used if pyarrow is installed, otherwise CSV.
+            Defaults to None.
+        chunksize (int, optional): the number of measurements per chunk.
+            Defaults to 100000.
+        full (bool, optional): whether to ignore the stored high-water mark
+            and export all measurements. The files of the earlier runs are
+            removed once the new files are written. Defaults to False.
+        safety_window (int, optional): the number of identifiers below the
+            high-water mark that are checked again for measurements that
+            were committed late. Defaults to 10000.
+
+    Returns:
+        dict: a summary with the number of exported measurements, the files
+            written, and the old and new high-water marks.
+    """
+    if file_format is None:
+        file_format = "parquet" if _has_pyarrow() else "csv"
+    if file_format not in ("parquet", "csv"):
+        raise ValueError(f"Unknown export format: {file_format}.")
+    os.makedirs(directory, exist_ok=True)
+    state = _read_state(directory)
+    high_water_mark = 0 if full else state["high_water_mark"]
+    gaps = set() if full else set(state["gaps"])
+    after_id = min([high_water_mark, *(gap - 1 for gap in gaps)])
+
+    writer = _PartitionWriter(directory, file_format, state["sequence"] + 1)
+    new_high_water_mark = high_water_mark
+    exported = 0
+    exported_ids = set()
+    try:
+        for chunk in stream_measurements(
+                engine, chunksize=chunksize, after_id=after_id):
+            ids = chunk["humidity_measurement_id"]
+            # The measurements below the high-water mark were exported
+            # before, unless they were committed late
+            chunk = chunk[(ids > high_water_mark) | ids.isin(gaps)]
+            if chunk.empty:
+                continue
+            writer.write(chunk)
+            exported += len(chunk)
+            exported_ids.update(chunk["humidity_measurement_id"].tolist())
+            new_high_water_mark = max(
+                new_high_water_mark,
+                int(chunk["humidity_measurement_id"].max()),
+            )
+    finally:
+        writer.close()
+    files = writer.commit()
+    if full:
+        _remove_earlier_files(directory, writer.file_name)
+    new_gaps = [
+        i
+        for i in range(
+            max(new_high_water_mark - safety_window, 0) + 1,
+            new_high_water_mark + 1,
+        )
+        if i not in exported_ids and (i > high_water_mark or i in gaps)
+    ]
+    _write_state(
+        directory,
+        {
+            "high_water_mark": new_high_water_mark,
+            "gaps": new_gaps,
+            "sequence": writer.sequence if files else state["sequence"],
+        },
+    )
+    return {
+        "exported": exported,
+        "files": files,
+        "previous_high_water_mark": high_water_mark,
+        "high_water_mark": new_high_water_mark,
+    }
+
+
+class _PartitionWriter:
+    """
+    This class appends chunks of measurements to one file per date. The
+    chunks arrive ordered by measurement time, so a file can be closed as
+    soon as a later date shows up. The files of a run are numbered with a
+    sequence that increases with every run.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            file_format: str,
+            sequence: int) -> None:
+        self.directory = directory
+        self.file_format = file_format
+        self.sequence = sequence
+        self.file_name = f"part-{sequence:020d}.{file_format}"
+        # The open writers (Parquet) or files (CSV), by date
+        self._open: dict[str, Any] = {}
+        self._written: list[str] = []
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        # Columns that are missing in a whole chunk (e.g., the temperature of
+        # humidity-only sensors) would otherwise fix a null type in the
+        # Parquet schema
+        chunk = chunk.astype(
+            {"humidity": float, "temperature": float, "pressure": float}
+        )
+        dates = chunk["measurement_time"].dt.strftime("%Y-%m-%d")
+        for date, partition in chunk.groupby(dates, sort=True):
+            for open_date in [d for d in self._open if d < date]:
+                self._close(open_date)
+            self._append(date, partition.reset_index(drop=True))
+
+    def close(self) -> None:
+        for date in list(self._open):
+            self._close(date)
+
+    def commit(self) -> list[str]:
+        files = []
+        for temporary_path in self._written:
+            path = temporary_path[:-len(".tmp")]
+            os.replace(temporary_path, path)
+            files.append(path)
+        return files
+
+    def _append(self, date: str, partition: pd.DataFrame) -> None:
+        if date not in self._open:
+            partition_directory = os.path.join(self.directory, f"date={date}")
+            os.makedirs(partition_directory, exist_ok=True)
+            path = os.path.join(partition_directory, self.file_name + ".tmp")
+            self._written.append(path)
+            self._open[date] = self._open_file(path, partition)
+        if self.file_format == "parquet":
+            import pyarrow as pa
+
+            writer = self._open[date]
+            writer.write_table(
+                pa.Table.from_pandas(
+                    partition, schema=writer.schema, preserve_index=False
+                )
+            )
+        else:
+            partition.to_csv(
+                self._open[date],
+                header=self._open[date].tell() == 0,
+                index=False,
+            )
+
+    def _open_file(self, path: str, partition: pd.DataFrame):
+        if self.file_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            schema = pa.Schema.from_pandas(partition, preserve_index=False)
+            return pq.ParquetWriter(path, schema)
+        return open(path, "w", newline="")
+
+    def _close(self, date: str) -> None:
+        self._open.pop(date).close()
+
+
+def _has_pyarrow() -> bool:
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
+
+
+def _remove_earlier_files(directory: str, file_name: str) -> None:
+    """
+    This function removes the files that were not written by the current
+    run, and the partition directories that are left empty.
+    """
+    for name in os.listdir(directory):
+        partition_directory = os.path.join(directory, name)
+        if not name.startswith("date=") or not os.path.isdir(
+                partition_directory):
+            continue
+        for part in os.listdir(partition_directory):
+            if part.startswith("part-") and part != file_name:
+                os.remove(os.path.join(partition_directory, part))
+        if not os.listdir(partition_directory):
+            os.rmdir(partition_directory)
+
+
+def _read_state(directory: str) -> dict:
+    path = os.path.join(directory, _STATE_FILE)
+    if not os.path.exists(path):
+        return {"high_water_mark": 0, "gaps": [], "sequence": 0}
+    with open(path) as f:
+        state = json.load(f)
+    # The files of exports without a sequence are numbered after the first
+    # identifier they hold, which does not exceed the high-water mark
+    state.setdefault("gaps", [])
+    state.setdefault("sequence", state["high_water_mark"])
+    return state
+
+
+def _write_state(directory: str, state: dict) -> None:
+    path = os.path.join(directory, _STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
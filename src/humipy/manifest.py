@@ -0,0 +1,136 @@
+"""
+This module reads fleet manifests, i.e., files that describe the locations,
+sensors and initial sensor placements of a building, so that they can be
+registered in bulk with write.register_fleet. YAML and JSON manifests look as
+follows:
+
+locations:
+  - Kitchen
+  - Bathroom
+sensors:
+  - serial_number: XIE-385A92H20-T0
+    type: DHT11
+placements:
+  - location: Kitchen
+    sensor: XIE-385A92H20-T0
+    start: 2024-01-31 08:00:00
+
+CSV manifests have one row per sensor, with the columns serial_number, type,
+location and start. The location and start of a sensor are optional, a
+sensor with a location is placed there. Rows without a serial number only
+register their location. Reading YAML manifests requires PyYAML.
+"""
+
+
+import csv
+from datetime import datetime
+from dateutil import parser
+from humipy.database.write import register_fleet
+import json
+import os
+import sqlalchemy
+from typing import Optional
+
+
+def import_manifest(
+        engine: sqlalchemy.engine.base.Engine,
+        path: str) -> dict[str, dict[str, list]]:
+    """
+    This function registers the locations, sensors and placements of a
+    manifest file in a single transaction.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        path (str): the path to the manifest file.
+
+    Returns:
+        dict[str, dict[str, list]]: the created and skipped locations, sensors
+            and placements, as returned by write.register_fleet.
+    """
+    return register_fleet(engine, **read_manifest(path))
+
+
+def read_manifest(path: str) -> dict[str, list]:
+    """
+    This function reads a manifest file. The format is derived from the file
+    extension (.yaml, .yml, .json or .csv).
+
+    Args:
+        path (str): the path to the manifest file.
+
+    Returns:
+        dict[str, list]: the locations, sensors and placements, in the form
+            expected by write.register_fleet.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in (".yaml", ".yml", ".json", ".csv"):
+        raise ValueError(f"Unknown manifest format: {extension}.")
+    if extension in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError(
+                "Reading YAML manifests requires PyYAML. Install it with "
+                "'pip install humipy[manifest]', or use a JSON or CSV "
+                "manifest."
+            ) from None
+    with open(path, newline="") as f:
+        if extension == ".csv":
+            return _parse_csv_manifest(f)
+        if extension == ".json":
+            return _parse_manifest(json.load(f))
+        return _parse_manifest(yaml.safe_load(f) or {})
+
+
+def _parse_manifest(manifest: dict) -> dict[str, list]:
+    locations = [
+        location if isinstance(location, str) else location["name"]
+        for location in manifest.get("locations") or []
+    ]
+    sensors = [
+        (sensor["serial_number"], sensor.get("type"))
+        for sensor in manifest.get("sensors") or []
+    ]
+    placements = [
+        (
+            placement["location"],
+            placement["sensor"],
+            _parse_time(placement.get("start")),
+        )
+        for placement in manifest.get("placements") or []
+    ]
+    return {
+        "locations": locations,
+        "sensors": sensors,
+        "placements": placements,
+    }
+
+
+def _parse_csv_manifest(f) -> dict[str, list]:
+    locations, sensors, placements = [], [], []
+    for row in csv.DictReader(f):
+        row = {key: (value or "").strip() for key, value in row.items()}
+        if row.get("location"):
+            locations.append(row["location"])
+        if not row.get("serial_number"):
+            continue
+        sensors.append((row["serial_number"], row.get("type") or None))
+        if row.get("location"):
+            placements.append(
+                (
+                    row["location"],
+                    row["serial_number"],
+                    _parse_time(row.get("start")),
+                )
+            )
+    return {
+        "locations": locations,
+        "sensors": sensors,
+        "placements": placements,
+    }
+
+
+def _parse_time(value) -> Optional[datetime]:
+    if value is None or value == "" or isinstance(value, datetime):
+        return value or None
+    return parser.isoparse(str(value))
@@ -1,19 +1,32 @@
 """
-This module implements functionality to request weather information from the 
+This module implements functionality to request weather information from the
 API provided by meteomatics.
 
 The pattern of the URL:
 
 api.meteomatics.com/validdatetime/parameters/locations/format?optionals
+
+The valid date time is either a single timestamp or an interval with a step
+(e.g., 2024-01-01T00:00:00Z--2024-01-02T00:00:00Z:PT1H), and multiple
+locations are separated by a plus sign. The MeteomaticsClient reuses its
+connections and access token across requests, and keeps the responses for
+past times in an on-disk cache, as they do not change anymore.
 """
 
 
+import base64
+from datetime import datetime, timedelta
+from dateutil import parser, tz
+from dotenv import load_dotenv
+import hashlib
+import json
 import os
 import requests
-from typing import Union
-from dotenv import load_dotenv
-from datetime import datetime
-from dateutil import tz
+from requests.adapters import HTTPAdapter
+import threading
+import time
+from typing import Iterable, Optional
+from urllib3.util.retry import Retry
 
 
 _LATITUDE = "51.053822"
@@ -21,41 +34,285 @@ _LONGITUDE = "3.722270"
 _METEOMATICS_BASE_URL="https://api.meteomatics.com"
 _METEOMATICS_TOKEN_URL="https://login.meteomatics.com/api/v1/token"
 
+# Access tokens are valid for two hours, and are refreshed a minute before
+# they expire
+_TOKEN_LIFETIME = 7200.
+_TOKEN_MARGIN = 60.
+
+
+class MeteomaticsClient:
+    """
+    A client for the meteomatics API that keeps a pool of connections and
+    caches its access token until it expires.
+
+    Args:
+        username (Optional[str], optional): the API username. If None, the
+            _METEOMATICS_USERNAME variable is used. Defaults to None.
+        password (Optional[str], optional): the API password. If None, the
+            _METEOMATICS_PASSWORD variable is used. Defaults to None.
+        base_url (str, optional): the base URL of the API. Defaults to the
+            meteomatics API.
+        token_url (str, optional): the URL to request access tokens from.
+            Defaults to the meteomatics login API.
+        cache_directory (Optional[str], optional): the directory of the
+            response cache. If None, responses are not cached. Defaults to
+            None.
+        timeout (float, optional): the timeout of a request in seconds.
+            Defaults to 30 seconds.
+        max_connections (int, optional): the maximum number of pooled
+            connections. Defaults to 10.
+        retries (int, optional): the number of retries of requests that fail
+            with a connection error, a rate limit or a server error. Defaults
+            to 3.
+    """
+
+    def __init__(
+            self,
+            username: Optional[str] = None,
+            password: Optional[str] = None,
+            base_url: str = _METEOMATICS_BASE_URL,
+            token_url: str = _METEOMATICS_TOKEN_URL,
+            cache_directory: Optional[str] = None,
+            timeout: float = 30.,
+            max_connections: int = 10,
+            retries: int = 3) -> None:
+        self.username = (
+            os.getenv("_METEOMATICS_USERNAME") if username is None else username
+        )
+        self.password = (
+            os.getenv("_METEOMATICS_PASSWORD") if password is None else password
+        )
+        self.base_url = base_url.rstrip("/")
+        self.token_url = token_url
+        self.cache_directory = cache_directory
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_connections,
+            pool_maxsize=max_connections,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._access_token: Optional[str] = None
+        self._expires_at = 0.
+        self._lock = threading.Lock()
+        if cache_directory is not None:
+            os.makedirs(cache_directory, exist_ok=True)
+
+    def __enter__(self) -> "MeteomaticsClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def get_access_token(self, refresh: bool = False) -> str:
+        """
+        This method returns an access token used to make API calls. A new
+        token is only requested if the cached token is about to expire.
+
+        Args:
+            refresh (bool, optional): whether to request a new token even if
+                the cached token is still valid. Defaults to False.
 
-def _get_access_token(token_url: str) -> Union[str, None]:
+        Returns:
+            str: the access token.
+        """
+        with self._lock:
+            if (
+                    refresh
+                    or self._access_token is None
+                    or time.time() >= self._expires_at - _TOKEN_MARGIN):
+                response = self.session.get(
+                    self.token_url,
+                    auth=(self.username, self.password),
+                    timeout=self.timeout,
+                )
+                response.raise_for_status()
+                access_token: str = response.json()["access_token"]
+                self._access_token = access_token
+                self._expires_at = _get_token_expiry(access_token)
+                return access_token
+            return self._access_token
+
+    def query(
+            self,
+            weather_params: Iterable[str],
+            locations: Iterable[str],
+            start: datetime,
+            end: Optional[datetime] = None,
+            step: timedelta = timedelta(hours=1)) -> dict:
+        """
+        This method requests weather parameters at one or more locations,
+        either at a single time or for a time range. Responses for time
+        ranges that lie in the past are served from the response cache if
+        possible.
+
+        Args:
+            weather_params (Iterable[str]): the weather parameters (e.g.,
+                't_2m:C').
+            locations (Iterable[str]): the locations as 'latitude,longitude'.
+            start (datetime): the (start) time. Naive times are taken to be
+                UTC.
+            end (Optional[datetime], optional): the end of the time range. If
+                None, only the start time is requested. Defaults to None.
+            step (timedelta, optional): the step of the time range. Defaults
+                to one hour.
+
+        Returns:
+            dict: the JSON response.
+        """
+        url = _construct_url(
+            start, list(weather_params), "+".join(locations), end, step,
+            self.base_url,
+        )
+        # The path of the cached response, if the time range lies in the past
+        path = None
+        if (
+                self.cache_directory is not None
+                and _as_utc(end or start) < datetime.now(tz=tz.UTC)):
+            path = os.path.join(
+                self.cache_directory,
+                hashlib.sha256(url.encode()).hexdigest() + ".json",
+            )
+            if os.path.exists(path):
+                with open(path) as f:
+                    return json.load(f)
+
+        response = self._get(url)
+        payload = response.json()
+        if path is not None:
+            temporary_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temporary_path, "w") as f:
+                json.dump(payload, f)
+            os.replace(temporary_path, path)
+        return payload
+
+    def get_time_series(
+            self,
+            weather_params: Iterable[str],
+            locations: Iterable[str],
+            start: datetime,
+            end: Optional[datetime] = None,
+            step: timedelta = timedelta(hours=1)) -> list[tuple]:
+        """
+        This method requests weather parameters like the query method, and
+        flattens the response.
+
+        Returns:
+            list[tuple]: the (parameter, latitude, longitude, time, value)
+                tuples, with the times in UTC.
+        """
+        return _parse_response(
+            self.query(weather_params, locations, start, end, step)
+        )
+
+    def _get(self, url: str) -> requests.Response:
+        response = self.session.get(
+            url,
+            params={"access_token": self.get_access_token()},
+            timeout=self.timeout,
+        )
+        if response.status_code == 401:
+            # The token was revoked or expired early
+            response = self.session.get(
+                url,
+                params={"access_token": self.get_access_token(refresh=True)},
+                timeout=self.timeout,
+            )
+        response.raise_for_status()
+        return response
+
+
+def _get_token_expiry(access_token: str) -> float:
     """
-    This function returns an access token used to make API calls.
+    This function reads the expiry time from the payload of an access token
+    (a JSON web token). If the token cannot be decoded, it is assumed to be
+    valid for two hours.
 
     Args:
-        token_url (str): base URL to make API call.
+        access_token (str): the access token.
 
     Returns:
-        Union[str, None]: access token if the request is successful, otherwise 
-            None.
+        float: the expiry time as a Unix timestamp.
     """
-    username = os.getenv("_METEOMATICS_USERNAME")
-    password = os.getenv("_METEOMATICS_PASSWORD")
-    response = requests.get(_METEOMATICS_TOKEN_URL, auth=(username, password))
-    if response.status_code == 200:
-        return response.json().get("access_token")
-    return None
+    try:
+        payload = access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return time.time() + _TOKEN_LIFETIME
+
+
+def _as_utc(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=tz.UTC)
+    return dt.astimezone(tz.UTC)
 
 
-def _construct_url(dt: datetime, weather_params: list, location: str) -> str:
-    dt_str = dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-    url = f"{_METEOMATICS_BASE_URL}/{dt_str}/{','.join(weather_params)}/{location}/json"
+def _format_duration(step: timedelta) -> str:
+    seconds = int(step.total_seconds())
+    if seconds % 86400 == 0:
+        return f"P{seconds // 86400}D"
+    if seconds % 3600 == 0:
+        return f"PT{seconds // 3600}H"
+    if seconds % 60 == 0:
+        return f"PT{seconds // 60}M"
+    return f"PT{seconds}S"
+
+
+def _construct_url(
+        dt: datetime,
+        weather_params: list,
+        location: str,
+        end: Optional[datetime] = None,
+        step: timedelta = timedelta(hours=1),
+        base_url: str = _METEOMATICS_BASE_URL) -> str:
+    dt_str = _as_utc(dt).strftime("%Y-%m-%dT%H:%M:%SZ")
+    if end is not None:
+        end_str = _as_utc(end).strftime("%Y-%m-%dT%H:%M:%SZ")
+        dt_str = f"{dt_str}--{end_str}:{_format_duration(step)}"
+    url = f"{base_url}/{dt_str}/{','.join(weather_params)}/{location}/json"
     return url
 
 
+def _parse_response(payload: dict) -> list[tuple]:
+    rows = []
+    for parameter in payload.get("data", []):
+        for coordinates in parameter["coordinates"]:
+            for date in coordinates["dates"]:
+                rows.append(
+                    (
+                        parameter["parameter"],
+                        coordinates["lat"],
+                        coordinates["lon"],
+                        parser.isoparse(date["date"]),
+                        date["value"],
+                    )
+                )
+    return rows
+
+
 def main() -> None:
     load_dotenv()
-    access_token = _get_access_token(_METEOMATICS_TOKEN_URL)
     weather_params = ["t_2m:C"]
     location = f"{_LATITUDE},{_LONGITUDE}"
-    url = _construct_url(datetime.now(tz=tz.UTC), weather_params, location)
-    response = requests.get(url, {"access_token": access_token})
-    print(response.text)
+    with MeteomaticsClient() as client:
+        print(
+            json.dumps(
+                client.query(
+                    weather_params, [location], datetime.now(tz=tz.UTC)
+                )
+            )
+        )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,287 @@
+"""
+This module records where time goes: the latency and row counts of every SQL
+statement executed by an engine, and the latency of the public functions of
+the read and write modules and of the views. The latencies are kept in
+in-memory histograms with logarithmic buckets, so that the memory used does
+not grow with the number of calls, and are reported as percentiles.
+
+Profiling is disabled by default, in which case the hooks only check a flag.
+With a sample rate below 1, only a random fraction of the calls and
+statements is timed, which keeps the overhead low enough to leave profiling
+on in production.
+"""
+
+
+import functools
+import json
+import math
+import random
+import sqlalchemy
+from sqlalchemy import event
+import threading
+import time
+from typing import Callable, Optional, TextIO
+
+
+# The buckets grow by a factor of 2 ** (1 / 8), i.e., the percentiles are
+# accurate to within about 5 percent
+_BUCKET_FACTOR = 2 ** (1 / 8)
+_SMALLEST_BUCKET = 1e-6
+_STATEMENT_LENGTH = 100
+
+
+class Histogram:
+    """
+    A latency histogram with logarithmic buckets.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.
+        self.min = math.inf
+        self.max = 0.
+        self.rows: Optional[int] = None
+        self._buckets: dict[int, int] = {}
+
+    def record(self, seconds: float, rows: Optional[int] = None) -> None:
+        """
+        This method records a latency.
+
+        Args:
+            seconds (float): the latency in seconds.
+            rows (Optional[int], optional): the number of rows returned or
+                affected, if known. Defaults to None.
+        """
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        if rows is not None:
+            self.rows = (self.rows or 0) + rows
+        bucket = (
+            int(math.log(seconds / _SMALLEST_BUCKET, _BUCKET_FACTOR))
+            if seconds > _SMALLEST_BUCKET else 0
+        )
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    def percentile(self, q: float) -> float:
+        """
+        This method estimates a percentile of the recorded latencies.
+
+        Args:
+            q (float): the percentile, between 0 and 100.
+
+        Returns:
+            float: the estimated latency in seconds.
+        """
+        if not self.count:
+            return 0.
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                break
+        estimate = _SMALLEST_BUCKET * _BUCKET_FACTOR ** (bucket + .5)
+        return min(max(estimate, self.min), self.max)
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.,
+            "min": self.min if self.count else 0.,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "rows": self.rows,
+        }
+
+
+_enabled = False
+_sample_rate = 1.
+_histograms: dict[str, Histogram] = {}
+_lock = threading.Lock()
+
+
+def enable(sample_rate: float = 1.) -> None:
+    """
+    This function enables profiling.
+
+    Args:
+        sample_rate (float, optional): the fraction of the calls and
+            statements that is timed. Defaults to 1.
+    """
+    global _enabled, _sample_rate
+    _sample_rate = sample_rate
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    with _lock:
+        _histograms.clear()
+
+
+def record(name: str, seconds: float, rows: Optional[int] = None) -> None:
+    """
+    This function records a latency in the histogram of a name.
+
+    Args:
+        name (str): the name of the statement or function.
+        seconds (float): the latency in seconds.
+        rows (Optional[int], optional): the number of rows returned or
+            affected, if known. Defaults to None.
+    """
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.record(seconds, rows)
+
+
+def _sampled() -> bool:
+    return _enabled and (_sample_rate >= 1. or random.random() < _sample_rate)
+
+
+def timed(func: Callable) -> Callable:
+    """
+    This decorator records the latency of a function, and the length of its
+    return value as the number of rows if it returns a list or a DataFrame,
+    if profiling is enabled.
+
+    Args:
+        func (Callable): the function.
+
+    Returns:
+        Callable: the wrapped function.
+    """
+    name = func.__module__.removeprefix("humipy.") + "." + func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _sampled():
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        rows = None
+        if isinstance(result, list) or hasattr(result, "to_dict"):
+            rows = len(result)
+        record(name, time.perf_counter() - start, rows)
+        return result
+
+    return wrapper
+
+
+def instrument_engine(engine: sqlalchemy.engine.base.Engine) -> None:
+    """
+    This function adds event hooks to an engine that record the latency and
+    row count of every statement, if profiling is enabled. Row counts are
+    only known for statements that modify rows.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+# The start times are kept per execution context, so that the start time of
+# a statement that raised is not taken for that of the next statement
+
+
+def _before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany) -> None:
+    if _sampled():
+        conn.info.setdefault("humipy_profiling", {})[context] = (
+            time.perf_counter()
+        )
+
+
+def _after_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany) -> None:
+    start = conn.info.get("humipy_profiling", {}).pop(context, None)
+    if start is None:
+        return
+    seconds = time.perf_counter() - start
+    rowcount = cursor.rowcount
+    record(
+        "sql: " + " ".join(statement.split())[:_STATEMENT_LENGTH],
+        seconds,
+        rowcount if rowcount >= 0 else None,
+    )
+
+
+def _handle_error(exception_context) -> None:
+    conn = exception_context.connection
+    if conn is not None:
+        conn.info.get("humipy_profiling", {}).pop(
+            exception_context.execution_context, None
+        )
+
+
+def get_report() -> dict[str, dict]:
+    """
+    This function returns the statistics of every recorded statement and
+    function, with the latencies in seconds.
+
+    Returns:
+        dict[str, dict]: the count, total, mean, minimum, 50th, 95th and 99th
+            percentile, maximum and number of rows per name.
+    """
+    with _lock:
+        return {
+            name: histogram.as_dict()
+            for name, histogram in _histograms.items()
+        }
+
+
+def print_report(file: Optional[TextIO] = None) -> None:
+    """
+    This function prints the statistics of the recorded statements and
+    functions, with the largest total latency first.
+
+    Args:
+        file (Optional[TextIO], optional): the file to print to. If None,
+            the report is printed to standard output. Defaults to None.
+    """
+    report = sorted(
+        get_report().items(), key=lambda item: item[1]["total"], reverse=True
+    )
+    print(
+        f"{'count':>8} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'p99 ms':>9} {'max ms':>9} {'rows':>9}  name",
+        file=file,
+    )
+    for name, stats in report:
+        print(
+            f"{stats['count']:>8} {stats['total']:>9.3f} "
+            f"{stats['p50'] * 1e3:>9.3f} {stats['p95'] * 1e3:>9.3f} "
+            f"{stats['p99'] * 1e3:>9.3f} {stats['max'] * 1e3:>9.3f} "
+            f"{'-' if stats['rows'] is None else stats['rows']:>9}  {name}",
+            file=file,
+        )
+
+
+def dump_report(path: str) -> None:
+    """
+    This function writes the statistics of the recorded statements and
+    functions to a JSON file.
+
+    Args:
+        path (str): the path to the JSON file.
+    """
+    with open(path, "w") as f:
+        json.dump(
+            {"sample_rate": _sample_rate, "report": get_report()}, f, indent=2
+        )
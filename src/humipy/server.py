@@ -0,0 +1,560 @@
+"""
+This module implements a network ingestion server for humidity measurements.
+
+Sensor gateways send measurements over TCP or UDP using a simple line
+protocol. Every line holds a sensor serial number, a humidity value and an
+optional timestamp, separated by whitespace or commas, optionally followed by
+the temperature and pressure of the same sample as named fields:
+
+XIE-385A92H20-T0 61.5
+XIE-385A92H20-T0,61.5,2024-01-31T12:00:00
+XIE-385A92H20-T0 61.5 temperature=21.4 pressure=1013.2
+
+The timestamp is either an ISO 8601 date and time or a Unix timestamp. If it
+is omitted, the time of arrival is used. Gateways that buffer measurements
+should send the timestamp of the sensor: a measurement that was written
+already is skipped, so that a batch can be resent safely after a failure, and
+it is attributed to the placement of the sensor at that time. Received
+measurements are buffered in memory and written to the database in batches,
+either when a batch is full or when the flush interval has passed. When the
+buffer is full, TCP clients are no longer read from until there is room
+again, while UDP datagrams are dropped. With a spool (see humipy.spool), the
+batches that cannot be written because the database is unreachable are kept
+on disk and replayed in the background once it is reachable again.
+"""
+
+
+import asyncio
+import contextlib
+from datetime import datetime, timedelta
+from humipy.database.pool import get_pool_stats
+from humipy.database.write import push_measurements
+from humipy.spool import Spool, is_unreachable
+import logging
+import math
+import sqlalchemy
+import time
+from typing import Optional
+
+
+_logger = logging.getLogger(__name__)
+_STOP = object()
+
+
+class IngestionStats:
+    """
+    This class keeps counters that allow sizing the ingestion server.
+    """
+
+    def __init__(self) -> None:
+        self.received = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.written = 0
+        self.skipped = 0
+        self.failed = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.flushes = 0
+        self.flush_seconds_total = 0.
+        self.flush_seconds_max = 0.
+        self.queue_depth = 0
+        self.queue_depth_max = 0
+
+    def record_flush(
+            self,
+            written: int,
+            failed: int,
+            seconds: float,
+            skipped: int = 0) -> None:
+        """
+        This method records the outcome of a flush.
+
+        Args:
+            written (int): the number of measurements written.
+            failed (int): the number of measurements that could not be
+                written.
+            seconds (float): the flush latency in seconds.
+            skipped (int, optional): the number of measurements that were
+                skipped, as duplicates or for sensors that were not placed.
+                Defaults to 0.
+        """
+        self.flushes += 1
+        self.written += written
+        self.skipped += skipped
+        self.failed += failed
+        self.flush_seconds_total += seconds
+        self.flush_seconds_max = max(self.flush_seconds_max, seconds)
+
+    def as_dict(self) -> dict:
+        """
+        This method returns the counters as a dictionary.
+
+        Returns:
+            dict: the counters, including the mean flush latency.
+        """
+        counters = dict(vars(self))
+        counters["flush_seconds_mean"] = (
+            self.flush_seconds_total / self.flushes if self.flushes else 0.
+        )
+        return counters
+
+
+def parse_line(
+        line: str
+        ) -> tuple[
+            str, float, Optional[datetime], Optional[float], Optional[float]]:
+    """
+    This function parses a line of the ingestion protocol.
+
+    Args:
+        line (str): a line holding a sensor serial number, a humidity value,
+            an optional timestamp, and optional temperature and pressure
+            fields (e.g., 'temperature=21.4').
+
+    Raises:
+        ValueError: if the line is malformed or a value is not finite (e.g.,
+            'nan').
+
+    Returns:
+        tuple[str, float, Optional[datetime], Optional[float],
+            Optional[float]]: the sensor serial number, the humidity, the
+            measurement time, the temperature and the pressure (None if not
+            given).
+    """
+    fields = line.replace(",", " ").split()
+    channels: dict[str, Optional[float]] = {
+        "temperature": None, "pressure": None,
+    }
+    while fields and "=" in fields[-1]:
+        name, value = fields.pop().split("=", 1)
+        if name not in channels:
+            raise ValueError(f"Unknown field: {name}.")
+        channels[name] = _parse_value(name, value)
+    if len(fields) not in (2, 3):
+        raise ValueError(f"Expected 2 or 3 fields, got {len(fields)}.")
+    serial_number, humidity = fields[0], _parse_value("humidity", fields[1])
+    measurement_time = None
+    if len(fields) == 3:
+        try:
+            timestamp = float(fields[2])
+        except ValueError:
+            measurement_time = datetime.fromisoformat(fields[2])
+        else:
+            try:
+                measurement_time = datetime.fromtimestamp(timestamp)
+            except (OverflowError, OSError) as e:
+                raise ValueError(
+                    f"The timestamp is out of range: {fields[2]}."
+                ) from e
+    return (
+        serial_number,
+        humidity,
+        measurement_time,
+        channels["temperature"],
+        channels["pressure"],
+    )
+
+
+def _parse_value(name: str, value: str) -> float:
+    number = float(value)
+    # NaN and infinity would poison the rollup sums
+    if not math.isfinite(number):
+        raise ValueError(f"The {name} is not finite: {value}.")
+    return number
+
+
+async def _read_line(reader: asyncio.StreamReader) -> bytes:
+    """
+    This function reads a line like StreamReader.readline, returning an empty
+    bytes object at the end of the stream. A line that is longer than the
+    limit of the reader is discarded up to and including its newline, rather
+    than partly, so that its tail is not read as another line.
+
+    Raises:
+        ValueError: if the line is longer than the limit of the reader.
+
+    Returns:
+        bytes: the line, including its newline.
+    """
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+    except asyncio.LimitOverrunError as e:
+        consumed = e.consumed
+    while True:
+        await reader.readexactly(consumed)
+        try:
+            await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError:
+            pass
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+            continue
+        raise ValueError("The line is longer than the limit of the reader.")
+
+
+class IngestionServer:
+    """
+    This class implements an asyncio ingestion server with write-behind
+    buffering.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        batch_size (int, optional): the maximum number of measurements per
+            database write. Defaults to 500.
+        flush_interval (float, optional): the maximum number of seconds a
+            measurement is buffered before it is written. Defaults to 1.
+        max_queue (int, optional): the maximum number of buffered
+            measurements. Defaults to 10000.
+        spool (Optional[Spool], optional): the spool that keeps the batches
+            while the database is unreachable, or None to count them as
+            failed. Defaults to None.
+        replay_interval (float, optional): the number of seconds between two
+            attempts to replay the spool. Defaults to 10.
+        replay_rate (Optional[float], optional): the maximum number of
+            spooled measurements replayed per second, or None for no limit.
+            Defaults to None.
+    """
+
+    def __init__(
+            self,
+            engine: sqlalchemy.engine.base.Engine,
+            batch_size: int = 500,
+            flush_interval: float = 1.,
+            max_queue: int = 10000,
+            spool: Optional[Spool] = None,
+            replay_interval: float = 10.,
+            replay_rate: Optional[float] = None) -> None:
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.spool = spool
+        self.replay_interval = replay_interval
+        self.replay_rate = replay_rate
+        self.stats = IngestionStats()
+        self._queue: Optional[asyncio.Queue] = None
+        self._writers: set[asyncio.StreamWriter] = set()
+        self._last_arrival = datetime.min
+
+    async def serve(
+            self,
+            host: str = "0.0.0.0",
+            port: Optional[int] = 8300,
+            udp_port: Optional[int] = None,
+            stats_interval: Optional[float] = None) -> None:
+        """
+        This method starts the listeners and the flusher, and runs until it
+        is cancelled. Buffered measurements are flushed before returning.
+
+        Args:
+            host (str, optional): the address to listen on. Defaults to
+                '0.0.0.0'.
+            port (Optional[int], optional): the TCP port, or None to disable
+                TCP. Defaults to 8300.
+            udp_port (Optional[int], optional): the UDP port, or None to
+                disable UDP. Defaults to None.
+            stats_interval (Optional[float], optional): the number of seconds
+                between two log messages with the counters, or None to
+                disable them. Defaults to None.
+        """
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        flusher = asyncio.create_task(self._flush_forever())
+        reporter = (
+            asyncio.create_task(self._report_forever(stats_interval))
+            if stats_interval else None
+        )
+        replayer = (
+            asyncio.create_task(self._replay_forever(self.spool))
+            if self.spool is not None else None
+        )
+        tcp_server = None
+        udp_transport = None
+        try:
+            if port is not None:
+                tcp_server = await asyncio.start_server(
+                    self._handle_tcp_client, host, port
+                )
+                _logger.info("Listening on tcp://%s:%s", host, port)
+            if udp_port is not None:
+                udp_transport, _ = await loop.create_datagram_endpoint(
+                    lambda: _DatagramProtocol(self),
+                    local_addr=(host, udp_port),
+                )
+                _logger.info("Listening on udp://%s:%s", host, udp_port)
+            await asyncio.Future()
+        finally:
+            if tcp_server is not None:
+                tcp_server.close()
+                for writer in self._writers:
+                    writer.close()
+            if udp_transport is not None:
+                udp_transport.close()
+            if reporter is not None:
+                reporter.cancel()
+            if replayer is not None:
+                replayer.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await replayer
+            # Let the flusher write the remaining buffered measurements
+            await self._get_queue().put(_STOP)
+            await flusher
+            _logger.info("Stopped: %s", self.stats.as_dict())
+            _logger.info("Pool: %s", get_pool_stats(self.engine))
+
+    async def submit(self, line: str) -> bool:
+        """
+        This method parses a line and buffers the measurement, waiting for
+        room in the buffer if it is full.
+
+        Args:
+            line (str): a line of the ingestion protocol.
+
+        Returns:
+            bool: True if the line was accepted, otherwise False.
+        """
+        reading = self._parse(line)
+        if reading is None:
+            return False
+        await self._get_queue().put(reading)
+        self._update_queue_depth()
+        return True
+
+    def submit_nowait(self, line: str) -> bool:
+        """
+        This method parses a line and buffers the measurement. If the buffer
+        is full, the measurement is dropped.
+
+        Args:
+            line (str): a line of the ingestion protocol.
+
+        Returns:
+            bool: True if the line was accepted, otherwise False.
+        """
+        reading = self._parse(line)
+        if reading is None:
+            return False
+        try:
+            self._get_queue().put_nowait(reading)
+        except asyncio.QueueFull:
+            self.stats.dropped += 1
+            return False
+        self._update_queue_depth()
+        return True
+
+    def _parse(self, line: str) -> Optional[tuple]:
+        line = line.strip()
+        if not line:
+            return None
+        self.stats.received += 1
+        try:
+            reading = parse_line(line)
+        except (ValueError, OverflowError, OSError):
+            # Any line a client can send is reported as malformed, rather
+            # than closing its connection
+            self.stats.rejected += 1
+            return None
+        if reading[2] is None:
+            # The arrival times are strictly increasing, so that measurements
+            # of a sensor that arrive within the same microsecond are not
+            # skipped as duplicates
+            self._last_arrival = max(
+                datetime.now(), self._last_arrival + timedelta(microseconds=1)
+            )
+            reading = (
+                reading[0], reading[1], self._last_arrival, *reading[3:]
+            )
+        return reading
+
+    def _get_queue(self) -> asyncio.Queue:
+        # The buffer is created by serve, in its event loop
+        if self._queue is None:
+            raise RuntimeError("The server is not running.")
+        return self._queue
+
+    def _update_queue_depth(self) -> None:
+        self.stats.queue_depth = self._get_queue().qsize()
+        self.stats.queue_depth_max = max(
+            self.stats.queue_depth_max, self.stats.queue_depth
+        )
+
+    async def _handle_tcp_client(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter) -> None:
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    line = await _read_line(reader)
+                except ValueError:
+                    # The line is dropped, but the connection is kept
+                    self.stats.received += 1
+                    self.stats.rejected += 1
+                    writer.write(b"ERR line too long\n")
+                    continue
+                if not line:
+                    break
+                if not await self.submit(line.decode(errors="replace")):
+                    if line.strip():
+                        writer.write(b"ERR malformed line\n")
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _flush_forever(self) -> None:
+        queue = self._get_queue()
+        stopping = False
+        while not stopping:
+            reading = await queue.get()
+            if reading is _STOP:
+                break
+            batch = [reading]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    reading = await asyncio.wait_for(
+                        queue.get(), timeout
+                    )
+                except asyncio.TimeoutError:
+                    break
+                if reading is _STOP:
+                    stopping = True
+                    break
+                batch.append(reading)
+            try:
+                await self._flush(batch)
+            except Exception:
+                # The batch is dropped, but the flusher keeps running, as the
+                # buffer would otherwise fill up and block every client
+                _logger.exception(
+                    "Failed to flush %s measurements", len(batch)
+                )
+                self.stats.record_flush(0, len(batch), 0.)
+
+    async def _flush(self, batch: list) -> None:
+        self.stats.queue_depth = self._get_queue().qsize()
+        start = time.perf_counter()
+        try:
+            written = await asyncio.to_thread(
+                push_measurements, self.engine, batch
+            )
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            if self.spool is None or not is_unreachable(e):
+                _logger.exception(
+                    "Failed to write %s measurements", len(batch)
+                )
+                self.stats.record_flush(
+                    0, len(batch), time.perf_counter() - start
+                )
+                return
+            _logger.warning(
+                "The database is unreachable, spooling %s measurements",
+                len(batch),
+            )
+            spooled = await asyncio.to_thread(self.spool.append, batch)
+            self.stats.spooled += spooled
+            self.stats.record_flush(
+                0, len(batch) - spooled, time.perf_counter() - start
+            )
+            return
+        self.stats.record_flush(
+            written, 0, time.perf_counter() - start,
+            skipped=len(batch) - written,
+        )
+
+    async def _replay_forever(self, spool: Spool) -> None:
+        while True:
+            await asyncio.sleep(self.replay_interval)
+            if not spool.pending_bytes:
+                continue
+            try:
+                summary = await asyncio.to_thread(
+                    spool.replay,
+                    self.engine,
+                    self.batch_size,
+                    self.replay_rate,
+                )
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                if not is_unreachable(e):
+                    _logger.exception("Failed to replay the spool")
+                continue
+            self.stats.replayed += summary["replayed"]
+            _logger.info("Replayed the spool: %s", summary)
+
+    async def _report_forever(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            _logger.info("Stats: %s", self.stats.as_dict())
+            _logger.info("Pool: %s", get_pool_stats(self.engine))
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, server: IngestionServer) -> None:
+        self.server = server
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        for line in data.decode(errors="replace").splitlines():
+            self.server.submit_nowait(line)
+
+
+def serve(
+        engine: sqlalchemy.engine.base.Engine,
+        host: str = "0.0.0.0",
+        port: Optional[int] = 8300,
+        udp_port: Optional[int] = None,
+        batch_size: int = 500,
+        flush_interval: float = 1.,
+        max_queue: int = 10000,
+        stats_interval: Optional[float] = 60.,
+        spool: Optional[Spool] = None,
+        replay_interval: float = 10.,
+        replay_rate: Optional[float] = None) -> None:
+    """
+    This function runs an ingestion server until it is interrupted.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        host (str, optional): the address to listen on. Defaults to
+            '0.0.0.0'.
+        port (Optional[int], optional): the TCP port, or None to disable TCP.
+            Defaults to 8300.
+        udp_port (Optional[int], optional): the UDP port, or None to disable
+            UDP. Defaults to None.
+        batch_size (int, optional): the maximum number of measurements per
+            database write. Defaults to 500.
+        flush_interval (float, optional): the maximum number of seconds a
+            measurement is buffered before it is written. Defaults to 1.
+        max_queue (int, optional): the maximum number of buffered
+            measurements. Defaults to 10000.
+        stats_interval (Optional[float], optional): the number of seconds
+            between two log messages with the counters, or None to disable
+            them. Defaults to 60.
+        spool (Optional[Spool], optional): the spool that keeps the batches
+            while the database is unreachable. Defaults to None.
+        replay_interval (float, optional): the number of seconds between two
+            attempts to replay the spool. Defaults to 10.
+        replay_rate (Optional[float], optional): the maximum number of
+            spooled measurements replayed per second, or None for no limit.
+            Defaults to None.
+    """
+    server = IngestionServer(
+        engine,
+        batch_size,
+        flush_interval,
+        max_queue,
+        spool=spool,
+        replay_interval=replay_interval,
+        replay_rate=replay_rate,
+    )
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(server.serve(host, port, udp_port, stats_interval))
@@ -0,0 +1,444 @@
+"""
+This module implements a local spool that keeps measurements on disk while
+the database is unreachable, so that a network outage between a site and the
+database does not lose measurements.
+
+The spool is a directory of append-only segment files, in which every
+reading is a JSON line:
+
+directory/segment-00000000000000000001.jsonl
+
+Readings are appended to the newest segment, and a new segment is started
+once it exceeds a size. When the database is reachable again, the segments
+are sealed (renamed to a .sealed file, so that nothing is appended to them
+anymore), replayed oldest first in batches and removed once they are
+written. A replay that is interrupted resends its current segment the next
+time, which is safe as measurements that were written already are skipped (see
+humipy.database.write). Readings that the database rejects, and lines that
+cannot be parsed, are moved to quarantine files, so that they do not block
+the readings behind them:
+
+directory/quarantine-00000000000000000001.jsonl
+
+Readings are stamped with the time they are spooled
+if they have no measurement time, so that replayed measurements keep their
+original time.
+
+Several processes (e.g., the server and a cron job that pushes or replays)
+can share a spool directory: appends and the sealing of segments hold an
+exclusive lock on directory/.lock, and a replay holds directory/.replay.lock,
+so that only one replay runs at a time.
+
+How often the segments are synced to disk is a trade-off between the
+measurements that may be lost in a power failure and the cost of an append:
+'always' syncs after every append, 'interval' at most once per interval and
+'never' leaves it to the operating system.
+"""
+
+
+import contextlib
+from datetime import datetime, timedelta
+from humipy.database.write import push_measurements
+import json
+import logging
+import os
+import sqlalchemy
+import threading
+import time
+from types import ModuleType
+from typing import Iterable, Iterator, Optional
+
+fcntl: Optional[ModuleType]
+try:
+    import fcntl
+except ImportError:
+    # Without file locks (e.g., on Windows), a spool directory must only be
+    # used by one process at a time
+    fcntl = None
+
+
+_logger = logging.getLogger(__name__)
+_PREFIX = "segment-"
+_QUARANTINE_PREFIX = "quarantine-"
+_SUFFIX = ".jsonl"
+_SEALED_SUFFIX = ".sealed"
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+def is_unreachable(error: Exception) -> bool:
+    """
+    This function checks whether a database error means that the database
+    could not be reached, as opposed to, e.g., a missing table, a locked
+    database or a statement timeout, which are not solved by waiting.
+
+    Args:
+        error (Exception): the error.
+
+    Returns:
+        bool: True if the measurements should be spooled.
+    """
+    if isinstance(error, sqlalchemy.exc.TimeoutError):
+        # No connection could be checked out of the pool in time
+        return True
+    if not isinstance(error, sqlalchemy.exc.DBAPIError):
+        return False
+    # Errors raised while connecting have no statement, and errors that
+    # broke an established connection invalidate it
+    return error.statement is None or error.connection_invalidated
+
+
+class Spool:
+    """
+    This class appends readings to segment files and replays them to the
+    database. A spool directory can be shared by several threads and
+    processes.
+
+    Args:
+        directory (str): the spool directory, which is created if needed.
+        segment_bytes (int, optional): the size above which a new segment is
+            started. Defaults to 8 MiB.
+        max_bytes (int, optional): the maximum size of the spool. Readings
+            that do not fit are dropped. Defaults to 256 MiB.
+        fsync (str, optional): 'always', 'interval' or 'never'. Defaults to
+            'always'.
+        fsync_interval (float, optional): the minimum number of seconds
+            between two syncs of the 'interval' policy. Defaults to 1.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            segment_bytes: int = 8 * 1024 ** 2,
+            max_bytes: int = 256 * 1024 ** 2,
+            fsync: str = "always",
+            fsync_interval: float = 1.) -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}.")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.dropped = 0
+        self._locks = {
+            ".lock": threading.Lock(), ".replay.lock": threading.Lock(),
+        }
+        self._last_fsync = 0.
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def pending_bytes(self) -> int:
+        """
+        int: the size of the spooled readings in bytes, including the
+            segments that are being replayed.
+        """
+        return sum(_get_size(path) for path in self._segments(sealed=True))
+
+    def append(self, readings: Iterable[tuple]) -> int:
+        """
+        This method appends readings to the newest segment. Readings without
+        a measurement time are stamped with the current date and time.
+
+        Args:
+            readings (Iterable[tuple]): the readings as (sensor serial
+                number, humidity, measurement time[, temperature[,
+                pressure]]) tuples.
+
+        Returns:
+            int: the number of readings spooled. The others were dropped, as
+                the spool is full.
+        """
+        now = datetime.now()
+        lines = []
+        for i, reading in enumerate(readings):
+            serial_number, humidity, timestamp, temperature, pressure = (
+                *reading, None, None
+            )[:5]
+            if timestamp is None:
+                # One microsecond apart, like the readings written directly
+                timestamp = now + timedelta(microseconds=i)
+            reading = (
+                serial_number, humidity, timestamp, temperature, pressure,
+            )
+            lines.append(_dump_reading(reading))
+
+        with self._locked(".lock"):
+            pending = self.pending_bytes
+            data = []
+            size = 0
+            for line in lines:
+                if pending + size + len(line) > self.max_bytes:
+                    break
+                data.append(line)
+                size += len(line)
+            dropped = len(lines) - len(data)
+            if dropped:
+                self.dropped += dropped
+                _logger.warning(
+                    "The spool is full, dropped %s readings", dropped
+                )
+            if not data:
+                return 0
+            segments = self._segments()
+            if segments and _get_size(segments[-1]) < self.segment_bytes:
+                path = segments[-1]
+            else:
+                path = self._new_segment()
+            with open(path, "ab") as f:
+                f.write(b"".join(data))
+                f.flush()
+                if self.fsync == "always" or (
+                        self.fsync == "interval"
+                        and time.monotonic() - self._last_fsync
+                        >= self.fsync_interval):
+                    os.fsync(f.fileno())
+                    self._last_fsync = time.monotonic()
+        return len(data)
+
+    def replay(
+            self,
+            engine: sqlalchemy.engine.base.Engine,
+            batch_size: int = 500,
+            max_rate: Optional[float] = None) -> dict[str, int]:
+        """
+        This method writes the spooled readings to the database, oldest
+        segment first, and removes every segment once it is written. If the
+        database cannot be reached, the error is raised and the remaining
+        segments are kept. A batch that fails for another reason is retried
+        reading by reading, and the readings that still fail are
+        quarantined. If another replay of the spool is running, nothing is
+        replayed.
+
+        Args:
+            engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine
+                object.
+            batch_size (int, optional): the number of readings per database
+                write. Defaults to 500.
+            max_rate (Optional[float], optional): the maximum number of
+                readings replayed per second, so that a replay does not
+                crowd out the live measurements, or None for no limit.
+                Defaults to None.
+
+        Returns:
+            dict[str, int]: the number of segments and readings replayed,
+                the number of measurements written (the others were
+                duplicates or from sensors that were not placed), the
+                number of corrupt lines, and the number of lines
+                quarantined (the corrupt lines and the rejected readings).
+        """
+        summary = {
+            "segments": 0, "replayed": 0, "written": 0, "corrupt": 0,
+            "quarantined": 0,
+        }
+        with self._locked(".replay.lock", blocking=False) as locked:
+            if not locked:
+                _logger.info("The spool is being replayed by another process")
+                return summary
+            with self._locked(".lock"):
+                # The segments are sealed, so that the readings appended
+                # from now on go to a new segment. Segments that were sealed
+                # by an interrupted replay are replayed too.
+                for path in self._segments():
+                    os.replace(path, path[:-len(_SUFFIX)] + _SEALED_SUFFIX)
+                self._sync_directory()
+            start = time.monotonic()
+            for path in self._segments(sealed=True, appendable=False):
+                try:
+                    readings, corrupt = _read_segment(path)
+                except FileNotFoundError:
+                    continue
+                summary["corrupt"] += len(corrupt)
+                quarantine = [line.rstrip(b"\n") + b"\n" for line in corrupt]
+                for i in range(0, len(readings), batch_size):
+                    batch = readings[i:i + batch_size]
+                    written, rejected = _push_batch(engine, batch)
+                    summary["written"] += written
+                    summary["replayed"] += len(batch)
+                    quarantine.extend(
+                        _dump_reading(reading) for reading in rejected
+                    )
+                    if max_rate:
+                        delay = (
+                            summary["replayed"] / max_rate
+                            - (time.monotonic() - start)
+                        )
+                        if delay > 0:
+                            time.sleep(delay)
+                summary["quarantined"] += len(quarantine)
+                if quarantine:
+                    self._quarantine(path, quarantine)
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                summary["segments"] += 1
+        if summary["quarantined"]:
+            _logger.warning(
+                "Quarantined %s spooled readings (%s corrupt lines)",
+                summary["quarantined"], summary["corrupt"],
+            )
+        return summary
+
+    @contextlib.contextmanager
+    def _locked(self, name: str, blocking: bool = True) -> Iterator[bool]:
+        """
+        This method holds a lock that is shared by the threads of this
+        process and by the other processes that use the spool directory.
+
+        Yields:
+            bool: whether the lock was acquired, which is always the case if
+                blocking.
+        """
+        lock = self._locks[name]
+        if not lock.acquire(blocking=blocking):
+            yield False
+            return
+        try:
+            if fcntl is None:
+                yield True
+                return
+            with open(os.path.join(self.directory, name), "ab") as f:
+                try:
+                    fcntl.flock(
+                        f.fileno(),
+                        fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB),
+                    )
+                except BlockingIOError:
+                    yield False
+                    return
+                yield True
+        finally:
+            lock.release()
+
+    def _segments(
+            self,
+            sealed: bool = False,
+            appendable: bool = True) -> list[str]:
+        suffixes = (
+            ((_SUFFIX,) if appendable else ())
+            + ((_SEALED_SUFFIX,) if sealed else ())
+        )
+        return sorted(
+            (
+                os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.startswith(_PREFIX) and name.endswith(suffixes)
+            ),
+            key=_get_sequence,
+        )
+
+    def _new_segment(self) -> str:
+        sequences = [
+            _get_sequence(name)
+            for name in os.listdir(self.directory)
+            if name.startswith(_PREFIX)
+        ]
+        sequence = max(sequences, default=0) + 1
+        path = os.path.join(
+            self.directory, f"{_PREFIX}{sequence:020d}{_SUFFIX}"
+        )
+        open(path, "ab").close()
+        self._sync_directory()
+        return path
+
+    def _quarantine(self, path: str, lines: list[bytes]) -> None:
+        name = f"{_QUARANTINE_PREFIX}{_get_sequence(path):020d}{_SUFFIX}"
+        with open(os.path.join(self.directory, name), "ab") as f:
+            f.write(b"".join(lines))
+            f.flush()
+            if self.fsync != "never":
+                os.fsync(f.fileno())
+
+    def _sync_directory(self) -> None:
+        if self.fsync == "never":
+            return
+        # The directory entries are synced too, so that new and renamed
+        # segments survive a power failure
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+def _get_sequence(path: str) -> int:
+    name = os.path.basename(path)
+    return int(name[name.index("-") + 1:name.index(".")])
+
+
+def _get_size(path: str) -> int:
+    # A segment can be removed by a replay in another process
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _dump_reading(reading: tuple) -> bytes:
+    serial_number, humidity, timestamp, temperature, pressure = reading
+    record = [
+        serial_number, humidity, timestamp.isoformat(), temperature, pressure,
+    ]
+    return json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+
+def _push_batch(
+        engine: sqlalchemy.engine.base.Engine,
+        batch: list[tuple]) -> tuple[int, list[tuple]]:
+    """
+    This function writes a batch of spooled readings. If the batch fails for
+    another reason than an unreachable database, the readings are written
+    one by one, so that a single bad reading does not hold back the others.
+
+    Returns:
+        tuple[int, list[tuple]]: the number of measurements written, and the
+            readings that were rejected.
+    """
+    try:
+        return push_measurements(engine, batch), []
+    except (sqlalchemy.exc.SQLAlchemyError, TypeError, ValueError) as e:
+        if is_unreachable(e):
+            raise
+        _logger.warning(
+            "Failed to replay a batch, retrying per reading: %s", e
+        )
+    written = 0
+    rejected = []
+    for reading in batch:
+        try:
+            written += push_measurements(engine, [reading])
+        except (sqlalchemy.exc.SQLAlchemyError, TypeError, ValueError) as e:
+            if is_unreachable(e):
+                raise
+            rejected.append(reading)
+    return written, rejected
+
+
+def _read_segment(path: str) -> tuple[list[tuple], list[bytes]]:
+    """
+    This function reads the readings of a segment. Lines that cannot be
+    parsed (e.g., the last line of a segment that was being written during a
+    power failure) are returned separately.
+
+    Returns:
+        tuple[list[tuple], list[bytes]]: the readings, and the lines that
+            could not be parsed.
+    """
+    readings = []
+    corrupt = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                serial_number, humidity, timestamp, temperature, pressure = (
+                    json.loads(line)
+                )
+                readings.append(
+                    (
+                        serial_number,
+                        humidity,
+                        datetime.fromisoformat(timestamp),
+                        temperature,
+                        pressure,
+                    )
+                )
+            except (TypeError, ValueError):
+                corrupt.append(line)
+    return readings, corrupt
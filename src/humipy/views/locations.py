@@ -1,5 +1,6 @@
-from humipy.database.read import get_locations
+from humipy.database.read import fetch_locations
 from humipy.database.write import add_location
+from humipy.profiling import timed
 from rich.console import Console
 from rich.padding import Padding
 from rich.panel import Panel
@@ -8,6 +9,7 @@ from rich.table import Table
 import sqlalchemy
 
 
+@timed
 def render_locations_table(engine: sqlalchemy.engine.base.Engine) -> str:
     """
     This function renders a table with all available locations. The function 
@@ -25,10 +27,10 @@ def render_locations_table(engine: sqlalchemy.engine.base.Engine) -> str:
     table = Table(caption="Locations", caption_justify="left")
     table.add_column("ID", style="cyan", justify="left", vertical="middle", min_width=4)
     table.add_column("Location", justify="left", vertical="middle", min_width=30)
-    locations = get_locations(engine).to_dict(orient="records")
+    locations = fetch_locations(engine)
 
     for row in locations:
-        table.add_row(str(row["location_id"]), row["location_name"])
+        table.add_row(str(row.location_id), row.location_name)
 
     console.print(Panel("Available Locations"))
     console.print(Padding(table, (0, 0, 0, 2)))
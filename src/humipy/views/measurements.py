@@ -1,11 +1,141 @@
+from collections import deque
 import contextlib
-from humipy.database.read import get_recent_measurements
+from datetime import datetime, timedelta
+from humipy.database.read import (
+    fetch_latest_per_location,
+    fetch_measurements_since,
+    fetch_recent_measurements,
+    fetch_sensor_locations,
+)
+from humipy.profiling import timed
+from rich.console import Console
 from rich.live import Live
+from rich.padding import Padding
+from rich.panel import Panel
 from rich.table import Table
 import sqlalchemy
 import time
+from typing import Iterable, NamedTuple, Optional
 
 
+class _MeasurementRow(NamedTuple):
+    measurement_time: datetime
+    humidity_measurement_id: int
+    location_name: str
+    sensor_serial_number: str
+    humidity: Optional[float]
+    temperature: Optional[float]
+
+
+class LiveMeasurements:
+    """
+    This class keeps the n most recent humidity measurements in a ring buffer
+    for the live view, ordered by measurement time. Every refresh only
+    fetches the measurements taken after the most recent measurement time
+    seen (the watermark), minus an overlap window, so that measurements that
+    are committed a little later than newer ones still show up. The
+    measurements that are fetched again are skipped by their identifier, and
+    measurements taken before the overlap window (e.g., replayed from a
+    spool) are not shown as new. Location names and sensor serial numbers
+    are resolved from a local cache of the sensor locations, which is only
+    reloaded when an unknown sensor location shows up.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        top_n (int): the n most recent measurements to keep.
+        overlap (timedelta, optional): the overlap window. Defaults to ten
+            seconds.
+    """
+
+    def __init__(
+            self,
+            engine: sqlalchemy.engine.base.Engine,
+            top_n: int,
+            overlap: timedelta = timedelta(seconds=10)) -> None:
+        self.engine = engine
+        self.top_n = top_n
+        self.overlap = overlap
+        self.rows: deque[_MeasurementRow] = deque(maxlen=top_n)
+        self.watermark: Optional[datetime] = None
+        self._sensor_locations: dict[int, tuple[str, str]] = {}
+
+    @timed
+    def refresh(self) -> bool:
+        """
+        This method fetches the measurements added since the previous refresh
+        and merges them into the ring buffer.
+
+        Returns:
+            bool: True if new measurements were found, otherwise False.
+        """
+        if self.watermark is None:
+            # The first refresh fills the buffer with the most recent
+            # measurements
+            since = None
+        else:
+            since = self.watermark - self.overlap
+        measurements = fetch_measurements_since(
+            self.engine, since, self.top_n
+        )
+        seen = {row.humidity_measurement_id for row in self.rows}
+        measurements = [
+            row for row in measurements
+            if row.humidity_measurement_id not in seen
+        ]
+        if not measurements:
+            return False
+        if any(
+            row.sensor_location_id not in self._sensor_locations
+            for row in measurements
+        ):
+            self._load_sensor_locations()
+
+        rows = list(self.rows)
+        for row in measurements:
+            location_name, sensor_serial_number = self._sensor_locations.get(
+                row.sensor_location_id, ("", "")
+            )
+            rows.append(
+                _MeasurementRow(
+                    row.measurement_time,
+                    row.humidity_measurement_id,
+                    location_name,
+                    sensor_serial_number,
+                    row.humidity,
+                    row.temperature,
+                )
+            )
+        # Measurements that were committed late can be older than buffered
+        # ones, so the buffer is sorted again, oldest first
+        rows.sort(key=lambda row: row[:2])
+        self.rows = deque(rows[-self.top_n:], maxlen=self.top_n)
+        # A sensor with a clock that runs ahead must not move the watermark
+        # past the measurements of the other sensors
+        newest = min(measurements[0].measurement_time, datetime.now())
+        if self.watermark is None or newest > self.watermark:
+            self.watermark = newest
+        return True
+
+    def get_table(self) -> Table:
+        """
+        This method returns a table with the buffered measurements, newest
+        first.
+
+        Returns:
+            Table: a table object with the n most recent measurements.
+        """
+        return _build_measurements_table(reversed(self.rows))
+
+    def _load_sensor_locations(self) -> None:
+        self._sensor_locations = {
+            row.sensor_location_id: (
+                row.location_name, row.sensor_serial_number
+            )
+            for row in fetch_sensor_locations(self.engine)
+        }
+
+
+@timed
 def get_measurements_table(
         engine: sqlalchemy.engine.base.Engine,
         top_n: int) -> Table:
@@ -20,23 +150,43 @@ def get_measurements_table(
     Returns:
         Table: a table object with the n most recent measurements
     """
+    return _build_measurements_table(fetch_recent_measurements(engine, top_n))
+
+
+def _build_measurements_table(measurements: Iterable) -> Table:
+    """
+    This function builds a table object from humidity measurements.
+
+    Args:
+        measurements (Iterable): the measurements, each with a measurement
+            time, location name, sensor serial number, humidity and
+            temperature attribute.
+
+    Returns:
+        Table: a table object with the measurements.
+    """
     table = Table(caption="Humidity Measurements", caption_justify="left")
     table.add_column("Time", justify="left", vertical="middle", min_width=25)
     table.add_column("Location", justify="left", vertical="middle", min_width=25)
     table.add_column("Serial Nr.", justify="left", vertical="middle", min_width=25)
     table.add_column("Humidity", justify="right", vertical="middle", min_width=25)
-    measurements = (
-        get_recent_measurements(engine, top_n).to_dict(orient="records")
-    )
-    
+    table.add_column("Temperature", justify="right", vertical="middle", min_width=15)
+
     for row in measurements:
-        measurement_time = row["measurement_time"].strftime("%Y-%d-%m %H:%M:%S")
-        humidity_measurement = str(round(row["humidity"], 4))
+        measurement_time = row.measurement_time.strftime("%Y-%d-%m %H:%M:%S")
+        humidity_measurement = (
+            "-" if row.humidity is None else str(round(row.humidity, 4))
+        )
+        # Sensors that only measure the humidity leave the temperature empty
+        temperature = (
+            "-" if row.temperature is None else str(round(row.temperature, 2))
+        )
         table.add_row(
             measurement_time,
-            row["location_name"],
-            row["sensor_serial_number"],
+            row.location_name,
+            row.sensor_serial_number,
             humidity_measurement,
+            temperature,
         )
 
     return table
@@ -58,10 +208,49 @@ def render_measurements_view(
     Returns:
         str: menu option (always 'm').
     """
-    with Live(get_measurements_table(engine, top_n), screen=True) as live:
-        index = 0
+    measurements = LiveMeasurements(engine, top_n)
+    measurements.refresh()
+    with Live(measurements.get_table(), screen=True) as live:
         with contextlib.suppress(KeyboardInterrupt):
             while True:
-                live.update(get_measurements_table(engine, top_n))
+                if measurements.refresh():
+                    live.update(measurements.get_table())
                 time.sleep(0.5)
-    return "m"
\ No newline at end of file
+    return "m"
+
+
+@timed
+def render_current_humidity_table(
+        engine: sqlalchemy.engine.base.Engine) -> str:
+    """
+    This function renders a compact table with the current humidity in every 
+    room, i.e., the latest measurement of every open sensor location. The 
+    function returns menu option 'm', as the view is accessed from the main 
+    menu.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+
+    Returns:
+        str: menu option (always 'm').
+    """
+    console = Console()
+    table = Table(caption="Current Humidity", caption_justify="left")
+    table.add_column("Location", justify="left", min_width=20)
+    table.add_column("Serial Nr.", justify="left", min_width=20)
+    table.add_column("Humidity", style="cyan", justify="right", min_width=8)
+    table.add_column("Updated", justify="left", min_width=19)
+    for row in fetch_latest_per_location(engine):
+        if row.measurement_time is None:
+            table.add_row(row.location_name, row.sensor_serial_number, "-", "")
+            continue
+        table.add_row(
+            row.location_name,
+            row.sensor_serial_number,
+            "-" if row.humidity is None else f"{row.humidity:.1f}",
+            row.measurement_time.strftime("%Y-%m-%d %H:%M:%S"),
+        )
+
+    console.print(Panel("Current Humidity"))
+    console.print(Padding(table, (0, 0, 0, 2)))
+    return "m"
@@ -12,10 +12,11 @@ def render_main_menu() -> str:
     console = Console()
     console.print(Panel("Main Menu"))
     console.print(Padding("- Manage database \[d]", (0, 0, 0, 2)))
+    console.print(Padding("- Show current humidity \[c]", (0, 0, 0, 2)))
     console.print(Padding("- Show measurements \[e]", (0, 0, 0, 2)))
     console.print(Padding("- Quit \[q]", (0, 0, 0, 2)))
     console.print("")
-    return Prompt.ask("  What do you want to do?", choices=["d", "e", "q"])
+    return Prompt.ask("  What do you want to do?", choices=["d", "c", "e", "q"])
 
 
 def render_database_menu() -> str:
@@ -32,6 +33,7 @@ def render_database_menu() -> str:
     console.print(Padding("- Add location \[a]", (0, 0, 0, 2)))
     console.print(Padding("- List sensors \[s]", (0, 0, 0, 2)))
     console.print(Padding("- Add sensor \[w]", (0, 0, 0, 2)))
+    console.print(Padding("- Show sensor health \[h]", (0, 0, 0, 2)))
     console.print(Padding("- List open sensor locations \[o]", (0, 0, 0, 2)))
     console.print(Padding("- Start sensor placement \[b]", (0, 0, 0, 2)))
     console.print(Padding("- Stop sensor placement \[t]", (0, 0, 0, 2)))
@@ -40,5 +42,5 @@ def render_database_menu() -> str:
     console.print("")
     return Prompt.ask(
         "  What do you want to do?",
-        choices=["l", "a", "s", "w", "o", "b", "t", "m", "q"],
+        choices=["l", "a", "s", "w", "h", "o", "b", "t", "m", "q"],
     )
\ No newline at end of file
@@ -1,6 +1,6 @@
-import datetime
-from humipy.database.read import get_open_sensor_locations
+from humipy.database.read import fetch_open_sensor_locations
 from humipy.database.write import start_sensor_placement
+from humipy.profiling import timed
 from rich.console import Console
 from rich.padding import Padding
 from rich.panel import Panel
@@ -9,6 +9,7 @@ from rich.table import Table
 import sqlalchemy
 
 
+@timed
 def render_open_sensor_locations_table(
         engine: sqlalchemy.engine.base.Engine) -> str:
     """
@@ -28,19 +29,19 @@ def render_open_sensor_locations_table(
     table.add_column("Location", justify="left", vertical="middle", min_width=30)
     table.add_column("Start", justify="left", vertical="middle", min_width=30)
     table.add_column("Stop", justify="left", vertical="middle", min_width=30)
-    sensor_locs = get_open_sensor_locations(engine).to_dict(orient="records")
+    sensor_locs = fetch_open_sensor_locations(engine)
 
     for row in sensor_locs:
-        start_placement = row["start_placement"].strftime("%Y-%m-%d %H:%M:%S")
-        if isinstance(row["stop_placement"], datetime.datetime):
-            stop_placement = row["stop_placement"].strftime("%Y-%m-%d %H:%M:%S")
+        start_placement = row.start_placement.strftime("%Y-%m-%d %H:%M:%S")
+        if row.stop_placement is not None:
+            stop_placement = row.stop_placement.strftime("%Y-%m-%d %H:%M:%S")
         else:
             stop_placement = ""
         table.add_row(
-            str(row["sensor_id"]),
-            row["sensor_serial_number"],
-            str(row["location_id"]),
-            row["location_name"],
+            str(row.sensor_id),
+            row.sensor_serial_number,
+            str(row.location_id),
+            row.location_name,
             start_placement,
             stop_placement,
         )
@@ -1,5 +1,9 @@
-from humipy.database.read import get_sensors
+from datetime import datetime, timedelta
+from humipy.database.health import format_duration, get_sensor_health
+from humipy.database.read import fetch_sensors
 from humipy.database.write import add_sensor
+from humipy.profiling import timed
+import math
 from rich.console import Console
 from rich.padding import Padding
 from rich.panel import Panel
@@ -8,6 +12,7 @@ from rich.table import Table
 import sqlalchemy
 
 
+@timed
 def render_sensors_table(engine: sqlalchemy.engine.base.Engine) -> str:
     """
     This function renders a table with all available sensors. The function 
@@ -23,13 +28,13 @@ def render_sensors_table(engine: sqlalchemy.engine.base.Engine) -> str:
     table.add_column("ID", style="cyan", justify="left", vertical="middle", min_width=4)
     table.add_column("Serial Nr.", justify="left", vertical="middle", min_width=30)
     table.add_column("Type", justify="left", vertical="middle", min_width=30)
-    sensors = get_sensors(engine).to_dict(orient="records")
+    sensors = fetch_sensors(engine)
 
     for row in sensors:
         table.add_row(
-            str(row["sensor_id"]),
-            row["sensor_serial_number"],
-            row["sensor_type"],
+            str(row.sensor_id),
+            row.sensor_serial_number,
+            row.sensor_type,
         )
 
     console.print(Panel("Available Sensors"))
@@ -37,6 +42,50 @@ def render_sensors_table(engine: sqlalchemy.engine.base.Engine) -> str:
     return "d"
 
 
+@timed
+def render_sensor_health_table(engine: sqlalchemy.engine.base.Engine) -> str:
+    """
+    This function renders a table with the health of the open sensor 
+    locations over the last week: the time since their last measurement, 
+    their gaps of more than 15 minutes, their uptime and the drift of their 
+    reporting rate over the last day. The function returns menu option 'd', 
+    as the view is accessed from the database menu.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+
+    Returns:
+        str: menu option (always 'd').
+    """
+    console = Console()
+    table = Table(caption="Sensor Health (last 7 days)", caption_justify="left")
+    table.add_column("Location", justify="left", min_width=20)
+    table.add_column("Serial Nr.", justify="left", min_width=20)
+    table.add_column("Silent For", justify="right", min_width=10)
+    table.add_column("Gaps", justify="right", min_width=5)
+    table.add_column("Longest Gap", justify="right", min_width=11)
+    table.add_column("Uptime", style="cyan", justify="right", min_width=7)
+    table.add_column("Rate Drift", justify="right", min_width=10)
+    report = get_sensor_health(
+        engine, start=datetime.now() - timedelta(days=7)
+    )
+    for row in report[report["is_open"]].itertuples():
+        table.add_row(
+            row.location_name,
+            row.sensor_serial_number,
+            format_duration(row.silent_seconds),
+            str(row.gap_count),
+            format_duration(row.longest_gap_seconds),
+            f"{row.uptime_pct:.1f}%",
+            "-" if math.isnan(row.rate_drift_pct)
+            else f"{row.rate_drift_pct:+.0f}%",
+        )
+
+    console.print(Panel("Sensor Health"))
+    console.print(Padding(table, (0, 0, 0, 2)))
+    return "d"
+
+
 def render_sensor_addition(engine: sqlalchemy.engine.base.Engine) -> str:
     """
     This function renders a prompt which asks the user for a new sensor. The 
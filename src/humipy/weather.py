@@ -0,0 +1,271 @@
+"""
+This module backfills the outdoor weather history from the meteomatics API
+into the outdoor_weather table, next to the humidity measurements, so that
+indoor humidity can be correlated with outdoor conditions.
+
+The time range is split into chunks that are fetched in parallel by a
+bounded thread pool, while a rate limiter spaces out the requests. Every
+chunk is inserted in its own transaction, together with a row in the
+weather_backfill_chunks table that marks it as completed. Inserts skip rows
+that already exist, and completed chunks are skipped by later runs, so an
+interrupted backfill resumes where it stopped.
+
+Unlike the humidity measurements, the weather is stored with naive UTC
+times: in local time, the hour that is repeated when daylight saving time
+ends would map two weather values onto the same time, and the insert would
+silently skip one of them. Convert the local times of the humidity
+measurements to UTC to correlate them with the weather.
+"""
+
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from dateutil import tz
+from humipy.database.models import (
+    outdoor_weather_table,
+    weather_backfill_chunks_table,
+)
+from humipy.meteomatics import MeteomaticsClient, _LATITUDE, _LONGITUDE
+import logging
+import sqlalchemy
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+import threading
+import time
+from typing import Iterable, Optional, Union
+
+
+WEATHER_PARAMETERS = [
+    "t_2m:C",
+    "relative_humidity_2m:p",
+    "dew_point_2m:C",
+    "msl_pressure:hPa",
+]
+DEFAULT_LOCATION = f"{_LATITUDE},{_LONGITUDE}"
+
+
+_logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    A thread-safe rate limiter that spaces out calls evenly.
+
+    Args:
+        rate (float): the maximum number of calls per second.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1. / rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        This method blocks until the next call is allowed.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(self._next, now) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def backfill_weather(
+        engine: sqlalchemy.engine.base.Engine,
+        start: datetime,
+        end: datetime,
+        client: Optional[MeteomaticsClient] = None,
+        weather_params: Iterable[str] = WEATHER_PARAMETERS,
+        locations: Iterable[str] = (DEFAULT_LOCATION,),
+        chunk: timedelta = timedelta(days=7),
+        step: timedelta = timedelta(hours=1),
+        max_workers: int = 4,
+        rate: float = 5.) -> dict:
+    """
+    This function backfills the outdoor weather of a time range. The chunks
+    that were completed by an earlier run are skipped.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        start (datetime): the start of the time range. Naive times are local
+            times.
+        end (datetime): the end of the time range (exclusive).
+        client (Optional[MeteomaticsClient], optional): the meteomatics
+            client. If None, a client is created with the credentials in the
+            environment. Defaults to None.
+        weather_params (Iterable[str], optional): the weather parameters.
+            Defaults to the temperature, relative humidity, dew point and
+            pressure.
+        locations (Iterable[str], optional): the locations as
+            'latitude,longitude'. Defaults to Ghent.
+        chunk (timedelta, optional): the time range of a request. Defaults to
+            seven days.
+        step (timedelta, optional): the time between weather values.
+            Defaults to one hour.
+        max_workers (int, optional): the maximum number of concurrent
+            requests. Defaults to 4.
+        rate (float, optional): the maximum number of requests per second.
+            Defaults to 5.
+
+    Returns:
+        dict: the number of chunks in the range, skipped because they were
+            completed before, fetched and failed, and the number of rows
+            inserted.
+    """
+    weather_params = list(weather_params)
+    locations = list(locations)
+    chunks = _split(_as_utc(start), _as_utc(end), chunk)
+    with engine.connect() as conn:
+        completed = set(
+            conn.execute(
+                select(weather_backfill_chunks_table.c.chunk_key)
+            ).scalars()
+        )
+    pending = [
+        (chunk_start, chunk_end)
+        for chunk_start, chunk_end in chunks
+        if _get_chunk_key(chunk_start, chunk_end, weather_params, locations)
+        not in completed
+    ]
+    summary = {
+        "chunks": len(chunks),
+        "skipped": len(chunks) - len(pending),
+        "fetched": 0,
+        "failed": 0,
+        "inserted": 0,
+    }
+    if not pending:
+        return summary
+
+    owns_client = client is None
+    weather_client = MeteomaticsClient() if client is None else client
+    limiter = RateLimiter(rate)
+
+    def fetch(chunk_start: datetime, chunk_end: datetime) -> list[tuple]:
+        limiter.acquire()
+        return weather_client.get_time_series(
+            weather_params, locations, chunk_start, chunk_end - step, step
+        )
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(fetch, chunk_start, chunk_end):
+                    (chunk_start, chunk_end)
+                for chunk_start, chunk_end in pending
+            }
+            # The rows are written from this thread only, while the workers
+            # fetch the next chunks
+            for future in as_completed(futures):
+                chunk_start, chunk_end = futures[future]
+                try:
+                    rows = future.result()
+                except Exception:
+                    _logger.exception(
+                        "Failed to fetch the weather from %s to %s",
+                        chunk_start, chunk_end,
+                    )
+                    summary["failed"] += 1
+                    continue
+                summary["inserted"] += _store_chunk(
+                    engine,
+                    _get_chunk_key(
+                        chunk_start, chunk_end, weather_params, locations
+                    ),
+                    chunk_start,
+                    chunk_end,
+                    rows,
+                )
+                summary["fetched"] += 1
+    finally:
+        if owns_client:
+            weather_client.close()
+    return summary
+
+
+def _store_chunk(
+        engine: sqlalchemy.engine.base.Engine,
+        chunk_key: str,
+        chunk_start: datetime,
+        chunk_end: datetime,
+        rows: list[tuple]) -> int:
+    """
+    This function inserts the weather of a chunk, skipping the rows that
+    already exist, and marks the chunk as completed in the same transaction.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): a SQLAlchemy engine object.
+        chunk_key (str): the key of the chunk.
+        chunk_start (datetime): the start of the chunk (UTC).
+        chunk_end (datetime): the end of the chunk (UTC).
+        rows (list[tuple]): the (parameter, latitude, longitude, time, value)
+            tuples.
+
+    Returns:
+        int: the number of rows inserted.
+    """
+    values = [
+        {
+            "latitude": latitude,
+            "longitude": longitude,
+            "weather_parameter": parameter,
+            "measurement_time": _as_naive_utc(measurement_time),
+            "value": value,
+        }
+        for parameter, latitude, longitude, measurement_time, value in rows
+    ]
+    with engine.begin() as conn:
+        inserted = 0
+        if values:
+            stmt: Union[postgresql.Insert, sqlite.Insert]
+            if conn.dialect.name == "postgresql":
+                stmt = postgresql.insert(outdoor_weather_table)
+            else:
+                stmt = sqlite.insert(outdoor_weather_table)
+            res = conn.execute(stmt.on_conflict_do_nothing(), values)
+            inserted = max(res.rowcount, 0)
+        conn.execute(
+            weather_backfill_chunks_table.insert(),
+            {
+                "chunk_key": chunk_key,
+                "chunk_start": _as_naive_utc(chunk_start),
+                "chunk_end": _as_naive_utc(chunk_end),
+                "row_count": len(values),
+                "completed_at": datetime.now(),
+            },
+        )
+    return inserted
+
+
+def _split(
+        start: datetime,
+        end: datetime,
+        chunk: timedelta) -> list[tuple[datetime, datetime]]:
+    chunks = []
+    while start < end:
+        chunks.append((start, min(start + chunk, end)))
+        start += chunk
+    return chunks
+
+
+def _get_chunk_key(
+        chunk_start: datetime,
+        chunk_end: datetime,
+        weather_params: list[str],
+        locations: list[str]) -> str:
+    return (
+        f"{chunk_start:%Y-%m-%dT%H:%M:%SZ}--{chunk_end:%Y-%m-%dT%H:%M:%SZ}/"
+        f"{','.join(sorted(weather_params))}/{'+'.join(sorted(locations))}"
+    )
+
+
+def _as_utc(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=tz.tzlocal())
+    return dt.astimezone(tz.UTC)
+
+
+def _as_naive_utc(dt: datetime) -> datetime:
+    return _as_utc(dt).replace(tzinfo=None)
@@ -0,0 +1,183 @@
+import base64
+from datetime import datetime, timedelta
+from dateutil import tz
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from humipy.meteomatics import MeteomaticsClient
+import json
+import pytest
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+
+def _make_token(expires_at):
+    def encode(value):
+        return base64.urlsafe_b64encode(
+            json.dumps(value).encode()
+        ).rstrip(b"=").decode()
+
+    return ".".join(
+        [encode({"alg": "none"}), encode({"exp": expires_at}), "signature"]
+    )
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        server.requests.append(url)
+        if url.path == "/token":
+            server.tokens += 1
+            token = _make_token(time.time() + server.token_lifetime)
+            self._send(200, {"access_token": token})
+        elif server.statuses:
+            self._send(server.statuses.pop(0), {"message": "try again"})
+        else:
+            self._send(200, server.payload)
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.requests = []
+    server.tokens = 0
+    server.token_lifetime = 7200.
+    server.statuses = []
+    server.payload = {"data": []}
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": .05},
+        daemon=True,
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server, tmp_path):
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    with MeteomaticsClient(
+            "user", "password",
+            base_url=base_url,
+            token_url=f"{base_url}/token",
+            cache_directory=str(tmp_path / "cache")) as client:
+        yield client
+
+
+def _data_requests(server):
+    return [url for url in server.requests if url.path != "/token"]
+
+
+def test_token_is_reused_until_it_expires(server, client):
+    first = client.get_access_token()
+
+    assert client.get_access_token() == first
+    assert server.tokens == 1
+
+    # A token that expires within the margin is refreshed
+    server.token_lifetime = 30.
+    client.get_access_token(refresh=True)
+    client.get_access_token()
+    assert server.tokens == 3
+
+
+def test_requests_use_the_access_token(server, client):
+    client.query(["t_2m:C"], ["51.05,3.72"], datetime.now(tz=tz.UTC))
+    client.query(["t_2m:C"], ["51.05,3.72"], datetime.now(tz=tz.UTC))
+
+    assert server.tokens == 1
+    for url in _data_requests(server):
+        assert parse_qs(url.query)["access_token"] == [
+            client.get_access_token()
+        ]
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_failed_requests_are_retried(server, client, status):
+    server.statuses = [status]
+
+    payload = client.query(
+        ["t_2m:C"], ["51.05,3.72"], datetime.now(tz=tz.UTC)
+    )
+
+    assert payload == {"data": []}
+    assert len(_data_requests(server)) == 2
+
+
+def test_time_series_of_several_parameters_and_locations(server, client):
+    server.payload = {
+        "data": [
+            {
+                "parameter": parameter,
+                "coordinates": [
+                    {
+                        "lat": lat,
+                        "lon": lon,
+                        "dates": [
+                            {"date": "2024-01-01T00:00:00Z", "value": 1.},
+                            {"date": "2024-01-01T01:00:00Z", "value": 2.},
+                        ],
+                    }
+                    for lat, lon in [(51.05, 3.72), (50.85, 4.35)]
+                ],
+            }
+            for parameter in ["t_2m:C", "relative_humidity_2m:p"]
+        ]
+    }
+    start = datetime(2024, 1, 1)
+
+    rows = client.get_time_series(
+        ["t_2m:C", "relative_humidity_2m:p"],
+        ["51.05,3.72", "50.85,4.35"],
+        start,
+        start + timedelta(hours=1),
+    )
+
+    url, = _data_requests(server)
+    assert url.path == (
+        "/2024-01-01T00:00:00Z--2024-01-01T01:00:00Z:PT1H"
+        "/t_2m:C,relative_humidity_2m:p/51.05,3.72+50.85,4.35/json"
+    )
+    assert len(rows) == 8
+    assert rows[0] == (
+        "t_2m:C", 51.05, 3.72, datetime(2024, 1, 1, tzinfo=tz.UTC), 1.
+    )
+    assert rows[-1] == (
+        "relative_humidity_2m:p", 50.85, 4.35,
+        datetime(2024, 1, 1, 1, tzinfo=tz.UTC), 2.,
+    )
+
+
+def test_past_responses_are_served_from_the_cache(server, client):
+    start = datetime(2024, 1, 1)
+    end = start + timedelta(days=1)
+
+    first = client.query(["t_2m:C"], ["51.05,3.72"], start, end)
+    second = client.query(["t_2m:C"], ["51.05,3.72"], start, end)
+
+    assert first == second
+    assert len(_data_requests(server)) == 1
+
+
+def test_future_responses_are_not_cached(server, client):
+    start = datetime.now(tz=tz.UTC) + timedelta(hours=1)
+
+    client.query(["t_2m:C"], ["51.05,3.72"], start)
+    client.query(["t_2m:C"], ["51.05,3.72"], start)
+
+    assert len(_data_requests(server)) == 2
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from humipy.database.connect import get_engine
+from humipy.database.partitions import apply_retention
+from humipy.database.seed import SENSORS
+from humipy.database.write import push_measurements
+import gzip
+import os
+import pytest
+import sqlalchemy
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return get_engine(
+        True,
+        dev_database=str(tmp_path / "humipy.db"),
+        # The sensors are placed long before the measurements
+        seed_options={"n_measurements": 0, "span": timedelta(days=3650)},
+    )
+
+
+def _count_measurements(engine):
+    with engine.connect() as conn:
+        return conn.execute(
+            sqlalchemy.text("SELECT COUNT(*) FROM humidity_measurements")
+        ).scalar()
+
+
+def _push_old_measurements(engine, temperature=None):
+    start = datetime(2024, 1, 10)
+    push_measurements(
+        engine,
+        [
+            (SENSORS[0], 50. + i, start + timedelta(hours=i), temperature)
+            for i in range(5)
+        ],
+    )
+
+
+def test_apply_retention(engine):
+    _push_old_measurements(engine)
+
+    applied = apply_retention(engine, 1, now=datetime(2024, 3, 15))
+
+    assert applied == [
+        "removed the measurements from 2024-01-01 to 2024-02-01"
+    ]
+    assert _count_measurements(engine) == 0
+
+
+def test_apply_retention_keeps_values_that_are_not_rolled_up(
+        engine, tmp_path):
+    _push_old_measurements(engine, temperature=21.)
+
+    # The temperatures are only in the raw measurements
+    assert apply_retention(engine, 1, now=datetime(2024, 3, 15)) == []
+    assert _count_measurements(engine) == 5
+
+    applied = apply_retention(
+        engine, 1, archive_directory=str(tmp_path / "archive"),
+        now=datetime(2024, 3, 15),
+    )
+
+    assert len(applied) == 2
+    assert _count_measurements(engine) == 0
+    [archive] = os.listdir(tmp_path / "archive")
+    with gzip.open(tmp_path / "archive" / archive, "rt") as f:
+        assert len(f.read().splitlines()) == 6
@@ -0,0 +1,42 @@
+import asyncio
+from humipy.server import _read_line, parse_line
+import pytest
+
+
+def _read_lines(data, limit):
+    async def read():
+        reader = asyncio.StreamReader(limit=limit)
+        reader.feed_data(data)
+        reader.feed_eof()
+        lines = []
+        while True:
+            try:
+                line = await _read_line(reader)
+            except ValueError:
+                lines.append(None)
+                continue
+            if not line:
+                return lines
+            lines.append(line)
+
+    return asyncio.run(read())
+
+
+def test_read_line():
+    assert _read_lines(b"a 1\nb 2\nc 3", 16) == [b"a 1\n", b"b 2\n", b"c 3"]
+
+
+@pytest.mark.parametrize("length", [17, 40, 100])
+def test_read_line_drops_long_lines(length):
+    data = b"a 1\n" + b"x" * length + b"\nb 2\n"
+
+    # The tail of the long line is not read as another line
+    assert _read_lines(data, 16) == [b"a 1\n", None, b"b 2\n"]
+
+
+@pytest.mark.parametrize("value", ["nan", "inf", "-inf"])
+def test_parse_line_rejects_non_finite_values(value):
+    with pytest.raises(ValueError, match="not finite"):
+        parse_line(f"XIE-385A92H20-T0 {value}")
+    with pytest.raises(ValueError, match="not finite"):
+        parse_line(f"XIE-385A92H20-T0 61.5 temperature={value}")
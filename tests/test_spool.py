@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+from humipy.database.connect import get_engine
+from humipy.database.seed import SENSORS
+from humipy.spool import Spool
+import os
+import pytest
+import sqlalchemy
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return get_engine(
+        True,
+        dev_database=str(tmp_path / "humipy.db"),
+        seed_options={"n_measurements": 0},
+    )
+
+
+@pytest.fixture
+def unreachable_engine(tmp_path):
+    # SQLite cannot open a database in a directory that does not exist
+    return sqlalchemy.create_engine(
+        f"sqlite+pysqlite:///{tmp_path / 'missing' / 'humipy.db'}"
+    )
+
+
+def _readings(n, start=None):
+    start = start or datetime.now()
+    return [
+        (SENSORS[0], 50. + i % 10, start + timedelta(seconds=i))
+        for i in range(n)
+    ]
+
+
+def _count_measurements(engine):
+    with engine.connect() as conn:
+        return conn.execute(
+            sqlalchemy.text("SELECT COUNT(*) FROM humidity_measurements")
+        ).scalar()
+
+
+def test_append(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), segment_bytes=200)
+
+    assert spool.append(_readings(10)) == 10
+    assert spool.append([(SENSORS[0], 50., None)]) == 1
+
+    segments = sorted(
+        name for name in os.listdir(tmp_path / "spool")
+        if name.startswith("segment-")
+    )
+    assert len(segments) > 1
+    assert spool.pending_bytes == sum(
+        os.path.getsize(tmp_path / "spool" / name) for name in segments
+    )
+    # A second spool on the same directory sees the same readings
+    assert Spool(str(tmp_path / "spool")).pending_bytes == spool.pending_bytes
+
+
+def test_append_drops_readings_over_the_cap(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), max_bytes=500)
+
+    spooled = spool.append(_readings(100))
+
+    assert 0 < spooled < 100
+    assert spool.dropped == 100 - spooled
+    assert spool.pending_bytes <= 500
+    assert spool.append(_readings(1)) == 0
+
+
+def test_replay_after_outage(tmp_path, engine, unreachable_engine):
+    spool = Spool(str(tmp_path / "spool"))
+    spool.append(_readings(20))
+    before = _count_measurements(engine)
+
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        spool.replay(unreachable_engine)
+    assert spool.pending_bytes
+
+    summary = spool.replay(engine, batch_size=7)
+
+    assert summary["replayed"] == 20
+    assert summary["written"] == 20
+    assert summary["quarantined"] == 0
+    assert spool.pending_bytes == 0
+    assert _count_measurements(engine) == before + 20
+
+
+def test_replay_quarantines_a_corrupt_trailing_line(tmp_path, engine):
+    directory = tmp_path / "spool"
+    spool = Spool(str(directory))
+    spool.append(_readings(5))
+    segment, = [
+        name for name in os.listdir(directory) if name.startswith("segment-")
+    ]
+    with open(directory / segment, "ab") as f:
+        # A line that was being written during a power failure
+        f.write(b'["XIE-385A92H20-T0",51.')
+
+    summary = spool.replay(engine)
+
+    assert summary["written"] == 5
+    assert summary["corrupt"] == 1
+    assert summary["quarantined"] == 1
+    quarantine, = [
+        name for name in os.listdir(directory)
+        if name.startswith("quarantine-")
+    ]
+    assert (directory / quarantine).read_bytes() == (
+        b'["XIE-385A92H20-T0",51.\n'
+    )
+    assert spool.pending_bytes == 0
+
+
+def test_replay_quarantines_rejected_readings(tmp_path, engine):
+    spool = Spool(str(tmp_path / "spool"))
+    readings = _readings(5)
+    readings[2] = (SENSORS[0], "not a number", readings[2][2])
+    spool.append(readings)
+
+    summary = spool.replay(engine)
+
+    assert summary["written"] == 4
+    assert summary["quarantined"] == 1
+    assert spool.pending_bytes == 0
+
+
+def test_replay_skips_duplicates(tmp_path, engine):
+    spool = Spool(str(tmp_path / "spool"))
+    readings = _readings(10)
+    spool.append(readings)
+    assert spool.replay(engine)["written"] == 10
+    before = _count_measurements(engine)
+
+    # An interrupted replay resends readings that were written already
+    spool.append(readings)
+    summary = spool.replay(engine)
+
+    assert summary["replayed"] == 10
+    assert summary["written"] == 0
+    assert _count_measurements(engine) == before
@@ -0,0 +1,162 @@
+from datetime import datetime, timedelta
+from humipy.__main__ import format_humidity, get_command_line_arguments
+from humipy.database.connect import get_engine
+from humipy.database.seed import SENSORS
+from humipy.database.schema import upgrade
+from humipy.database.write import (
+    add_location,
+    add_sensor,
+    push_measurement,
+    push_measurements,
+    register_fleet,
+)
+import pytest
+import sqlalchemy
+import sys
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return get_engine(
+        True,
+        dev_database=str(tmp_path / "humipy.db"),
+        seed_options={"n_measurements": 0},
+    )
+
+
+def _count_measurements(engine):
+    with engine.connect() as conn:
+        return conn.execute(
+            sqlalchemy.text("SELECT COUNT(*) FROM humidity_measurements")
+        ).scalar()
+
+
+def test_push_measurement(engine):
+    measurement_time = datetime.now()
+
+    assert push_measurement(
+        engine, SENSORS[0], 55., temperature=21.5,
+        measurement_time=measurement_time,
+    )
+    # A retried push is skipped
+    assert not push_measurement(
+        engine, SENSORS[0], 55., measurement_time=measurement_time,
+    )
+    assert _count_measurements(engine) == 1
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), -float("inf")])
+def test_push_measurement_rejects_non_finite_values(engine, value):
+    with pytest.raises(ValueError, match="humidity"):
+        push_measurement(engine, SENSORS[0], value)
+    with pytest.raises(ValueError, match="temperature"):
+        push_measurement(engine, SENSORS[0], 55., temperature=value)
+    with pytest.raises(ValueError, match="pressure"):
+        push_measurement(engine, SENSORS[0], 55., pressure=value)
+    assert _count_measurements(engine) == 0
+
+
+def test_push_measurements_rejects_non_finite_values(engine):
+    start = datetime.now()
+    readings = [
+        (SENSORS[0], 50., start),
+        (SENSORS[0], float("nan"), start + timedelta(seconds=1)),
+    ]
+
+    # The batch is rejected as a whole
+    with pytest.raises(ValueError, match="not finite"):
+        push_measurements(engine, readings)
+    assert _count_measurements(engine) == 0
+    assert push_measurements(engine, readings[:1]) == 1
+
+
+@pytest.mark.parametrize("value", ["nan", "inf", "-inf"])
+def test_push_command_rejects_non_finite_values(monkeypatch, value):
+    for argv in [
+            ["push", SENSORS[0], value],
+            ["push", SENSORS[0], "55", "--temperature", value]]:
+        monkeypatch.setattr(sys, "argv", ["humipy", *argv])
+        with pytest.raises(SystemExit):
+            get_command_line_arguments()
+    monkeypatch.setattr(sys, "argv", ["humipy", "push", SENSORS[0], "55.5"])
+    assert get_command_line_arguments().value == 55.5
+
+
+def test_format_humidity():
+    assert format_humidity(55.04) == "55.0"
+    assert format_humidity(None) == "-"
+
+
+def _open_placements(engine, serial_number):
+    with engine.connect() as conn:
+        return conn.execute(
+            sqlalchemy.text(
+                "SELECT COUNT(*) FROM sensor_locations "
+                "JOIN sensors USING (sensor_id) "
+                "WHERE sensor_serial_number = :serial_number "
+                "AND stop_placement IS NULL"
+            ),
+            {"serial_number": serial_number},
+        ).scalar()
+
+
+def test_register_fleet_skips_open_placements(engine):
+    summary = register_fleet(
+        engine,
+        locations=["Attic", "Cellar"],
+        sensors=[("XIE-000000000-T0", None)],
+        placements=[
+            ("Attic", "XIE-000000000-T0", None),
+            ("Cellar", SENSORS[0], None),
+        ],
+    )
+
+    assert summary["placements"] == {
+        "created": [("Attic", "XIE-000000000-T0")],
+        "skipped": [("Cellar", SENSORS[0])],
+    }
+    assert _open_placements(engine, "XIE-000000000-T0") == 1
+    assert _open_placements(engine, SENSORS[0]) == 1
+
+
+def test_upgrade_makes_the_open_placements_unique(engine):
+    add_location(engine, "Attic")
+    add_sensor(engine, "XIE-000000000-T0")
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text("DROP INDEX ix_sensor_locations_open"))
+        conn.execute(
+            sqlalchemy.text(
+                "CREATE INDEX ix_sensor_locations_open "
+                "ON sensor_locations (sensor_id) "
+                "WHERE stop_placement IS NULL"
+            )
+        )
+        for start in ["2024-01-01", "2024-02-01"]:
+            conn.execute(
+                sqlalchemy.text(
+                    "INSERT INTO sensor_locations "
+                    "(sensor_id, location_id, start_placement) "
+                    "SELECT sensor_id, location_id, :start "
+                    "FROM sensors, locations "
+                    "WHERE sensor_serial_number = 'XIE-000000000-T0' "
+                    "AND location_name = 'Attic'"
+                ),
+                {"start": start},
+            )
+
+    applied = upgrade(engine)
+
+    assert "stopped 1 duplicate open sensor locations" in applied
+    assert "created index ix_sensor_locations_open" in applied
+    assert _open_placements(engine, "XIE-000000000-T0") == 1
+    assert upgrade(engine) == []
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        with engine.begin() as conn:
+            conn.execute(
+                sqlalchemy.text(
+                    "INSERT INTO sensor_locations "
+                    "(sensor_id, location_id, start_placement) "
+                    "SELECT sensor_id, location_id, '2024-03-01' "
+                    "FROM sensor_locations WHERE stop_placement IS NULL"
+                )
+            )